@@ -8,6 +8,10 @@ from alembic import context
 
 from pathlib import Path
 import os
+import sys
+
+# database.py imports its siblings (e.g. cache/) the way backend.py does, from src/
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
 
 from src.db.database import Base
 
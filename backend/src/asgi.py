@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import json
+import os
+from concurrent.futures import Future
+from typing import AsyncIterator
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.exc import NoResultFound
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from atr_logger import get_logger
+from auth import auth_context_from_header
+from backend import (
+    backend,
+    database_url,
+    parse_message_request,
+    provider,
+    query_builder,
+    title_sse_wait,
+    title_worker,
+)
+from db.async_database import (
+    db_append_user_message_async,
+    db_finish_turn_async,
+    db_start_chat_async,
+    dispose_async_engines,
+)
+
+"""
+asyncio-native serving mode: /api/message streams from an event loop, so one
+process can hold many concurrent chats; every other route is served by the
+Flask app in backend.py through a WSGI adapter.
+
+Run with: uvicorn asgi:app
+"""
+
+logger = get_logger()
+
+# The event loop only keeps weak references to tasks
+_finishing_turns: set[asyncio.Task] = set()
+
+
+async def send_message(request: Request) -> Response:
+    auth = await asyncio.to_thread(
+        auth_context_from_header, request.headers.get("Authorization", "")
+    )
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    try:
+        chat_uuid, messages = parse_message_request(data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    init_new_chat = chat_uuid is None
+
+    full_message = " ".join([message["content"] for message in messages])
+
+    latest_message = messages[-1]["content"]
+    logger.debug(f"Latest message: {latest_message}")
+
+    try:
+        if auth.logged_in:
+            if chat_uuid is None:
+                chat_uuid = await db_start_chat_async(
+                    database_url,
+                    full_message,
+                    auth.claims.iss,
+                    auth.claims.sub,
+                )
+
+            else:
+                try:
+                    await db_append_user_message_async(
+                        database_url,
+                        chat_uuid,
+                        auth.claims.iss,
+                        auth.claims.sub,
+                        latest_message,
+                    )
+
+                except PermissionError:
+                    logger.warning(
+                        f"User {auth.claims.sub} from {auth.claims.iss} attempted to access chat {chat_uuid}, which is a real chat, but not theirs"
+                    )
+                    return JSONResponse({"error": "Record not found"}, status_code=404)
+
+                except NoResultFound:
+                    return JSONResponse({"error": "Record not found"}, status_code=404)
+
+        # VDB clients are blocking, keep them off the event loop
+        contexts = await asyncio.to_thread(query_builder.get_nearest, 3, messages)
+        logger.debug(f"Received {len(contexts)} context(s)")
+
+    except Exception as e:
+        logger.error(f"Error in chat stream: {str(e)}")
+        return JSONResponse({"error": "Error reaching chatbot"}, status_code=500)
+
+    async def stream_and_store() -> AsyncIterator[str]:
+        if init_new_chat and auth.logged_in:
+            yield f"event: set_uuid\ndata: {json.dumps({'new_uuid': str(chat_uuid)})}\n\n"
+
+        chunks: list[str] = []
+        title_future: Future[str | None] | None = None
+
+        async def finish_turn(message_content: str) -> Future[str | None] | None:
+            await db_finish_turn_async(
+                database_url,
+                chat_uuid,
+                message_content,
+                title_pending=True if init_new_chat else None,
+            )
+
+            if init_new_chat:
+                return title_worker.submit(chat_uuid, latest_message, message_content)
+            return None
+
+        try:
+            async for event in provider.async_request(contexts, messages):
+                if event[0] == "new_chunk" and event[1] != "":
+                    chunks.append(event[1])
+                    yield f"event: {event[0]}\ndata: {json.dumps({'content': event[1]})}\n\n"
+                elif event[0] == "update_sources":
+                    yield f"event: {event[0]}\ndata: {event[1]}\n\n"
+
+        finally:
+            message_content = "".join(chunks)
+            logger.info(f"Received message: {message_content}")
+
+            # Only owners get here with a uuid; a logged out user may send any uuid
+            if auth.logged_in and chat_uuid is not None:
+                # A client disconnect cancels every await left in here, so the
+                # reply and its title job go in one shielded task that outlives it
+                task = asyncio.create_task(finish_turn(message_content))
+                _finishing_turns.add(task)
+                task.add_done_callback(_finishing_turns.discard)
+
+                title_future = await asyncio.shield(task)
+
+        if title_future is not None:
+            try:
+                new_chat_title = await asyncio.wait_for(
+                    asyncio.wrap_future(title_future), timeout=title_sse_wait
+                )
+                if new_chat_title is not None:
+                    yield f"event: set_title\ndata: {json.dumps({'title': new_chat_title})}\n\n"
+            except TimeoutError:
+                logger.debug(f"Title for chat {chat_uuid} not ready yet")
+            except Exception as e:
+                logger.error(f"Could not generate title for chat {chat_uuid}: {e}")
+
+    return StreamingResponse(
+        stream_and_store(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app: Starlette) -> AsyncIterator[None]:
+    yield
+    await dispose_async_engines()
+
+
+middleware = []
+
+# Mirrors USE_CORS in backend.py; preflights for the async route never reach flask
+if os.environ.get("USE_CORS", None) is not None:
+    middleware.append(
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+    )
+
+app = Starlette(
+    routes=[
+        Route("/api/message", send_message, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(backend)),
+    ],
+    middleware=middleware,
+    lifespan=lifespan,
+)
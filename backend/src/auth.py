@@ -1,12 +1,19 @@
+import hashlib
+import json
 import os
+import threading
+import time
 from functools import wraps
 
 from dotenv import load_dotenv
 import jwt
-from jwt import PyJWKClient
+import requests
+from jwt import PyJWK, PyJWKSet
+from jwt.exceptions import PyJWKClientError
 from flask import request, g
 
 from atr_logger import get_logger
+from cache.lru import LRUCache
 from models.auth_context import AuthContext, Claims
 
 load_dotenv()
@@ -20,56 +27,191 @@ SUPABASE_URL = SUPABASE_URL.rstrip("/")
 ISSUER = f"{SUPABASE_URL}/auth/v1"
 JWKS_URL = f"{ISSUER}/.well-known/jwks.json"
 
+# Either may point the key cache somewhere other than Supabase, e.g. a stub server
+# or a local JWKS file in tests
+JWKS_SOURCE = os.environ.get("SUPABASE_JWKS_FILE") or os.environ.get(
+    "SUPABASE_JWKS_URL", JWKS_URL
+)
+JWKS_TTL = float(os.environ.get("JWKS_TTL", "3600"))
+# Minimum seconds between refetches triggered by tokens with an unknown kid
+JWKS_MIN_REFETCH_INTERVAL = float(os.environ.get("JWKS_MIN_REFETCH_INTERVAL", "30"))
+
+VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get("VERIFIED_TOKEN_CACHE_SIZE", "1024"))
+
 logger = get_logger()
-jwks_client = PyJWKClient(JWKS_URL)
+
+
+class JWKSCache:
+    """Signing keys from a JWKS document, keyed by kid.
+    A background thread refreshes the keys every ttl / 2 seconds, so requests
+    only fetch synchronously before the first load or when a token
+    names a kid we haven't seen
+    """
+
+    def __init__(
+        self,
+        source: str,
+        ttl: float = 3600,
+        min_refetch_interval: float = 30,
+        timeout: float = 5,
+    ) -> None:
+        self.source = source
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys: dict[str, PyJWK] = {}
+        self._fetched_at: float | None = None
+        self._lock = threading.Lock()
+        self._refresher: threading.Thread | None = None
+
+    def _load(self) -> dict:
+        if self.source.startswith(("http://", "https://")):
+            response = requests.get(self.source, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+        with open(self.source, "r") as f:
+            return json.load(f)
+
+    def refresh(self, kid: str | None = None) -> None:
+        """Fetch the JWKS document and replace the cached keys.
+        Given the kid a request is missing, the fetch is skipped if another
+        thread loaded that kid or fetched within min_refetch_interval while
+        this one waited for the lock
+        """
+        with self._lock:
+            if kid is not None:
+                if kid in self._keys:
+                    return
+                fetched_at = self._fetched_at
+                if (
+                    fetched_at is not None
+                    and time.monotonic() - fetched_at < self.min_refetch_interval
+                ):
+                    return
+
+            jwk_set = PyJWKSet.from_dict(self._load())
+            self._keys = {
+                key.key_id: key for key in jwk_set.keys if key.key_id is not None
+            }
+            self._fetched_at = time.monotonic()
+
+        logger.debug(f"Loaded {len(self._keys)} signing key(s) from {self.source}")
+
+    def _refresh_loop(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the keys we already have
+                logger.warning(f"Could not refresh JWKS: {e}")
+
+            time.sleep(max(self.ttl / 2, 1))
+
+    def start(self) -> None:
+        """Start the background refresher, which also does the initial load"""
+        if self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="jwks-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        fetched_at = self._fetched_at
+        if (
+            fetched_at is None
+            or time.monotonic() - fetched_at >= self.min_refetch_interval
+        ):
+            self.refresh(kid)
+            key = self._keys.get(kid)
+
+        if key is None:
+            raise PyJWKClientError(f"Unable to find a signing key that matches: {kid}")
+
+        return key
+
+    def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid", ""))
+
+
+jwks_client = JWKSCache(
+    JWKS_SOURCE, ttl=JWKS_TTL, min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL
+)
+# Warm the keys in the background so a cold start doesn't block on Supabase
+jwks_client.start()
 
 logger.debug(f"jwks_client: {jwks_client}")
 
+# Claims of tokens that already passed verification, keyed by token hash
+verified_tokens: LRUCache[str, dict[str, str]] = LRUCache(VERIFIED_TOKEN_CACHE_SIZE)
+
 
 def verify_supabase_jwt(token: str) -> dict[str, str]:
     """
     Verify a Supabase access token and return its claims
     """
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+
+    claims = verified_tokens.get(token_hash)
+    if claims is not None:
+        return claims
+
     signing_key = jwks_client.get_signing_key_from_jwt(token)
-    return jwt.decode(
+    claims = jwt.decode(
         token,
         signing_key.key,
         algorithms=["ES256"],
         audience="authenticated",
         issuer=ISSUER,
+        options={"require": ["exp"]},
     )
 
+    # Cached claims never outlive the token
+    verified_tokens.set(token_hash, claims, expires_at=float(claims["exp"]))
 
-def auth_supabase_user(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        auth_header = request.headers.get("Authorization", "")
+    return claims
 
-        if not auth_header.startswith("Bearer "):
-            logger.info("No bearer token found")
-            g.auth = AuthContext(_protected_claims=None)
 
-        else:
-            token = auth_header.split(" ", 1)[1].strip()
+def auth_context_from_header(auth_header: str) -> AuthContext:
+    """
+    Build the AuthContext for a request from its Authorization header
+    """
+    if not auth_header.startswith("Bearer "):
+        logger.info("No bearer token found")
+        return AuthContext(_protected_claims=None)
 
-            try:
-                claims = verify_supabase_jwt(token)
-                # Make user info available to view functions
-                iss = claims.get("iss", None)
-                sub = claims.get("sub", None)
-
-                if iss is not None and sub is not None:
-                    g.auth = AuthContext(
-                        _protected_claims=Claims(
-                            iss=iss,
-                            sub=sub,
-                        )
-                    )
-                else:
-                    g.auth = AuthContext(_protected_claims=None)
+    token = auth_header.split(" ", 1)[1].strip()
 
-            except Exception as e:
-                logger.error(f"Failed to verify Supabase JWT: {e}")
+    try:
+        claims = verify_supabase_jwt(token)
+        # Make user info available to view functions
+        iss = claims.get("iss", None)
+        sub = claims.get("sub", None)
+
+        if iss is not None and sub is not None:
+            return AuthContext(
+                _protected_claims=Claims(
+                    iss=iss,
+                    sub=sub,
+                )
+            )
+
+    except Exception as e:
+        logger.error(f"Failed to verify Supabase JWT: {e}")
+
+    return AuthContext(_protected_claims=None)
+
+
+def auth_supabase_user(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.auth = auth_context_from_header(request.headers.get("Authorization", ""))
 
         return fn(*args, **kwargs)
 
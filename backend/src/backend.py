@@ -2,23 +2,28 @@ import json
 import logging
 import os
 import uuid
+from concurrent.futures import Future
+from typing import Iterator
 
 import jwt
 import requests
 from atr_logger import get_logger, set_log_level
 from auth import auth_supabase_user
 from db.database import (
+    DEFAULT_PAGE_SIZE,
     add_example_message_to_chat,
     add_test_user,
     create_example_chat,
-    db_create_chat,
-    db_create_message,
+    db_append_user_message,
     db_delete_chat,
-    db_get_all_chats,
-    db_get_all_messages,
-    db_get_chat,
-    db_get_or_create_user,
-    db_set_chat_title,
+    db_finish_turn,
+    db_get_chat_title,
+    db_get_messages_page,
+    db_list_chats,
+    db_remove_sessions,
+    db_start_chat,
+    db_stream_messages,
+    get_engine,
 )
 from dotenv import load_dotenv
 from flask import Flask, Response, g, jsonify, request, stream_with_context
@@ -26,9 +31,16 @@ from flask_cors import CORS
 from models.auth_context import AuthContext
 from providers.llama_server import Llama
 from providers.openrouter import OpenRouter
-from sqlalchemy.exc import IntegrityError, NoResultFound
+from query_builder import QueryBuilder
+from sqlalchemy.exc import IntegrityError, NoResultFound, SQLAlchemyError
+from title_worker import TitleWorker
 from vdb.amazons3vector import AmazonS3Vector
+from vdb.bm25 import BM25Index
+from vdb.embedding_cache import CachedEmbeddingVDB, EmbeddingCache
 from vdb.faiss import FaissIndex
+from vdb.hybrid import HybridVDB
+from vdb.rerank import CrossEncoderReranker, RerankingVDB
+from vdb.semantic_cache import SemanticCacheVDB
 
 backend = Flask(__name__)
 
@@ -80,8 +92,69 @@ vector_db = (
     else FaissIndex()
 )
 
+# Set EMBEDDING_CACHE_SIZE=0 to embed every query
+embedding_cache_size = int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024"))
+if embedding_cache_size > 0:
+    vector_db = CachedEmbeddingVDB(
+        vector_db,
+        EmbeddingCache(
+            maxsize=embedding_cache_size,
+            ttl=float(os.environ.get("EMBEDDING_CACHE_TTL", "86400")),
+            disk_path=os.environ.get("EMBEDDING_CACHE_PATH"),
+            disk_maxsize=int(os.environ.get("EMBEDDING_CACHE_DISK_SIZE", "100000")),
+        ),
+    )
+
+# Set SEMANTIC_CACHE_SIZE=0 to always search the VDB
+semantic_cache_size = int(os.environ.get("SEMANTIC_CACHE_SIZE", "256"))
+if semantic_cache_size > 0:
+    vector_db = SemanticCacheVDB(
+        vector_db,
+        maxsize=semantic_cache_size,
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", "3600")),
+    )
+
+# A BM25 index built from the same chunks as the VDB, see vdb/bm25.py.
+# Wraps the caches, since BM25 needs the query text rather than its embedding
+bm25_index_path = os.environ.get("BM25_INDEX_PATH")
+if bm25_index_path:
+    vector_db = HybridVDB(
+        vector_db,
+        BM25Index.load(bm25_index_path),
+        fetch_k=int(os.environ.get("HYBRID_FETCH_K", "10")),
+        rrf_k=int(os.environ.get("RRF_K", "60")),
+    )
+
+# Over-fetch and let a cross-encoder pick the contexts, see vdb/rerank.py
+rerank_model_dir = os.environ.get("RERANK_MODEL_DIR")
+if rerank_model_dir:
+    rerank_threads = os.environ.get("RERANK_THREADS")
+    vector_db = RerankingVDB(
+        vector_db,
+        CrossEncoderReranker(
+            rerank_model_dir,
+            max_length=int(os.environ.get("RERANK_MAX_LENGTH", "256")),
+            threads=int(rerank_threads) if rerank_threads else None,
+        ),
+        candidates=int(os.environ.get("RERANK_CANDIDATES", "30")),
+        token_budget=int(os.environ.get("RERANK_TOKEN_BUDGET", "1500")),
+    )
+
+# Retrieval sees the latest user turns rather than the whole transcript
+query_builder = QueryBuilder(
+    vector_db,
+    max_turns=int(os.environ.get("QUERY_MAX_TURNS", "3")),
+    max_tokens=int(os.environ.get("QUERY_MAX_TOKENS", "256")),
+    latest_weight=float(os.environ.get("QUERY_LATEST_WEIGHT", "0.7")),
+    cache_size=int(os.environ.get("QUERY_CACHE_SIZE", "1024")),
+)
+
 database_url = os.environ.get("DATABASE_URL", "sqlite+pysqlite:///example.db")
 
+# Build the shared connection pool up front so the first request doesn't pay for it
+get_engine(database_url)
+
 logger.info(f"VDB provider read as: {vdb_provider}")
 logger.info(f"Created vector db interface of type {type(vector_db)}")
 
@@ -110,6 +183,27 @@ elif completion_provider == "OpenRouter":
 else:
     raise ValueError("Specified completion provider is not supported")
 
+title_worker = TitleWorker(
+    provider,
+    database_url,
+    max_workers=int(os.environ.get("TITLE_WORKERS", "2")),
+    retries=int(os.environ.get("TITLE_RETRIES", "3")),
+    claim_lease=float(os.environ.get("TITLE_CLAIM_LEASE", "600")),
+)
+# Titles queued before the last shutdown; every worker queues them, and the
+# first to claim each one generates it
+try:
+    title_worker.resume_pending()
+except SQLAlchemyError as e:
+    logger.error(f"Could not resume pending chat titles: {e}")
+# How long an open stream waits for the title before leaving it to polling
+title_sse_wait = float(os.environ.get("TITLE_SSE_WAIT", "2"))
+
+
+@backend.teardown_appcontext
+def release_db_sessions(_exc):
+    db_remove_sessions()
+
 
 # TODO - Remove this when testing is done!
 test_user_email = "test_email@example.com"
@@ -176,18 +270,36 @@ def get_chat_history():
     # for k, v in vars(ctx).items():
     # logger.debug("%s: %r", k, v)
 
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    cursor = request.args.get("cursor")
+
+    if not auth.logged_in:
+        return jsonify({"chats": [], "next_cursor": None})
+
     try:
-        if auth.logged_in:
-            chats = db_get_all_chats(
-                db_url=database_url, issuer=auth.claims.iss, sub=auth.claims.sub
-            )
-        else:
-            chats = []
+        chats, next_cursor = db_list_chats(
+            db_url=database_url,
+            issuer=auth.claims.iss,
+            sub=auth.claims.sub,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError:
+        return jsonify({"error": "Could not parse the cursor"}), 400
 
-        return jsonify({"chats": chats})
+    return jsonify({"chats": chats, "next_cursor": next_cursor})
 
-    except NoResultFound:
-        return jsonify({"chats": []})
+
+def stream_json_messages(messages: Iterator[dict]) -> Iterator[str]:
+    """Write {"messages": [...]} one message at a time, so memory use
+    doesn't grow with the length of the transcript
+    """
+    yield '{"messages": ['
+
+    for i, message in enumerate(messages):
+        yield ("," if i > 0 else "") + json.dumps(message)
+
+    yield "]}"
 
 
 @backend.route("/api/chat/<uuid:chat_id>", methods=["GET"])
@@ -195,19 +307,35 @@ def get_chat_history():
 def get_chat_messages(chat_id):
     auth: AuthContext = g.auth
 
+    # Without a limit the whole transcript is returned, as the frontend expects
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after", type=int)
+
     if auth.logged_in:
         try:
-            messages = db_get_all_messages(
+            if limit is None:
+                messages = db_stream_messages(
+                    db_url=database_url,
+                    chat_id=chat_id,
+                    issuer=auth.claims.iss,
+                    sub=auth.claims.sub,
+                )
+
+                return Response(
+                    stream_with_context(stream_json_messages(messages)),
+                    mimetype="application/json",
+                )
+
+            messages, next_cursor = db_get_messages_page(
                 db_url=database_url,
                 chat_id=chat_id,
                 issuer=auth.claims.iss,
                 sub=auth.claims.sub,
+                limit=limit,
+                after=after,
             )
 
-            for message in messages:
-                print(f"Message: {message}")
-
-            return jsonify({"messages": messages})
+            return jsonify({"messages": messages, "next_cursor": next_cursor})
 
         except PermissionError:
             logger.info(
@@ -221,6 +349,29 @@ def get_chat_messages(chat_id):
     return jsonify({"error": "Only logged in users can retrieve stored chats"}), 404
 
 
+@backend.route("/api/chat/<uuid:chat_id>/title", methods=["GET"])
+@auth_supabase_user
+def get_chat_title(chat_id):
+    auth: AuthContext = g.auth
+
+    if not auth.logged_in:
+        return jsonify({"error": "Only logged in users can retrieve stored chats"}), 404
+
+    try:
+        title, pending = db_get_chat_title(
+            database_url, chat_id, issuer=auth.claims.iss, sub=auth.claims.sub
+        )
+    except PermissionError:
+        logger.info(
+            f"User {auth.claims.sub} from {auth.claims.iss} attempted to access chat {chat_id} but is NOT the owner of that chat"
+        )
+        return jsonify({"error": "Could not locate the specified record"}), 404
+    except NoResultFound:
+        return jsonify({"error": "Could not locate the specified record"}), 404
+
+    return jsonify({"title": title, "pending": pending})
+
+
 @backend.route("/api/chat", methods=["DELETE"])
 @auth_supabase_user
 def delete_chat():
@@ -263,41 +414,46 @@ def delete_chat():
     return "ok", 200
 
 
-@backend.route("/api/message", methods=["POST"])
-@auth_supabase_user
-def send_message():
-    data = request.get_json()
-    auth: AuthContext = g.auth
-
+def parse_message_request(data: dict | None) -> tuple[uuid.UUID | None, list]:
+    """Validate the body of a /api/message request
+    Returns: the chat uuid (None for a new chat), and the messages
+    Raises:
+        ValueError: With a message for the client if the body is invalid
+    """
     if data is None or "messages" not in data.keys():
-        return jsonify({"error": "No user prompt received"}), 400
+        raise ValueError("No user prompt received")
 
     raw_uuid: str | None = data.get("uuid")
 
     if raw_uuid is None:
-        return jsonify(
-            {
-                "error": "uuid field not received in request (new chats should report uuid as the string 'None')"
-            }
-        ), 400
+        raise ValueError(
+            "uuid field not received in request (new chats should report uuid as the string 'None')"
+        )
 
     try:
-        if raw_uuid == "None":
-            chat_uuid: uuid.UUID | None = None
-            init_new_chat: bool = True
-        else:
-            chat_uuid = uuid.UUID(raw_uuid)
-            init_new_chat = False
-
+        chat_uuid = None if raw_uuid == "None" else uuid.UUID(raw_uuid)
     except ValueError:
-        return jsonify({"error": "Could not parse the uuid field correctly"}), 400
-
-    if auth.logged_in:
-        db_get_or_create_user(database_url, issuer=auth.claims.iss, sub=auth.claims.sub)
+        raise ValueError("Could not parse the uuid field correctly")
 
     messages = data.get("messages")
     if not isinstance(messages, list) or len(messages) < 1:
-        return jsonify({"error": "messages must be a non-empty list"}), 400
+        raise ValueError("messages must be a non-empty list")
+
+    return chat_uuid, messages
+
+
+@backend.route("/api/message", methods=["POST"])
+@auth_supabase_user
+def send_message():
+    data = request.get_json()
+    auth: AuthContext = g.auth
+
+    try:
+        chat_uuid, messages = parse_message_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    init_new_chat = chat_uuid is None
 
     full_message = " ".join([message["content"] for message in messages])
 
@@ -313,30 +469,26 @@ def send_message():
                 logger.debug(
                     "Received post request with no chat_uuid, creating new one"
                 )
-                chat = db_create_chat(
+                chat_uuid = db_start_chat(
                     database_url,
                     full_message,
                     auth.claims.iss,
                     auth.claims.sub,
                 )
-                if chat is None:
-                    return jsonify({"error": "Failed to save user chat"}), 500
-
-                chat_uuid = chat.id
 
-            # Double check to make sure this is an existing chat
+            # The insert only succeeds if this is an existing chat owned by the user
             else:
                 logger.debug(
                     f"Received post request with uuid {chat_uuid}, verifying access"
                 )
                 try:
-                    chat = db_get_chat(
+                    db_append_user_message(
                         database_url,
                         chat_uuid,
                         auth.claims.iss,
                         auth.claims.sub,
+                        latest_message,
                     )
-                    chat_uuid = chat.id
 
                 except PermissionError:
                     logger.warning(
@@ -347,14 +499,7 @@ def send_message():
                 except NoResultFound:
                     return jsonify({"error": "Record not found"}), 404
 
-                db_create_message(
-                    database_url,
-                    "user",
-                    latest_message,
-                    chat_uuid,
-                )
-
-        contexts = vector_db.get_nearest(3, full_message)
+        contexts = query_builder.get_nearest(3, messages)
         logger.debug(f"Received {len(contexts)} context(s)")
 
         logger.debug("Querying provider")
@@ -364,6 +509,7 @@ def send_message():
                 yield f"event: set_uuid\ndata: {json.dumps({'new_uuid': str(chat_uuid)})}\n\n"
 
             chunks: list[str] = []
+            title_future: Future[str | None] | None = None
 
             try:
                 for event in provider.request(contexts, data["messages"]):
@@ -376,27 +522,32 @@ def send_message():
             finally:
                 message_content = "".join(chunks)
                 logger.info(f"Received message: {message_content}")
-                if chat_uuid is not None:
-                    db_create_message(
+
+                # Only owners get here with a uuid; a logged out user may send any uuid
+                if auth.logged_in and chat_uuid is not None:
+                    db_finish_turn(
                         database_url,
-                        "assistant",
-                        message_content,
                         chat_uuid,
+                        message_content,
+                        title_pending=True if init_new_chat else None,
                     )
 
-                if init_new_chat:
-                    new_chat_title = provider.get_chat_title(
-                        latest_message, message_content
-                    )
-
-                    if len(new_chat_title) >= 127:
-                        new_chat_title = f"{new_chat_title[0:125]}..."
+                    if init_new_chat:
+                        title_future = title_worker.submit(
+                            chat_uuid, latest_message, message_content
+                        )
 
-                    logger.debug(f"Picked title {new_chat_title}")
-
-                    if chat_uuid is not None:
-                        # Should only happen when user is not none
-                        db_set_chat_title(database_url, chat_uuid, new_chat_title)
+            # Only reached if the client is still connected; otherwise the
+            # client picks the title up from /api/chat/<uuid>/title
+            if title_future is not None:
+                try:
+                    new_chat_title = title_future.result(timeout=title_sse_wait)
+                    if new_chat_title is not None:
+                        yield f"event: set_title\ndata: {json.dumps({'title': new_chat_title})}\n\n"
+                except TimeoutError:
+                    logger.debug(f"Title for chat {chat_uuid} not ready yet")
+                except Exception as e:
+                    logger.error(f"Could not generate title for chat {chat_uuid}: {e}")
 
         return Response(
             stream_with_context(stream_and_store()),
@@ -0,0 +1,113 @@
+"""
+Added latency and context precision of cross-encoder re-ranking.
+
+Run from backend/src against a JSONL file of labelled retrieval results,
+one object per line with the candidates in retrieval order:
+
+    {"query": "...", "candidates": [{"text": "...", "url": "...", "relevant": true}, ...]}
+
+    python -m benchmarks.bench_rerank eval.jsonl --model-dir ./cross-encoder
+
+For each candidate count it reports the precision of the top-n contexts
+sent to the model, with and without re-ranking, and the latency re-ranking
+adds per query.
+"""
+
+import argparse
+import json
+import time
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from models.chunk import Chunk
+from models.context import Context
+from vdb.rerank import CrossEncoderReranker, RerankingVDB
+from vdb.vdb import VDB
+
+
+class CandidateList(VDB):
+    """Serves pre-retrieved candidates, so only re-ranking is timed"""
+
+    def __init__(self, candidates: Sequence[Context]) -> None:
+        self.candidates = list(candidates)
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.candidates[:k]
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        raise NotImplementedError
+
+
+def read_eval_set(filename: str) -> Iterable[tuple[str, list[Context], set[Context]]]:
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            candidates = [
+                Context(c["text"], c.get("url") or "") for c in item["candidates"]
+            ]
+            relevant = {
+                context
+                for context, c in zip(candidates, item["candidates"])
+                if c.get("relevant")
+            }
+            yield item["query"], candidates, relevant
+
+
+def precision(contexts: Sequence[Context], relevant: set[Context]) -> float:
+    if not contexts:
+        return 0.0
+    return sum(context in relevant for context in contexts) / len(contexts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-encoder re-ranking benchmark")
+    parser.add_argument("eval_set", help="JSONL file of labelled candidates")
+    parser.add_argument("--model-dir", required=True)
+    parser.add_argument("-n", type=int, default=3, help="Contexts sent to the model")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20, 30])
+    parser.add_argument("--token-budget", type=int, default=1500)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--threads", type=int)
+    args = parser.parse_args()
+
+    reranker = CrossEncoderReranker(
+        args.model_dir, max_length=args.max_length, threads=args.threads
+    )
+    eval_set = list(read_eval_set(args.eval_set))
+    print(f"{len(eval_set)} queries, n={args.n}, token budget {args.token_budget}")
+
+    # Warm up the session so the first query doesn't skew the latencies
+    query, candidates, _ = eval_set[0]
+    reranker.score(query, [c.content for c in candidates])
+
+    for count in args.candidates:
+        baseline, reranked, latencies = [], [], []
+
+        for query, candidates, relevant in eval_set:
+            vdb = RerankingVDB(
+                CandidateList(candidates[:count]),
+                reranker,
+                candidates=count,
+                token_budget=args.token_budget,
+            )
+
+            start = time.perf_counter()
+            contexts = vdb.get_nearest(args.n, query)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+            baseline.append(precision(candidates[: args.n], relevant))
+            reranked.append(precision(contexts, relevant))
+
+        print(
+            f"candidates={count:<4} "
+            f"precision@{args.n} {np.mean(baseline):.3f} -> {np.mean(reranked):.3f}  "
+            f"added latency p50 {np.percentile(latencies, 50):.1f} ms "
+            f"p95 {np.percentile(latencies, 95):.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
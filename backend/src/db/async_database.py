@@ -0,0 +1,148 @@
+import threading
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from db.database import (
+    ECHO_SQL,
+    MAX_OVERFLOW,
+    POOL_PRE_PING,
+    POOL_RECYCLE,
+    POOL_SIZE,
+    Chat,
+    append_user_message_stmt,
+    assistant_message_stmt,
+    new_chat_stmts,
+    touch_chat_stmt,
+    user_upsert_stmt,
+)
+
+"""
+Async versions of the chat-turn queries in database.py, for the ASGI app.
+Statements are shared with database.py so both paths write the same rows
+"""
+
+# Async drivers for the sync URLs DATABASE_URL is written with
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+psycopg",
+    "postgresql+psycopg": "postgresql+psycopg",
+    "postgresql+psycopg2": "postgresql+psycopg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+_async_engines: dict[str, AsyncEngine] = {}
+_async_session_factories: dict[str, async_sessionmaker[AsyncSession]] = {}
+_async_engine_lock = threading.Lock()
+
+
+def to_async_url(db_url: str) -> str:
+    """Swap the driver of a sync database URL for its async equivalent"""
+    url = make_url(db_url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def get_async_session_factory(db_url: str) -> async_sessionmaker[AsyncSession]:
+    """Return the process-wide async session factory for db_url (the sync URL),
+    creating its engine on first use
+    """
+    factory = _async_session_factories.get(db_url)
+    if factory is not None:
+        return factory
+
+    with _async_engine_lock:
+        factory = _async_session_factories.get(db_url)
+        if factory is None:
+            async_url = to_async_url(db_url)
+            kwargs: dict = {
+                "echo": ECHO_SQL,
+                "pool_pre_ping": POOL_PRE_PING,
+                "pool_recycle": POOL_RECYCLE,
+            }
+
+            if make_url(async_url).database not in (None, "", ":memory:"):
+                kwargs["pool_size"] = POOL_SIZE
+                kwargs["max_overflow"] = MAX_OVERFLOW
+
+            engine = create_async_engine(async_url, **kwargs)
+            _async_engines[db_url] = engine
+
+            factory = async_sessionmaker(engine)
+            _async_session_factories[db_url] = factory
+
+        return factory
+
+
+async def db_start_chat_async(
+    db_url: str, initial_message: str, issuer: str, sub: str
+) -> uuid.UUID:
+    """See db_start_chat"""
+    chat_id = uuid.uuid4()
+
+    async with get_async_session_factory(db_url)() as session:
+        await session.execute(
+            user_upsert_stmt(session.get_bind().dialect.name, issuer, sub)
+        )
+
+        for stmt in new_chat_stmts(chat_id, initial_message, issuer, sub):
+            await session.execute(stmt)
+
+        await session.commit()
+
+    return chat_id
+
+
+async def db_append_user_message_async(
+    db_url: str, chat_id: uuid.UUID, issuer: str, sub: str, contents: str
+) -> None:
+    """See db_append_user_message
+    Raises:
+        PermissionError: If the chat exists but is not owned by the user
+        NoResultFound: If no chat with the given id exists
+    """
+    async with get_async_session_factory(db_url)() as session:
+        result = await session.execute(
+            append_user_message_stmt(chat_id, issuer, sub, contents)
+        )
+
+        if result.rowcount == 1:
+            await session.execute(touch_chat_stmt(chat_id))
+            await session.commit()
+            return
+
+        await session.rollback()
+
+        if (await session.execute(select(Chat.id).where(Chat.id == chat_id))).first():
+            raise PermissionError("User is not the owner of the specified chat")
+
+        raise NoResultFound("No chat with the specified id")
+
+
+async def db_finish_turn_async(
+    db_url: str,
+    chat_id: uuid.UUID,
+    contents: str,
+    chat_title: str | None = None,
+    title_pending: bool | None = None,
+) -> None:
+    """See db_finish_turn"""
+    async with get_async_session_factory(db_url)() as session:
+        await session.execute(assistant_message_stmt(chat_id, contents))
+        await session.execute(touch_chat_stmt(chat_id, chat_title, title_pending))
+
+        await session.commit()
+
+
+async def dispose_async_engines() -> None:
+    """Close every pooled async connection; call on shutdown"""
+    for engine in list(_async_engines.values()):
+        await engine.dispose()
@@ -1,16 +1,35 @@
+import base64
+from datetime import datetime, timedelta, timezone
+import os
 import re
-from typing import List
+import threading
+from typing import Iterator, List
 import uuid
 from flask import jsonify
 from sqlalchemy import (
+    Boolean,
+    DateTime,
+    Engine,
     ForeignKey,
     ForeignKeyConstraint,
+    Index,
     String,
     Text,
     Uuid,
     create_engine,
+    false,
+    insert,
+    literal,
+    or_,
     select,
+    text,
+    tuple_,
+    update,
 )
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Executable
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -19,12 +38,27 @@ from sqlalchemy.orm import (
     Session,
     mapped_column,
     relationship,
-    selectinload,
+    scoped_session,
+    sessionmaker,
 )
 
 
 ECHO_SQL: bool = False
 
+# Connection pool settings, shared by every engine created in this process
+POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW: int = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+POOL_PRE_PING: bool = os.environ.get("DB_POOL_PRE_PING", "true").lower() != "false"
+# Seconds before a pooled connection is replaced; -1 disables recycling
+POOL_RECYCLE: int = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
+_engines: dict[str, Engine] = {}
+_session_factories: dict[str, scoped_session[Session]] = {}
+_engine_lock = threading.Lock()
+
+DEFAULT_PAGE_SIZE: int = 50
+MAX_PAGE_SIZE: int = 200
+
 example_issuer = "https://localhost/testing"
 example_sub = "superduper"
 
@@ -33,6 +67,67 @@ This modules assumes that issuer/sub have been verified by the calling function
 """
 
 
+def get_engine(db_url: str) -> Engine:
+    """Return the process-wide engine for db_url, creating it on first use.
+    Every caller shares the same connection pool, so warm connections
+    survive between requests (and between Lambda invocations)
+    """
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
+
+    with _engine_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            kwargs: dict = {
+                "echo": ECHO_SQL,
+                "pool_pre_ping": POOL_PRE_PING,
+                "pool_recycle": POOL_RECYCLE,
+            }
+
+            # In-memory sqlite uses a singleton pool that has no size to configure
+            if make_url(db_url).database not in (None, "", ":memory:"):
+                kwargs["pool_size"] = POOL_SIZE
+                kwargs["max_overflow"] = MAX_OVERFLOW
+
+            engine = create_engine(db_url, **kwargs)
+            _engines[db_url] = engine
+
+        return engine
+
+
+def get_session_factory(db_url: str) -> scoped_session[Session]:
+    """Return the thread-scoped session factory bound to the shared engine for db_url.
+    Calling the factory returns the current thread's session; call
+    db_remove_sessions at the end of a request to release it
+    """
+    factory = _session_factories.get(db_url)
+    if factory is not None:
+        return factory
+
+    engine = get_engine(db_url)
+
+    with _engine_lock:
+        factory = _session_factories.get(db_url)
+        if factory is None:
+            factory = scoped_session(sessionmaker(bind=engine))
+            _session_factories[db_url] = factory
+
+        return factory
+
+
+def db_remove_sessions() -> None:
+    """Close and discard the current thread's sessions, returning their
+    connections to the pool
+    """
+    for factory in list(_session_factories.values()):
+        factory.remove()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Base(DeclarativeBase, MappedAsDataclass):
     pass
 
@@ -71,9 +166,29 @@ class Chat(Base):
 
     title: Mapped[str] = mapped_column(String(255))
 
+    # Set with the first reply and cleared once a title is stored, so title
+    # jobs lost in a restart can be queued again
+    title_pending: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default=false(), init=False
+    )
+    # When a title worker last started on the pending title; see
+    # db_claim_chat_title
+    title_claimed_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), default=None, init=False
+    )
+
+    # Set from python rather than the server so sqlite stores a comparable format
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default_factory=_utcnow,
+        server_default=text("CURRENT_TIMESTAMP"),
+        init=False,
+    )
+
     # Apparently there is no ORM only version of this?
     __table_args__ = (
         ForeignKeyConstraint(["user_issuer", "user_sub"], ["user.issuer", "user.sub"]),
+        Index("ix_chat_user_updated_at", "user_issuer", "user_sub", "updated_at"),
     )
 
     messages: Mapped[List["Message"]] = relationship(
@@ -100,187 +215,421 @@ class Message(Base):
         return f"Chat(id={self.id!r}, chat={self.chat!r}, chat_id={self.chat_id!r}, contents={self.contents!r})"
 
 
-def db_get_all_chats(db_url: str, issuer: str, sub: str) -> list[dict]:
-    """Return all chats associated with the given user email.
+def _encode_chat_cursor(updated_at: datetime, chat_id: uuid.UUID) -> str:
+    raw = f"{updated_at.isoformat()}|{chat_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_chat_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """Raises: ValueError if the cursor is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, chat_id = raw.split("|", 1)
+        return datetime.fromisoformat(updated_at), uuid.UUID(chat_id)
+    except ValueError as e:
+        raise ValueError("Malformed chat cursor") from e
+
 
+def _clamp_page_size(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def db_list_chats(
+    db_url: str,
+    issuer: str,
+    sub: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+) -> tuple[list[dict], str | None]:
+    """Return one page of the user's chats, most recently active first.
+    Only the columns the chat list needs are loaded; messages come from
+    db_get_messages_page.
+    Returns: the page, and the cursor for the next page (None on the last page)
     Raises:
-        NoResultFound: User with the given email does not exist.
+        ValueError: If the cursor is malformed
     """
-    engine = create_engine(db_url, echo=ECHO_SQL)
+    limit = _clamp_page_size(limit)
 
-    with Session(engine) as session:
-        user = session.execute(
-            select(User).where(User.issuer == issuer, User.sub == sub)
-        ).scalar_one()
+    stmt = (
+        select(Chat.id, Chat.title, Chat.updated_at)
+        .where(Chat.user_issuer == issuer, Chat.user_sub == sub)
+        .order_by(Chat.updated_at.desc(), Chat.id.desc())
+        .limit(limit + 1)
+    )
+
+    if cursor is not None:
+        updated_at, chat_id = _decode_chat_cursor(cursor)
+        stmt = stmt.where(tuple_(Chat.updated_at, Chat.id) < tuple_(updated_at, chat_id))
+
+    with get_session_factory(db_url)() as session:
+        rows = session.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_chat_cursor(rows[-1].updated_at, rows[-1].id)
+
+    chats = [
+        {
+            "id": str(row.id),
+            "title": str(row.title),
+            "updated_at": row.updated_at.isoformat(),
+        }
+        for row in rows
+    ]
+
+    return chats, next_cursor
+
+
+def db_stream_messages(
+    db_url: str,
+    chat_id: uuid.UUID,
+    issuer: str,
+    sub: str,
+    batch_size: int = 100,
+) -> Iterator[dict]:
+    """
+    Check ownership of the specified chat, then return an iterator over its
+    messages that fetches batch_size rows at a time from a server-side cursor.
+    The session stays open until the iterator is exhausted or closed.
+    Raises:
+        NoResultFound: Chat with the given UUID does not exist
+        PermissionError: The chat is not owned by the user
+    """
+    # Not the scoped session: other calls on this thread must not close it mid-stream
+    session = get_session_factory(db_url).session_factory()
+
+    try:
+        owner = session.execute(
+            select(Chat.user_issuer, Chat.user_sub).where(Chat.id == chat_id)
+        ).one()
+
+        if owner.user_issuer != issuer or owner.user_sub != sub:
+            raise PermissionError("User not authorized to access this chat")
 
-        chats = (
-            session.execute(
-                select(Chat)
-                .where(Chat.user == user)
-                .options(selectinload(Chat.user), selectinload(Chat.messages))
+    except Exception:
+        session.close()
+        raise
+
+    def generate() -> Iterator[dict]:
+        try:
+            rows = session.execute(
+                select(Message.role, Message.contents)
+                .where(Message.chat_id == chat_id)
+                .order_by(Message.id)
+                .execution_options(yield_per=batch_size)
             )
-            .scalars()
-            .all()
-        )
 
-        result = [
-            {
-                "id": str(chat.id),
-                "user_prompt": str(chat.user.user_prompt),
-                "title": str(chat.title),
-                "messages": [
-                    {"id": msg.id, "role": msg.role, "contents": msg.contents}
-                    for msg in chat.messages
-                ],
-            }
-            for chat in chats
-        ]
+            for row in rows:
+                yield {"sender": row.role, "text": row.contents}
 
-        return result
+        finally:
+            session.close()
 
+    return generate()
 
-def db_get_all_messages(
+
+def db_get_chat_title(
     db_url: str, chat_id: uuid.UUID, issuer: str, sub: str
-) -> list[dict]:
+) -> tuple[str, bool]:
+    """Get the title of a chat owned by the user
+    Returns: the title, and whether a better one is still being generated
+    Raises:
+        NoResultFound: Chat with the given UUID does not exist
+        PermissionError: The chat is not owned by the user
     """
-    Get all chat messages associated with the specified chat
+    with get_session_factory(db_url)() as session:
+        chat = session.execute(
+            select(
+                Chat.title, Chat.title_pending, Chat.user_issuer, Chat.user_sub
+            ).where(Chat.id == chat_id)
+        ).one()
+
+    if chat.user_issuer != issuer or chat.user_sub != sub:
+        raise PermissionError("User not authorized to access this chat")
+
+    return chat.title, chat.title_pending
+
+
+def db_get_messages_page(
+    db_url: str,
+    chat_id: uuid.UUID,
+    issuer: str,
+    sub: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: int | None = None,
+) -> tuple[list[dict], int | None]:
+    """
+    Get up to limit messages from the specified chat with ids greater than after
+    Returns: the page, and the cursor for the next page (None on the last page)
     Raises:
-        NoResultFound: Chat with the given UUID does not exist, or
-        user with the given email address does not exist
+        NoResultFound: Chat with the given UUID does not exist
+        PermissionError: The chat is not owned by the user
     """
-    engine = create_engine(db_url, echo=ECHO_SQL)
+    limit = _clamp_page_size(limit)
 
-    with Session(engine) as session:
-        user = session.execute(
-            select(User).where(User.issuer == issuer, User.sub == sub)
-        ).scalar_one()
-
-        chat = session.execute(select(Chat).where(Chat.id == chat_id)).scalar_one()
+    with get_session_factory(db_url)() as session:
+        owner = session.execute(
+            select(Chat.user_issuer, Chat.user_sub).where(Chat.id == chat_id)
+        ).one()
 
-        if chat.user != user:
+        if owner.user_issuer != issuer or owner.user_sub != sub:
             raise PermissionError("User not authorized to access this chat")
 
-        messages = (
-            session.execute(
-                select(Message).where(Message.chat_id == chat_id).order_by(Message.id)
-            )
-            .scalars()
-            .all()
+        stmt = (
+            select(Message.id, Message.role, Message.contents)
+            .where(Message.chat_id == chat_id)
+            .order_by(Message.id)
+            .limit(limit + 1)
         )
 
-        messages = [
-            {
-                "sender": message.role,
-                "text": message.contents,
-            }
-            for message in messages
-        ]
+        if after is not None:
+            stmt = stmt.where(Message.id > after)
 
-        return messages
+        rows = session.execute(stmt).all()
 
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
 
-def db_create_message(db_url: str, role: str, contents: str, chat_id: uuid.UUID):
-    """Store a new message in the specified chat"""
-    engine = create_engine(db_url, echo=ECHO_SQL)
+    messages = [
+        {"id": row.id, "sender": row.role, "text": row.contents} for row in rows
+    ]
 
-    with Session(engine) as session:
-        new_message = Message(contents=contents, role=role, chat_id=chat_id)
+    return messages, next_cursor
 
-        session.add(new_message)
-        session.commit()
 
-        return new_message
+def db_get_or_create_user(db_url: str, issuer: str, sub: str) -> None:
+    """
+    Make sure a user with the given issuer/sub pair exists, creating one if not
+    """
+    with get_session_factory(db_url)() as session:
+        session.execute(user_upsert_stmt(session.get_bind().dialect.name, issuer, sub))
+        session.commit()
 
 
-def db_get_chat(db_url: str, chat_id: uuid.UUID, iss: str, sub: str) -> Chat:
-    """Retrieve a specific chat owned by user
-    Raises: NoResultFound if user or chat cannot be found"""
-    engine = create_engine(db_url, echo=ECHO_SQL)
+def _sanitize_title(chat_title: str) -> str:
+    """Strip the title and fall back to the default if it is empty or contains control characters"""
+    chat_title = chat_title.strip()
 
-    with Session(engine) as session:
-        user = session.execute(
-            select(User).where(User.issuer == iss, User.sub == sub)
-        ).scalar_one()
+    TITLE_PATTERN = re.compile(r"^[^\x00-\x1F\x7F]+$")
 
-        chat = session.execute(select(Chat).where(Chat.id == chat_id)).scalar_one()
+    if not TITLE_PATTERN.match(chat_title) or chat_title == "":
+        # Default title
+        chat_title = "Previous Chat"
 
-        # User tries to access a chat that is not theirs
-        # Don't tell them they hit a real chat that isn't theirs,
-        # but leave this logic separate to make identifying potential
-        # troublemakers easier
-        if user.sub != chat.user_sub or user.issuer != chat.user_issuer:
-            raise PermissionError("User is not the owner of the specified chat")
+    return chat_title
 
-        return chat
 
+# Statement builders shared with db/async_database.py, so the sync and async
+# paths write the same rows
 
-def db_get_or_create_user(db_url: str, issuer: str, sub: str) -> None:
-    """
-    Gets the user with the given issuer/sub pair
-    If no such user exists, create one and return that
-    """
-    engine = create_engine(db_url, echo=ECHO_SQL)
 
-    with Session(engine) as session:
-        try:
-            user_stmt = select(User).where(User.issuer == issuer, User.sub == sub)
-            session.execute(user_stmt).scalar_one()
+def user_upsert_stmt(dialect_name: str, issuer: str, sub: str) -> Executable:
+    """Insert the user row unless it already exists, without a separate lookup"""
+    values = {"issuer": issuer, "sub": sub, "user_prompt": ""}
 
-        except NoResultFound:
-            new_user = User(issuer=issuer, sub=sub, user_prompt="", chats=[])
-            session.add(new_user)
-            session.commit()
+    if dialect_name == "postgresql":
+        return postgresql_insert(User).values(values).on_conflict_do_nothing()
 
+    return sqlite_insert(User).values(values).on_conflict_do_nothing()
 
-def db_create_chat(db_url: str, initial_message: str, issuer: str, sub: str):
-    """Create a new chat for the given user"""
-    engine = create_engine(db_url, echo=ECHO_SQL)
 
-    with Session(engine) as session:
-        new_chat = Chat(
+def new_chat_stmts(
+    chat_id: uuid.UUID, initial_message: str, issuer: str, sub: str
+) -> list[Executable]:
+    return [
+        insert(Chat).values(
+            id=chat_id,
             user_issuer=issuer,
             user_sub=sub,
             title="Previous Chat",
-            messages=[Message(initial_message, "user")],
-        )
-        session.add(new_chat)
+            updated_at=_utcnow(),
+        ),
+        insert(Message).values(contents=initial_message, role="user", chat_id=chat_id),
+    ]
+
+
+def append_user_message_stmt(
+    chat_id: uuid.UUID, issuer: str, sub: str, contents: str
+) -> Executable:
+    """INSERT ... SELECT that only inserts if the user owns the chat"""
+    owned_chat = select(
+        literal(contents, Text), literal("user", String), Chat.id
+    ).where(Chat.id == chat_id, Chat.user_issuer == issuer, Chat.user_sub == sub)
+
+    return insert(Message).from_select(["contents", "role", "chat_id"], owned_chat)
+
+
+def touch_chat_stmt(
+    chat_id: uuid.UUID,
+    chat_title: str | None = None,
+    title_pending: bool | None = None,
+) -> Executable:
+    values: dict = {"updated_at": _utcnow()}
+    if chat_title is not None:
+        values["title"] = _sanitize_title(chat_title)
+    if title_pending is not None:
+        values["title_pending"] = title_pending
+
+    return update(Chat).where(Chat.id == chat_id).values(values)
+
+
+def assistant_message_stmt(chat_id: uuid.UUID, contents: str) -> Executable:
+    return insert(Message).values(contents=contents, role="assistant", chat_id=chat_id)
+
+
+def db_start_chat(
+    db_url: str, initial_message: str, issuer: str, sub: str
+) -> uuid.UUID:
+    """Create the user if they don't exist yet, a new chat, and its first
+    message in a single transaction. The upsert runs every time rather than
+    being skipped for users seen before, since another process may have
+    deleted the user since
+    Returns: the id of the new chat
+    """
+    chat_id = uuid.uuid4()
+
+    with get_session_factory(db_url)() as session:
+        session.execute(user_upsert_stmt(session.get_bind().dialect.name, issuer, sub))
+
+        for stmt in new_chat_stmts(chat_id, initial_message, issuer, sub):
+            session.execute(stmt)
+
         session.commit()
-        session.refresh(new_chat)
 
-        return new_chat
+    return chat_id
 
 
-def db_set_chat_title(db_url: str, chat_id: uuid.UUID, chat_title: str):
-    """Set the title of an already created chat
+def db_append_user_message(
+    db_url: str, chat_id: uuid.UUID, issuer: str, sub: str, contents: str
+) -> None:
+    """Store a user message in an existing chat. The ownership check is part of
+    the insert itself, so nothing is written unless the user owns the chat
     Raises:
-        NoResultFound if no chat with the given id can be found
+        PermissionError: If the chat exists but is not owned by the user
+        NoResultFound: If no chat with the given id exists
     """
-    engine = create_engine(db_url, echo=ECHO_SQL)
+    with get_session_factory(db_url)() as session:
+        result = session.execute(
+            append_user_message_stmt(chat_id, issuer, sub, contents)
+        )
 
-    chat_title = chat_title.strip()
+        if result.rowcount == 1:
+            session.execute(touch_chat_stmt(chat_id))
+            session.commit()
+            return
 
-    TITLE_PATTERN = re.compile(r"^[^\x00-\x1F\x7F]+$")
+        session.rollback()
 
-    if not TITLE_PATTERN.match(chat_title) or chat_title == "":
-        # Default title
-        chat_title = "Previous Chat"
+        # Only the failure path pays for a second query, to keep
+        # the logging distinction between missing and foreign chats
+        if session.execute(select(Chat.id).where(Chat.id == chat_id)).first():
+            raise PermissionError("User is not the owner of the specified chat")
 
-    with Session(engine) as session:
+        raise NoResultFound("No chat with the specified id")
+
+
+def db_finish_turn(
+    db_url: str,
+    chat_id: uuid.UUID,
+    contents: str,
+    chat_title: str | None = None,
+    title_pending: bool | None = None,
+) -> None:
+    """Store the assistant's reply and, if given, the chat title or whether
+    a title job is queued for it, in a single transaction
+    """
+    with get_session_factory(db_url)() as session:
+        session.execute(assistant_message_stmt(chat_id, contents))
+        session.execute(touch_chat_stmt(chat_id, chat_title, title_pending))
+
+        session.commit()
+
+
+def db_set_chat_title(db_url: str, chat_id: uuid.UUID, chat_title: str) -> str:
+    """Set the title of an already created chat, completing its title job
+    Returns: the title as stored
+    Raises:
+        NoResultFound if no chat with the given id can be found
+    """
+    chat_title = _sanitize_title(chat_title)
+
+    with get_session_factory(db_url)() as session:
         chat = session.execute(select(Chat).where(Chat.id == chat_id)).scalar_one()
 
         chat.title = chat_title
+        chat.title_pending = False
 
         session.commit()
 
+    return chat_title
+
+
+def db_claim_chat_title(db_url: str, chat_id: uuid.UUID, lease: float) -> bool:
+    """Claim the pending title job of a chat for the caller, unless another
+    worker claimed it less than lease seconds ago. Several processes may
+    queue the same job, but only one of them runs it at a time
+    Returns: whether the caller got the job
+    """
+    now = _utcnow()
+
+    with get_session_factory(db_url)() as session:
+        result = session.execute(
+            update(Chat)
+            .where(
+                Chat.id == chat_id,
+                Chat.title_pending,
+                or_(
+                    Chat.title_claimed_at.is_(None),
+                    Chat.title_claimed_at < now - timedelta(seconds=lease),
+                ),
+            )
+            .values(title_claimed_at=now)
+        )
+        session.commit()
+
+    return result.rowcount == 1
+
+
+def db_abandon_chat_title(db_url: str, chat_id: uuid.UUID) -> None:
+    """Complete the title job of a chat, keeping its current title"""
+    with get_session_factory(db_url)() as session:
+        session.execute(
+            update(Chat).where(Chat.id == chat_id).values(title_pending=False)
+        )
+        session.commit()
+
+
+def db_pending_titles(db_url: str) -> list[tuple[uuid.UUID, str, str]]:
+    """Chats whose title job never completed, with the first user message
+    and reply the title is generated from
+    """
+    with get_session_factory(db_url)() as session:
+        rows = session.execute(
+            select(Message.chat_id, Message.role, Message.contents)
+            .join(Chat, Chat.id == Message.chat_id)
+            .where(Chat.title_pending)
+            .order_by(Message.chat_id, Message.id)
+        ).all()
+
+    first: dict[uuid.UUID, dict[str, str]] = {}
+    for row in rows:
+        first.setdefault(row.chat_id, {}).setdefault(row.role, row.contents)
+
+    return [
+        (chat_id, messages.get("user", ""), messages.get("assistant", ""))
+        for chat_id, messages in first.items()
+    ]
+
 
 def db_delete_user(db_url: str, issuer: str, sub: str):
     """Delete the specified user.
     Does NOT do any auth checks, that
     should be handled separately.
     """
-    engine = create_engine(db_url)
-
-    with Session(engine) as session:
+    with get_session_factory(db_url)() as session:
         user = session.execute(
             select(User).where(User.issuer == issuer, User.sub == sub)
         ).scalar_one()
@@ -295,9 +644,7 @@ def db_delete_chat(db_url: str, chat_id: uuid.UUID, issuer: str, sub: str):
     Raises:
         PermissionError: If the user does not own the specified chat
     """
-    engine = create_engine(db_url, echo=ECHO_SQL)
-
-    with Session(engine) as session:
+    with get_session_factory(db_url)() as session:
         user = session.execute(
             select(User).where(User.issuer == issuer, User.sub == sub)
         ).scalar_one()
@@ -317,9 +664,7 @@ def db_delete_chat(db_url: str, chat_id: uuid.UUID, issuer: str, sub: str):
 
 
 def add_example_message_to_chat(db_url: str):
-    engine = create_engine(db_url, echo=ECHO_SQL)
-
-    with Session(engine) as session:
+    with get_session_factory(db_url)() as session:
         try:
             chat_id = session.execute(
                 select(Chat.id)
@@ -348,9 +693,7 @@ def add_example_message_to_chat(db_url: str):
 
 
 def add_test_user(db_url: str):
-    engine = create_engine(db_url, echo=ECHO_SQL)
-
-    with Session(engine) as session:
+    with get_session_factory(db_url)() as session:
         test_user = User(
             issuer="test_idp",
             sub="123456abcd",
@@ -370,9 +713,7 @@ def add_test_user(db_url: str):
 
 
 def create_example_chat(db_url: str):
-    engine = create_engine(db_url, echo=ECHO_SQL)
-
-    with Session(engine) as session:
+    with get_session_factory(db_url)() as session:
         try:
             user_id = session.execute(
                 select(User.issuer, User.sub).where(
@@ -0,0 +1,10 @@
+from typing import NamedTuple
+
+
+class Chunk(NamedTuple):
+    text: str
+    url: str
+    repo: str
+    path: str
+    # Position of the chunk within its file
+    offset: int
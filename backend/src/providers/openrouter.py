@@ -1,6 +1,5 @@
-import logging
 import os
-from typing import Generator, Iterable
+from typing import AsyncGenerator, Generator, Iterable
 from dotenv import load_dotenv
 from flask import json
 import openai
@@ -31,6 +30,18 @@ def get_client() -> openai.OpenAI:
     return openai.OpenAI(api_key=api_key, base_url=base_url)
 
 
+def get_async_client() -> openai.AsyncOpenAI:
+    base_url = os.environ.get("BASE_URL")
+    if base_url is None:
+        raise ValueError("Could not find the base url for OpenRouter")
+
+    api_key = os.environ.get("API_KEY")
+    if api_key is None:
+        raise ValueError("Could not read API key for OpenRouter")
+
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
 logger = get_logger()
 
 
@@ -46,6 +57,7 @@ class OpenRouter(Provider):
         self.model = get_model_name()
 
         self.client = get_client()
+        self.async_client = get_async_client()
 
         logger.debug(f"Provider client: {self.client}")
         self._system_prompt: ChatCompletionMessageParam = {
@@ -120,12 +132,9 @@ class OpenRouter(Provider):
 
         return title
 
-    def request(
+    def _chat_messages(
         self, contexts: list[Context], messages: list[dict[str, str]]
-    ) -> Generator[tuple[str, str], None, None]:
-        logger.debug(
-            f"Received request with {len(contexts)} contexts and {len(messages)} messages"
-        )
+    ) -> Iterable[ChatCompletionMessageParam]:
         chat_messages: Iterable[ChatCompletionMessageParam] = [self._system_prompt]
 
         # chat_messages.append(self._system_prompt)
@@ -152,16 +161,29 @@ class OpenRouter(Provider):
 
             chat_messages.append(new_message)
 
+        return chat_messages
+
+    def _sources_event(self, contexts: list[Context]) -> tuple[str, str]:
+        source_list = [
+            {"title": "Not provided", "summary": "No summary", "url": context.url}
+            for context in contexts
+        ]
+        logger.debug(f"Source list with {len(source_list)} items prepared")
+        return "update_sources", json.dumps({"sources": source_list})
+
+    def request(
+        self, contexts: list[Context], messages: list[dict[str, str]]
+    ) -> Generator[tuple[str, str], None, None]:
+        logger.debug(
+            f"Received request with {len(contexts)} contexts and {len(messages)} messages"
+        )
+        chat_messages = self._chat_messages(contexts, messages)
+
         logger.debug("Finished preparing request to provider")
 
         def generate():
-            source_list = [
-                {"title": "Not provided", "summary": "No summary", "url": context.url}
-                for context in contexts
-            ]
-            logger.debug(f"Source list with {len(source_list)} items prepared")
             # yield f"event: update_sources\ndata: {json.dumps({'sources': source_list})}\n\n"
-            yield "update_sources", json.dumps({"sources": source_list})
+            yield self._sources_event(contexts)
             logger.debug("Yielded sources")
 
             response = self.client.chat.completions.create(
@@ -180,6 +202,30 @@ class OpenRouter(Provider):
 
         return generate()
 
+    async def async_request(
+        self, contexts: list[Context], messages: list[dict[str, str]]
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        logger.debug(
+            f"Received async request with {len(contexts)} contexts and {len(messages)} messages"
+        )
+        chat_messages = self._chat_messages(contexts, messages)
+
+        yield self._sources_event(contexts)
+
+        response = await self.async_client.chat.completions.create(
+            messages=chat_messages,
+            model=self.model,
+            stream=True,
+            max_completion_tokens=1024,
+            max_tokens=1024,
+        )
+
+        async for chunk in response:
+            content = chunk.choices[0].delta.content
+            if content is None:
+                content = ""
+            yield "new_chunk", content
+
     def system_prompt(self, prompt: str) -> None:
         self._system_prompt: ChatCompletionMessageParam = {
             "role": "system",
@@ -1,5 +1,7 @@
 import abc
-from typing import Generator
+import asyncio
+import threading
+from typing import AsyncGenerator, Generator
 
 from models.context import Context
 
@@ -15,6 +17,39 @@ class Provider(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    async def async_request(
+        self, contexts: list[Context], messages: list[dict[str, str]]
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        """
+        Async version of request, for the ASGI app. Providers without an
+        async client fall back to running request on a worker thread
+        """
+        events = self.request(contexts, messages)
+        done = object()
+        # A cancelled step keeps running on its thread, and closing the
+        # generator while it runs would fail
+        stepping = threading.Lock()
+
+        def step() -> tuple[str, str] | object:
+            with stepping:
+                return next(events, done)
+
+        def close() -> None:
+            with stepping:
+                events.close()
+
+        try:
+            while True:
+                event = await asyncio.to_thread(step)
+                if event is done:
+                    break
+
+                yield event
+
+        finally:
+            # Lets request release its connection when the consumer stops early
+            await asyncio.shield(asyncio.to_thread(close))
+
     @abc.abstractmethod
     def get_chat_title(
         self,
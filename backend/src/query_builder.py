@@ -0,0 +1,132 @@
+import hashlib
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from atr_logger import get_logger
+from cache.lru import LRUCache
+from models.context import Context
+from vdb.rerank import estimate_tokens
+from vdb.vdb import VDB
+
+logger = get_logger()
+
+
+class RetrievalQuery(NamedTuple):
+    # Bounded window of the latest user turns, for stages that need text
+    text: str
+    # Blend of the latest turn's embedding with the conversation so far,
+    # or None if the VDB can't embed queries on their own
+    vector: Optional[list[float]]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, keeping the start"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: 4 * max_tokens]
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class QueryBuilder:
+    """Builds the retrieval query for a chat turn from a bounded window of
+    the conversation instead of the whole transcript.
+
+    The query vector is latest_weight parts the latest user turn and the
+    rest the previous turn's query vector, a decaying summary of the chat.
+    Query vectors are cached under a hash of the user turns that produced
+    them, so a follow-up turn only embeds its own message. Nothing is keyed
+    on the chat id, so anonymous chats and other workers' chats work the
+    same way; a miss rebuilds the vector from the last max_turns turns
+    """
+
+    def __init__(
+        self,
+        vector_db: VDB,
+        max_turns: int = 3,
+        max_tokens: int = 256,
+        latest_weight: float = 0.7,
+        cache_size: int = 1024,
+        ttl: Optional[float] = 3600,
+    ) -> None:
+        self.vector_db = vector_db
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.latest_weight = latest_weight
+        self._vectors: LRUCache[str, np.ndarray] = LRUCache(cache_size, ttl=ttl)
+
+    def user_turns(self, messages: list[dict[str, str]]) -> list[str]:
+        turns = [m["content"] for m in messages if m.get("role") != "assistant"]
+        if not turns:
+            turns = [messages[-1]["content"]]
+        return [truncate_to_tokens(turn, self.max_tokens) for turn in turns]
+
+    def window_text(self, turns: list[str]) -> str:
+        """The latest turns, newest first, until max_tokens is reached"""
+        window = []
+        used = 0
+        for turn in reversed(turns[-self.max_turns :]):
+            tokens = estimate_tokens(turn)
+            if window and used + tokens > self.max_tokens:
+                break
+            window.append(turn)
+            used += tokens
+
+        return " ".join(window)
+
+    def _key(self, turns: list[str]) -> str:
+        digest = hashlib.sha256(self.vector_db.model_id.encode("utf-8"))
+        for turn in turns:
+            digest.update(b"\0")
+            digest.update(turn.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _blend(self, previous: Optional[np.ndarray], latest: list[float]) -> np.ndarray:
+        vector = _normalize(np.asarray(latest, dtype=np.float32))
+        if previous is None:
+            return vector
+        return _normalize(
+            self.latest_weight * vector + (1.0 - self.latest_weight) * previous
+        )
+
+    def query_vector(self, turns: list[str]) -> np.ndarray:
+        key = self._key(turns)
+        vector = self._vectors.get(key)
+        if vector is not None:
+            return vector
+
+        previous = self._vectors.get(self._key(turns[:-1])) if len(turns) > 1 else None
+
+        if previous is not None or len(turns) == 1:
+            vector = self._blend(previous, self.vector_db.embed_query(turns[-1]))
+        else:
+            logger.debug("No cached query vector for this chat, rebuilding it")
+            window = turns[-self.max_turns :]
+            vector = None
+            for embedding in self.vector_db.embed_queries(window):
+                vector = self._blend(vector, embedding)
+
+        self._vectors.set(key, vector)
+        return vector
+
+    def build(self, messages: list[dict[str, str]]) -> RetrievalQuery:
+        turns = self.user_turns(messages)
+        text = self.window_text(turns)
+
+        try:
+            vector = self.query_vector(turns)
+        except NotImplementedError:
+            return RetrievalQuery(text, None)
+
+        return RetrievalQuery(text, vector.tolist())
+
+    def get_nearest(self, k: int, messages: list[dict[str, str]]) -> list[Context]:
+        query = self.build(messages)
+
+        if query.vector is None:
+            return self.vector_db.get_nearest(k, query.text)
+        return self.vector_db.get_nearest_with_vector(k, query.text, query.vector)
@@ -6,6 +6,9 @@
 # PATH=$PATH:$LAMBDA_TASK_ROOT/bin PYTHONPATH=$LAMBDA_TASK_ROOT which gunicorn
 # PATH=$PATH:$LAMBDA_TASK_ROOT/bin PYTHONPATH=$LAMBDA_TASK_ROOT which python
 export RUST_BACKTRACE=1
+if [ "$SERVER_MODE" = "asgi" ]; then
+  PATH=$PATH:$LAMBDA_TASK_ROOT/bin PYTHONPATH=$PYTHONPATH:/opt/python:$LAMBDA_RUNTIME_DIR exec python -m uvicorn asgi:app --host 0.0.0.0 --port ${PORT:-3459}
+fi
 PATH=$PATH:$LAMBDA_TASK_ROOT/bin PYTHONPATH=$PYTHONPATH:/opt/python:$LAMBDA_RUNTIME_DIR exec python -m gunicorn backend:backend --bind 0.0.0.0:${PORT:-3459} --workers 1 --threads 8
 # PATH=$PATH:$LAMBDA_TASK_ROOT/bin PYTHONPATH=$PYTHONPATH:/opt/python:$LAMBDA_RUNTIME_DIR exec python -c 'print("Hello World!")'
 # echo $LAMBDA_TASK_ROOT
@@ -0,0 +1,234 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future
+from typing import Callable, Sequence
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwt.algorithms import ECAlgorithm
+
+# Run from anywhere; the backend imports its modules from backend/src
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.database import Base, get_engine  # noqa: E402
+from models.auth_context import AuthContext, Claims  # noqa: E402
+from models.context import Context  # noqa: E402
+from vdb.vdb import VDB  # noqa: E402
+
+ISSUER = "https://localhost/testing"
+
+
+class Clock:
+    """Stands in for the time module, running offset seconds ahead"""
+
+    def __init__(self) -> None:
+        self.offset = 0.0
+        self.sleep = time.sleep
+
+    def monotonic(self) -> float:
+        return time.monotonic() + self.offset
+
+    def time(self) -> float:
+        return time.time() + self.offset
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    """A Clock in place of time in cache/lru.py; tests patch it into the
+    other modules they need
+    """
+    import cache.lru
+
+    clock = Clock()
+    monkeypatch.setattr(cache.lru, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    """A fresh sqlite database with the schema created"""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    Base.metadata.create_all(get_engine(url))
+    return url
+
+
+@pytest.fixture(scope="session")
+def app_env(tmp_path_factory) -> str:
+    """Configure the environment backend.py reads at import, against a
+    sqlite database of its own
+    Returns: the DATABASE_URL
+    """
+    app_dir = tmp_path_factory.mktemp("app")
+    url = f"sqlite:///{app_dir / 'app.db'}"
+    Base.metadata.create_all(get_engine(url))
+
+    # auth.py loads its signing keys at import; keep that off the network
+    jwk = ECAlgorithm.to_jwk(
+        ec.generate_private_key(ec.SECP256R1()).public_key(), as_dict=True
+    )
+    jwks_file = app_dir / "jwks.json"
+    jwks_file.write_text(json.dumps({"keys": [{**jwk, "kid": "app", "alg": "ES256"}]}))
+
+    env = {
+        "SECRET_KEY": "testing",
+        "DATABASE_URL": url,
+        "VDB": "FAISS",
+        "COMPLETION_PROVIDER": "OpenRouter",
+        "COMPLETION_MODEL": "test-model",
+        "BASE_URL": "http://localhost:9",
+        "API_KEY": "testing",
+        "SUPABASE_URL": "http://localhost:9",
+        "SUPABASE_JWKS_FILE": str(jwks_file),
+        # Read by vdb/amazons3vector.py at import, though the tests use FAISS
+        "AWS_REGION": "us-east-1",
+        "BUCKET_NAME": "testing",
+        "EMBEDDING_MODEL": "testing",
+        "INDEX_NAME": "testing",
+        "PROFILE_NAME": "testing",
+    }
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+
+    return os.environ["DATABASE_URL"]
+
+
+class FakeProvider:
+    """Streams the same reply to the Flask and ASGI apps"""
+
+    EVENTS = [
+        ("update_sources", "[]"),
+        ("new_chunk", "Hello"),
+        ("new_chunk", ""),
+        ("new_chunk", " there"),
+    ]
+
+    def request(self, contexts, messages):
+        yield from self.EVENTS
+
+    async def async_request(self, contexts, messages):
+        for event in self.EVENTS:
+            yield event
+
+
+class FakeQueryBuilder:
+    def get_nearest(self, k, messages):
+        return []
+
+
+class FakeTitleWorker:
+    """Titles every chat "A title" at once, and records what it was given"""
+
+    def __init__(self) -> None:
+        self.submitted = []
+
+    def submit(self, chat_id, user_message, reply) -> Future:
+        self.submitted.append((chat_id, user_message, reply))
+        future = Future()
+        future.set_result("A title")
+        return future
+
+
+def auth_from_header(header: str) -> AuthContext:
+    """Bearer <sub> logs in as sub"""
+    if not header.startswith("Bearer "):
+        return AuthContext(_protected_claims=None)
+    return AuthContext(_protected_claims=Claims(iss=ISSUER, sub=header[7:]))
+
+
+@pytest.fixture
+def provider() -> FakeProvider:
+    return FakeProvider()
+
+
+@pytest.fixture
+def query_builder() -> FakeQueryBuilder:
+    return FakeQueryBuilder()
+
+
+@pytest.fixture
+def title_worker() -> FakeTitleWorker:
+    return FakeTitleWorker()
+
+
+@pytest.fixture
+def auth_context() -> Callable[[str], AuthContext]:
+    """Stands in for auth_context_from_header; Bearer <sub> logs in as sub"""
+    return auth_from_header
+
+
+class FakeVDB(VDB):
+    """Records what it is asked. Searches return results cut to k, or when
+    results is None, k contexts naming the query and vector. Queries embed
+    with embed, by default as [len(query), embed calls so far], and not at
+    all if can_embed is false
+    """
+
+    def __init__(
+        self,
+        results: list[Context] | None = None,
+        embed: Callable[[str], list[float]] | None = None,
+        can_embed: bool = True,
+        name: str = "FakeVDB",
+    ) -> None:
+        self.results = results
+        self.embed = embed
+        self.can_embed = can_embed
+        self.name = name
+        self.embedded: list[str] = []
+        # (k, query, vector), with None for whichever wasn't given
+        self.searches: list[tuple] = []
+        self.embed_batches = 0
+        self.search_batches = 0
+        self.indexed: list = []
+
+    @property
+    def model_id(self) -> str:
+        return self.name
+
+    def embed_query(self, query: str) -> list[float]:
+        if not self.can_embed:
+            raise NotImplementedError
+        self.embedded.append(query)
+        if self.embed is not None:
+            return self.embed(query)
+        return [float(len(query)), float(len(self.embedded))]
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        if not self.can_embed:
+            raise NotImplementedError
+        self.embed_batches += 1
+        return [self.embed_query(query) for query in queries]
+
+    def get_nearest(self, k, query):
+        return self._search(k, query, None)
+
+    def get_nearest_with_vector(self, k, query, vector):
+        return self._search(k, query, vector)
+
+    def get_nearest_by_vector(self, k, vector):
+        return self._search(k, None, vector)
+
+    def get_nearest_by_vectors(self, k, vectors):
+        self.search_batches += 1
+        return [self._search(k, None, vector) for vector in vectors]
+
+    def index_document(self, chunks):
+        self.indexed.extend(chunks)
+        return len(chunks)
+
+    def delete_chunks(self, chunks):
+        return len(list(chunks))
+
+    def _search(self, k, query, vector) -> list[Context]:
+        self.searches.append((k, query, vector))
+        if self.results is not None:
+            return self.results[:k]
+        return [Context(f"{query} {vector} result {i}", "url") for i in range(k)]
+
+
+@pytest.fixture
+def fake_vdb() -> type[FakeVDB]:
+    """The FakeVDB class, for tests to build with the results they need"""
+    return FakeVDB
@@ -0,0 +1,119 @@
+# test_amazons3vector.py
+import importlib.util
+import io
+import json
+import os
+import threading
+
+import pytest
+
+from models.chunk import Chunk
+
+AWS_DATASOURCE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "datasources", "aws"
+)
+
+
+class FakeBedrock:
+    def __init__(self) -> None:
+        self.threads = set()
+        self.texts = []
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, accept, contentType):
+        text = json.loads(body)["inputText"]
+        with self._lock:
+            self.threads.add(threading.get_ident())
+            self.texts.append(text)
+        payload = {"embedding": [float(len(text)), 1.0]}
+        return {"body": io.BytesIO(json.dumps(payload).encode())}
+
+
+class FakeS3Vectors:
+    def __init__(self) -> None:
+        self.batch_sizes = []
+        self.stored = {}
+        self._lock = threading.Lock()
+
+    def put_vectors(self, vectorBucketName, indexName, vectors):
+        with self._lock:
+            self.batch_sizes.append(len(vectors))
+            self.stored.update((v["key"], v) for v in vectors)
+
+    def delete_vectors(self, vectorBucketName, indexName, keys):
+        with self._lock:
+            for key in keys:
+                self.stored.pop(key, None)
+
+
+@pytest.fixture
+def s3(app_env, monkeypatch):
+    from vdb import amazons3vector
+
+    bedrock, s3vectors = FakeBedrock(), FakeS3Vectors()
+    monkeypatch.setattr(amazons3vector, "_clients", (bedrock, s3vectors))
+    return amazons3vector, bedrock, s3vectors
+
+
+def chunk(path: str, offset: int, text: str = "") -> Chunk:
+    return Chunk(text or f"{path} {offset}", "https://origin", "repo", path, offset)
+
+
+def test_index_document_embeds_on_the_executor_and_batches_puts(s3):
+    amazons3vector, bedrock, s3vectors = s3
+    chunks = [chunk("docs/guide.md", i) for i in range(1203)]
+
+    assert amazons3vector.AmazonS3Vector().index_document(chunks) == 1203
+
+    assert sorted(s3vectors.batch_sizes) == [203, 500, 500]
+    assert len(bedrock.texts) == 1203
+    assert threading.get_ident() not in bedrock.threads
+    stored = s3vectors.stored[amazons3vector.vector_key(chunks[7])]
+    assert stored["data"] == {"float32": [float(len(chunks[7].text)), 1.0]}
+    assert stored["metadata"] == amazons3vector.vector_metadata(
+        "https://origin", chunks[7].text
+    )
+
+
+def test_later_chunks_with_the_same_key_win(s3):
+    amazons3vector, bedrock, s3vectors = s3
+    chunks = [chunk("a.md", 0, "old"), chunk("a.md", 1), chunk("a.md", 0, "new")]
+
+    assert amazons3vector.AmazonS3Vector().index_document(chunks) == 2
+
+    assert sorted(bedrock.texts) == ["a.md 1", "new"]
+    stored = s3vectors.stored[amazons3vector.vector_key(chunks[0])]
+    assert stored["metadata"]["text"] == "new"
+
+
+def test_files_sharing_a_name_get_their_own_keys(s3):
+    amazons3vector, _, s3vectors = s3
+    index = amazons3vector.AmazonS3Vector()
+
+    index.index_document([chunk("docs/README.md", 0), chunk("src/README.md", 0)])
+    assert index.delete_chunks([chunk("docs/README.md", 0)]) == 1
+
+    assert list(s3vectors.stored) == [
+        amazons3vector.vector_key(chunk("src/README.md", 0))
+    ]
+
+
+def test_keys_and_metadata_match_the_ingestion_script(s3, monkeypatch):
+    amazons3vector, _, _ = s3
+    for name in ("MODEL_ID", "PROFILE_NAME", "REGION_NAME"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.syspath_prepend(AWS_DATASOURCE)
+    spec = importlib.util.spec_from_file_location(
+        "preprocess_docs", os.path.join(AWS_DATASOURCE, "preprocess_docs.py")
+    )
+    preprocess_docs = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(preprocess_docs)
+
+    indexed = chunk("docs/README.md", 3, "Some text")
+
+    assert amazons3vector.vector_key(indexed) == preprocess_docs.vector_key(
+        "repo", "docs/README.md", 3
+    )
+    assert amazons3vector.vector_metadata(
+        indexed.url, indexed.text
+    ) == preprocess_docs.vector_metadata("https://origin", "Some text")
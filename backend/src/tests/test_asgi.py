@@ -0,0 +1,216 @@
+# test_asgi.py
+import asyncio
+import json
+import uuid
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import anyio  # noqa: E402
+from sqlalchemy import delete, select  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+from db.database import Chat, Message, User, get_session_factory  # noqa: E402
+
+ISSUER = "https://localhost/testing"
+
+
+@pytest.fixture
+def client(app_env, monkeypatch, auth_context, provider, query_builder, title_worker):
+    import asgi
+
+    monkeypatch.setattr(asgi, "auth_context_from_header", auth_context)
+    monkeypatch.setattr(asgi, "provider", provider)
+    monkeypatch.setattr(asgi, "query_builder", query_builder)
+    monkeypatch.setattr(asgi, "title_worker", title_worker)
+
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def events(body: str) -> list[tuple[str, str]]:
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        parsed.append((event.removeprefix("event: "), data.removeprefix("data: ")))
+    return parsed
+
+
+def new_chat_id(response) -> str:
+    name, data = events(response.text)[0]
+    assert name == "set_uuid"
+    return json.loads(data)["new_uuid"]
+
+
+def transcript(db_url: str, chat_id: str) -> list[tuple[str, str]]:
+    with get_session_factory(db_url)() as session:
+        rows = session.execute(
+            select(Message.role, Message.contents)
+            .where(Message.chat_id == uuid.UUID(chat_id))
+            .order_by(Message.id)
+        ).all()
+    return [(row.role, row.contents) for row in rows]
+
+
+def send(client, sub, chat_id, *contents):
+    messages = [{"role": "user", "content": c} for c in contents]
+    return client.post(
+        "/api/message",
+        json={"uuid": chat_id, "messages": messages},
+        headers={"Authorization": f"Bearer {sub}"} if sub else {},
+    )
+
+
+def test_new_chat_streams_and_stores_the_turn(client, app_env):
+    response = send(client, "alice", "None", "What is a pipe?")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    names = [name for name, _ in events(response.text)]
+    assert names == [
+        "set_uuid",
+        "update_sources",
+        "new_chunk",
+        "new_chunk",
+        "set_title",
+    ]
+
+    chat_id = new_chat_id(response)
+    assert transcript(app_env, chat_id) == [
+        ("user", "What is a pipe?"),
+        ("assistant", "Hello there"),
+    ]
+
+
+def test_follow_up_is_appended_to_the_chat(client, app_env):
+    first = send(client, "bob", "None", "First question")
+    chat_id = new_chat_id(first)
+
+    response = send(client, "bob", chat_id, "First question", "Second question")
+
+    assert response.status_code == 200
+    assert "set_uuid" not in response.text
+    assert transcript(app_env, chat_id)[2:] == [
+        ("user", "Second question"),
+        ("assistant", "Hello there"),
+    ]
+    with get_session_factory(app_env)() as session:
+        assert session.get(Chat, uuid.UUID(chat_id)).title == "Previous Chat"
+
+
+@pytest.mark.parametrize("sub", ["mallory", None])
+def test_someone_elses_chat_is_not_found(client, app_env, sub):
+    first = send(client, "carol", "None", "Private")
+    chat_id = new_chat_id(first)
+
+    response = send(client, sub, chat_id, "Let me in")
+
+    if sub is None:
+        # Logged out users can chat, but nothing is stored
+        assert response.status_code == 200
+    else:
+        assert response.status_code == 404
+    assert len(transcript(app_env, chat_id)) == 2
+
+
+def test_unknown_chat_is_not_found(client):
+    response = send(client, "dave", str(uuid.uuid4()), "Hello?")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {},
+        {"messages": [{"role": "user", "content": "hi"}]},
+        {"uuid": "x", "messages": [{"role": "user", "content": "hi"}]},
+        {"uuid": "None", "messages": []},
+    ],
+)
+def test_invalid_requests_are_rejected(client, body):
+    response = client.post("/api/message", json=body)
+
+    assert response.status_code == 400
+
+
+def test_new_chats_recreate_a_user_deleted_elsewhere(client, app_env):
+    send(client, "ivan", "None", "First")
+    # As another worker deleting the account would
+    with get_session_factory(app_env)() as session:
+        session.execute(delete(User).where(User.issuer == ISSUER, User.sub == "ivan"))
+        session.commit()
+
+    response = send(client, "ivan", "None", "Second")
+
+    assert response.status_code == 200
+    with get_session_factory(app_env)() as session:
+        assert session.get(User, (ISSUER, "ivan")) is not None
+
+
+class StallingProvider:
+    """Sends one chunk, then waits on the upstream model forever"""
+
+    async def async_request(self, contexts, messages):
+        yield ("new_chunk", "Partial")
+        await anyio.sleep_forever()
+
+
+def message_request(sub: str, content: str) -> Request:
+    body = json.dumps(
+        {"uuid": "None", "messages": [{"role": "user", "content": content}]}
+    ).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/message",
+        "headers": [(b"authorization", f"Bearer {sub}".encode())],
+    }
+    return Request(scope, receive)
+
+
+def test_disconnect_mid_stream_stores_the_reply_and_queues_the_title(
+    app_env, monkeypatch, auth_context, query_builder, title_worker
+):
+    import asgi
+
+    monkeypatch.setattr(asgi, "auth_context_from_header", auth_context)
+    monkeypatch.setattr(asgi, "provider", StallingProvider())
+    monkeypatch.setattr(asgi, "query_builder", query_builder)
+    monkeypatch.setattr(asgi, "title_worker", title_worker)
+
+    async def disconnect_after_first_chunk() -> str:
+        response = await asgi.send_message(message_request("heidi", "Hang on"))
+        chat_id = None
+        # Starlette cancels the stream like this when the client goes away;
+        # the cancellation is redelivered at every await until the scope exits
+        with anyio.CancelScope() as scope:
+            async for event in response.body_iterator:
+                if event.startswith("event: set_uuid"):
+                    chat_id = json.loads(event.split("data: ")[1])["new_uuid"]
+                if event.startswith("event: new_chunk"):
+                    scope.cancel()
+        assert scope.cancelled_caught
+
+        # The turn is finished in the background once the stream is gone
+        for _ in range(200):
+            if title_worker.submitted:
+                break
+            await asyncio.sleep(0.01)
+        # As the lifespan does on shutdown, closing this loop's connections
+        await asgi.dispose_async_engines()
+        return chat_id
+
+    chat_id = anyio.run(disconnect_after_first_chunk)
+
+    assert transcript(app_env, chat_id) == [
+        ("user", "Hang on"),
+        ("assistant", "Partial"),
+    ]
+    assert title_worker.submitted == [(uuid.UUID(chat_id), "Hang on", "Partial")]
@@ -0,0 +1,198 @@
+# test_auth.py
+import hashlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwt.algorithms import ECAlgorithm
+from jwt.exceptions import PyJWKClientError
+
+
+@pytest.fixture
+def auth(app_env):
+    import auth
+
+    auth.verified_tokens.clear()
+    return auth
+
+
+@pytest.fixture
+def clock(clock, monkeypatch, auth):
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+def new_key() -> ec.EllipticCurvePrivateKey:
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+def write_jwks(path, keys: dict[str, ec.EllipticCurvePrivateKey]) -> None:
+    jwks = []
+    for kid, key in keys.items():
+        jwk = ECAlgorithm.to_jwk(key.public_key(), as_dict=True)
+        jwks.append({**jwk, "kid": kid, "alg": "ES256", "use": "sig"})
+    path.write_text(json.dumps({"keys": jwks}))
+
+
+def make_token(auth, key, kid: str, sub: str = "someone", lifetime: float = 60):
+    claims = {
+        "iss": auth.ISSUER,
+        "sub": sub,
+        "aud": "authenticated",
+        "exp": int(time.time() + lifetime),
+    }
+    return jwt.encode(claims, key, algorithm="ES256", headers={"kid": kid})
+
+
+class CountingJWKSCache:
+    """JWKSCache over a local file that counts how often it is read"""
+
+    def __init__(self, auth, path, min_refetch_interval: float = 30) -> None:
+        self.cache = auth.JWKSCache(
+            str(path), min_refetch_interval=min_refetch_interval
+        )
+        self.loads = 0
+        load = self.cache._load
+
+        def counting_load():
+            self.loads += 1
+            return load()
+
+        self.cache._load = counting_load
+
+
+def test_known_kid_verifies(auth, tmp_path, monkeypatch):
+    key = new_key()
+    write_jwks(tmp_path / "jwks.json", {"one": key})
+    jwks = CountingJWKSCache(auth, tmp_path / "jwks.json")
+    monkeypatch.setattr(auth, "jwks_client", jwks.cache)
+
+    claims = auth.verify_supabase_jwt(make_token(auth, key, "one", sub="alice"))
+    auth.verify_supabase_jwt(make_token(auth, key, "one", sub="bob"))
+
+    assert claims["sub"] == "alice"
+    # The first token loaded the keys, the second used them
+    assert jwks.loads == 1
+
+
+def test_wrong_signature_is_refused(auth, tmp_path, monkeypatch):
+    write_jwks(tmp_path / "jwks.json", {"one": new_key()})
+    monkeypatch.setattr(
+        auth, "jwks_client", auth.JWKSCache(str(tmp_path / "jwks.json"))
+    )
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        auth.verify_supabase_jwt(make_token(auth, new_key(), "one"))
+
+
+def test_unknown_kid_refetches_at_most_once_per_interval(auth, tmp_path, clock):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, {"one": new_key()})
+    jwks = CountingJWKSCache(auth, path, min_refetch_interval=30)
+    jwks.cache.refresh()
+
+    for _ in range(5):
+        with pytest.raises(PyJWKClientError):
+            jwks.cache.get_signing_key("unknown")
+    assert jwks.loads == 1
+
+    clock.offset += 30
+    with pytest.raises(PyJWKClientError):
+        jwks.cache.get_signing_key("unknown")
+    with pytest.raises(PyJWKClientError):
+        jwks.cache.get_signing_key("unknown")
+    assert jwks.loads == 2
+
+
+def test_rotated_key_is_picked_up(auth, tmp_path, monkeypatch, clock):
+    path = tmp_path / "jwks.json"
+    old, new = new_key(), new_key()
+    write_jwks(path, {"old": old})
+    jwks = CountingJWKSCache(auth, path, min_refetch_interval=30)
+    monkeypatch.setattr(auth, "jwks_client", jwks.cache)
+    auth.verify_supabase_jwt(make_token(auth, old, "old"))
+
+    write_jwks(path, {"new": new})
+    clock.offset += 30
+    claims = auth.verify_supabase_jwt(make_token(auth, new, "new", sub="rotated"))
+
+    assert claims["sub"] == "rotated"
+    assert jwks.loads == 2
+    # The retired key is gone, and the refetch it asks for is rate limited
+    with pytest.raises(PyJWKClientError):
+        auth.verify_supabase_jwt(make_token(auth, old, "old", sub="late"))
+    assert jwks.loads == 2
+
+
+def test_concurrent_misses_share_one_refetch(auth, tmp_path, clock):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, {"old": new_key()})
+    jwks = CountingJWKSCache(auth, path, min_refetch_interval=30)
+    jwks.cache.refresh()
+
+    write_jwks(path, {"new": new_key()})
+    clock.offset += 30
+    # Hold the first refetch long enough for the other requests to queue
+    # up behind it
+    load = jwks.cache._load
+
+    def slow_load():
+        time.sleep(0.2)
+        return load()
+
+    jwks.cache._load = slow_load
+    found = []
+    threads = [
+        threading.Thread(target=lambda: found.append(jwks.cache.get_signing_key("new")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(found) == 8
+    assert jwks.loads == 2
+
+
+def test_cached_token_expires_at_exp(auth, tmp_path, monkeypatch, clock):
+    key = new_key()
+    write_jwks(tmp_path / "jwks.json", {"one": key})
+    monkeypatch.setattr(
+        auth, "jwks_client", auth.JWKSCache(str(tmp_path / "jwks.json"))
+    )
+    token = make_token(auth, key, "one", lifetime=60)
+    exp = jwt.decode(token, options={"verify_signature": False})["exp"]
+    auth.verify_supabase_jwt(token)
+
+    # From here on a token that isn't served from the cache fails verification
+    broken = SimpleNamespace(
+        get_signing_key_from_jwt=lambda token: pytest.fail("verified again")
+    )
+    monkeypatch.setattr(auth, "jwks_client", broken)
+
+    clock.offset = exp - 1 - time.time()
+    assert auth.verify_supabase_jwt(token)["sub"] == "someone"
+
+    clock.offset = exp - time.time()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    assert auth.verified_tokens.get(token_hash) is None
+
+
+def test_auth_context_from_header(auth, tmp_path, monkeypatch):
+    key = new_key()
+    write_jwks(tmp_path / "jwks.json", {"one": key})
+    monkeypatch.setattr(
+        auth, "jwks_client", auth.JWKSCache(str(tmp_path / "jwks.json"))
+    )
+
+    context = auth.auth_context_from_header(f"Bearer {make_token(auth, key, 'one')}")
+    assert context.logged_in
+    assert context.claims.sub == "someone"
+
+    assert not auth.auth_context_from_header("").logged_in
+    assert not auth.auth_context_from_header("Bearer not-a-token").logged_in
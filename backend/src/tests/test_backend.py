@@ -0,0 +1,87 @@
+# test_backend.py
+import json
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+from db.database import Message, db_set_chat_title, get_session_factory
+
+
+@pytest.fixture
+def client(app_env, monkeypatch, auth_context, provider, query_builder, title_worker):
+    import auth
+    import backend
+
+    monkeypatch.setattr(auth, "auth_context_from_header", auth_context)
+    monkeypatch.setattr(backend, "provider", provider)
+    monkeypatch.setattr(backend, "query_builder", query_builder)
+    monkeypatch.setattr(backend, "title_worker", title_worker)
+
+    return backend.backend.test_client()
+
+
+def send(client, sub, chat_id, *contents):
+    messages = [{"role": "user", "content": c} for c in contents]
+    return client.post(
+        "/api/message",
+        json={"uuid": chat_id, "messages": messages},
+        headers={"Authorization": f"Bearer {sub}"} if sub else {},
+    )
+
+
+def message_count(db_url: str, chat_id: str) -> int:
+    with get_session_factory(db_url)() as session:
+        return session.execute(
+            select(func.count())
+            .select_from(Message)
+            .where(Message.chat_id == uuid.UUID(chat_id))
+        ).scalar_one()
+
+
+def new_chat_id(response) -> str:
+    event, data = response.get_data(as_text=True).split("\n\n")[0].split("\n")
+    assert event == "event: set_uuid"
+    return json.loads(data.removeprefix("data: "))["new_uuid"]
+
+
+def test_logged_out_replies_are_not_stored_in_any_chat(client, app_env):
+    chat_id = new_chat_id(send(client, "erin", "None", "Mine"))
+    assert message_count(app_env, chat_id) == 2
+
+    response = send(client, None, chat_id, "Not mine")
+
+    assert response.status_code == 200
+    assert "Hello" in response.get_data(as_text=True)
+    assert message_count(app_env, chat_id) == 2
+
+
+def poll(client, sub, chat_id):
+    return client.get(
+        f"/api/chat/{chat_id}/title",
+        headers={"Authorization": f"Bearer {sub}"} if sub else {},
+    )
+
+
+def test_title_poll_reports_the_pending_title_until_it_is_stored(client, app_env):
+    chat_id = new_chat_id(send(client, "frank", "None", "What is a pipe?"))
+
+    response = poll(client, "frank", chat_id)
+    assert response.status_code == 200
+    assert response.get_json() == {"title": "Previous Chat", "pending": True}
+
+    db_set_chat_title(app_env, uuid.UUID(chat_id), "Unix pipes")
+
+    response = poll(client, "frank", chat_id)
+    assert response.get_json() == {"title": "Unix pipes", "pending": False}
+
+
+@pytest.mark.parametrize("sub", ["mallory", None])
+def test_title_poll_hides_other_users_chats(client, sub):
+    chat_id = new_chat_id(send(client, "grace", "None", "Private"))
+
+    assert poll(client, sub, chat_id).status_code == 404
+
+
+def test_title_poll_of_an_unknown_chat_is_not_found(client):
+    assert poll(client, "grace", uuid.uuid4()).status_code == 404
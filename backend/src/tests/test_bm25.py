@@ -0,0 +1,168 @@
+# test_bm25.py
+import json
+
+import pytest
+
+from models.chunk import Chunk
+from models.context import Context
+from vdb.bm25 import BM25Index, read_chunks_jsonl, tokenize
+from vdb.hybrid import HybridVDB, reciprocal_rank_fusion
+
+
+def chunk(text: str, offset: int, path: str = "docs/pipes.md") -> Chunk:
+    return Chunk(text, f"https://example.com/{path}", "repo", path, offset)
+
+
+CHUNKS = [
+    chunk("The mekanism:basic_universal_cable carries power.", 0),
+    chunk("Pipes move fluids between machines.", 1),
+    chunk("Set ftbquests.enabled to false to hide the quest book.", 2),
+    chunk("A logistical transporter moves items, not fluids.", 3),
+]
+
+
+@pytest.mark.parametrize(
+    "text, tokens",
+    [
+        ("The pipe is full", ["pipe", "full"]),
+        (
+            "mekanism:basic_universal_cable",
+            [
+                "mekanism:basic_universal_cable",
+                "mekanism",
+                "basic",
+                "universal",
+                "cable",
+            ],
+        ),
+        ("ftbquests.enabled", ["ftbquests.enabled", "ftbquests", "enabled"]),
+        ("getItemStack", ["getitemstack", "get", "item", "stack"]),
+        ("HTTPServer v2", ["httpserver", "http", "server", "v2", "v", "2"]),
+        ("it is what it is", []),
+    ],
+)
+def test_tokenize(text, tokens):
+    assert tokenize(text) == tokens
+
+
+def test_exact_identifiers_rank_first():
+    index = BM25Index.from_chunks(CHUNKS)
+
+    results = index.search("ftbquests.enabled", k=2)
+
+    assert results[0][0] == CHUNKS[2]
+    assert all(score > 0 for _, score in results)
+
+
+def test_results_are_ordered_and_limited_to_k():
+    index = BM25Index.from_chunks(CHUNKS)
+
+    results = index.search("fluids pipes machines", k=2)
+
+    assert [c for c, _ in results] == [CHUNKS[1], CHUNKS[3]]
+    assert results[0][1] > results[1][1]
+
+
+def test_no_matches():
+    index = BM25Index.from_chunks(CHUNKS)
+
+    assert index.search("nothing here matches", k=3) == []
+    assert BM25Index().search("pipes", k=3) == []
+
+
+def test_removed_chunks_are_masked():
+    index = BM25Index.from_chunks(CHUNKS)
+
+    assert index.remove([CHUNKS[1], chunk("never added", 9)]) == 1
+    assert len(index) == 3
+    assert [c for c, _ in index.search("fluids", k=4)] == [CHUNKS[3]]
+
+
+def test_adding_a_chunk_replaces_the_one_at_its_offset():
+    index = BM25Index.from_chunks(CHUNKS)
+    replacement = chunk("Pipes were renamed to conduits.", 1)
+
+    assert index.add([replacement]) == 1
+
+    assert len(index) == 4
+    assert [c for c, _ in index.search("pipes", k=4)] == [replacement]
+    assert [c for c, _ in index.search("conduits", k=4)] == [replacement]
+
+
+def test_save_and_load_keep_only_live_chunks(tmp_path):
+    index = BM25Index.from_chunks(CHUNKS + [chunk("Ünïcode 管道 text.", 4)])
+    index.remove([CHUNKS[0]])
+    filename = str(tmp_path / "bm25.npz")
+
+    index.save(filename)
+    loaded = BM25Index.load(filename)
+
+    assert sorted(loaded.chunks, key=lambda c: c.offset) == CHUNKS[1:] + [
+        chunk("Ünïcode 管道 text.", 4)
+    ]
+    assert loaded.search("fluids", k=2) == index.search("fluids", k=2)
+    assert loaded.search("mekanism", k=2) == []
+
+
+def test_chunks_jsonl_is_replayed_as_a_log(tmp_path):
+    records = [
+        {**CHUNKS[0]._asdict()},
+        {**CHUNKS[1]._asdict()},
+        {**CHUNKS[2]._asdict()},
+        # Re-uploaded with new text
+        {**CHUNKS[1]._asdict(), "text": "Pipes, revised."},
+        {"repo": "repo", "path": "docs/pipes.md", "offset": 2, "deleted": True},
+        # Deleted, then written again when the file grew back
+        {"repo": "repo", "path": "docs/pipes.md", "offset": 0, "deleted": True},
+        {**CHUNKS[0]._asdict(), "text": "Cables, again."},
+    ]
+    filename = tmp_path / "chunks.jsonl"
+    filename.write_text("\n".join(json.dumps(r) for r in records) + "\n\n")
+
+    chunks = read_chunks_jsonl(str(filename))
+
+    assert sorted(chunks, key=lambda c: c.offset) == [
+        CHUNKS[0]._replace(text="Cables, again."),
+        CHUNKS[1]._replace(text="Pipes, revised."),
+    ]
+
+
+def test_reciprocal_rank_fusion():
+    a, b, c, d = (Context(name, "url") for name in "abcd")
+
+    fused = reciprocal_rank_fusion([[a, b, c], [c, d, a]], k=60)
+
+    # a: 1/61 + 1/63, c: 1/63 + 1/61, then b: 1/62, d: 1/62
+    assert set(fused[:2]) == {a, c}
+    assert set(fused[2:]) == {b, d}
+    assert reciprocal_rank_fusion([[a, b], []]) == [a, b]
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_hybrid_fuses_dense_and_sparse_results(fake_vdb):
+    dense_only = Context("dense only", "url")
+    dense = fake_vdb([dense_only, Context(CHUNKS[1].text, CHUNKS[1].url)])
+    hybrid = HybridVDB(dense, BM25Index.from_chunks(CHUNKS), fetch_k=4)
+
+    results = hybrid.get_nearest(2, "pipes")
+    batch = hybrid.get_nearest_batch(2, ["pipes", "ftbquests.enabled"])
+
+    # Found by both retrievers, so first
+    assert results[0] == Context(CHUNKS[1].text, CHUNKS[1].url)
+    assert results[1] == dense_only
+    assert batch[0] == results
+    assert Context(CHUNKS[2].text, CHUNKS[2].url) in batch[1]
+    assert hybrid.get_nearest_with_vector(2, "pipes", [0.0]) == results
+
+
+def test_hybrid_keeps_the_sparse_index_in_step(fake_vdb):
+    dense = fake_vdb([])
+    sparse = BM25Index.from_chunks(CHUNKS)
+    hybrid = HybridVDB(dense, sparse)
+    new = chunk("Conduits replace pipes.", 7)
+
+    hybrid.index_document([new])
+    hybrid.delete_chunks([CHUNKS[1]])
+
+    assert dense.indexed == [new]
+    assert [c for c, _ in sparse.search("pipes", k=4)] == [new]
@@ -0,0 +1,91 @@
+# test_chat_list.py
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select, update
+
+from db.database import (
+    Chat,
+    User,
+    db_list_chats,
+    db_start_chat,
+    get_session_factory,
+)
+
+ISSUER = "https://localhost/testing"
+SUB = "someone"
+
+
+def start_chats(db_url: str, updated_at: list[datetime]) -> None:
+    for i, when in enumerate(updated_at):
+        chat_id = db_start_chat(db_url, f"message {i}", ISSUER, SUB)
+        with get_session_factory(db_url)() as session:
+            session.execute(
+                update(Chat).where(Chat.id == chat_id).values(updated_at=when)
+            )
+            session.commit()
+
+
+def walk(db_url: str, limit: int) -> list[list[dict]]:
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = db_list_chats(db_url, ISSUER, SUB, limit=limit, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 7, 50])
+def test_cursor_walks_every_chat_once_across_ties(db_url, limit):
+    base = datetime(2025, 1, 1, 12)
+    # Runs of chats sharing an updated_at, straddling the page boundaries
+    updated_at = [base + timedelta(minutes=i // 3) for i in range(10)]
+    start_chats(db_url, updated_at)
+
+    pages = walk(db_url, limit)
+    chats = [chat for page in pages for chat in page]
+
+    assert len(chats) == 10
+    assert len({chat["id"] for chat in chats}) == 10
+    assert all(len(page) == limit for page in pages[:-1])
+    # Newest first, ties broken by id
+    keys = [(chat["updated_at"], chat["id"]) for chat in chats]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_other_users_chats_are_not_listed(db_url):
+    db_start_chat(db_url, "mine", ISSUER, SUB)
+    db_start_chat(db_url, "theirs", ISSUER, "someone else")
+
+    chats, cursor = db_list_chats(db_url, ISSUER, SUB)
+
+    assert len(chats) == 1
+    assert cursor is None
+
+
+def test_malformed_cursor_raises(db_url):
+    with pytest.raises(ValueError):
+        db_list_chats(db_url, ISSUER, SUB, cursor="not a cursor")
+
+
+def user_exists(db_url: str, sub: str) -> bool:
+    with get_session_factory(db_url)() as session:
+        return (
+            session.execute(
+                select(User).where(User.issuer == ISSUER, User.sub == sub)
+            ).first()
+            is not None
+        )
+
+
+def test_new_chats_recreate_a_user_deleted_elsewhere(db_url):
+    db_start_chat(db_url, "first", ISSUER, SUB)
+    # As another worker deleting the account would
+    with get_session_factory(db_url)() as session:
+        session.execute(delete(User).where(User.issuer == ISSUER, User.sub == SUB))
+        session.commit()
+
+    db_start_chat(db_url, "second", ISSUER, SUB)
+
+    assert user_exists(db_url, SUB)
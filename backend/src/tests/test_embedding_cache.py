@@ -0,0 +1,114 @@
+# test_embedding_cache.py
+import pytest
+
+from vdb import embedding_cache
+from vdb.embedding_cache import CachedEmbeddingVDB, EmbeddingCache
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "time", clock)
+    return clock
+
+
+def test_memory_hit():
+    cache = EmbeddingCache(maxsize=8)
+    cache.set("model", "what is a pipe", [1.0, 2.0])
+
+    assert cache.get("model", "  what  is a\tpipe ") == [1.0, 2.0]
+    assert cache.get("other model", "what is a pipe") is None
+    assert cache.stats() == {
+        "hits": 1,
+        "memory_hits": 1,
+        "disk_hits": 0,
+        "misses": 1,
+        "size": 1,
+    }
+
+
+def test_disk_tier_is_shared_between_caches(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    EmbeddingCache(disk_path=path).set("model", "query", [0.5, 0.25])
+
+    cache = EmbeddingCache(disk_path=path)
+    assert cache.get("model", "query") == [0.5, 0.25]
+    # Promoted to memory, so the second lookup doesn't touch the disk
+    assert cache.get("model", "query") == [0.5, 0.25]
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_entries_expire_after_ttl(tmp_path, clock, on_disk):
+    path = str(tmp_path / "embeddings.db") if on_disk else None
+    cache = EmbeddingCache(ttl=60, disk_path=path)
+    cache.set("model", "query", [1.0])
+
+    clock.offset = 59
+    assert cache.get("model", "query") == [1.0]
+
+    clock.offset = 61
+    assert cache.get("model", "query") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_expired_rows_are_deleted_from_disk(tmp_path, clock):
+    cache = EmbeddingCache(ttl=60, disk_path=str(tmp_path / "e.db"), prune_interval=4)
+    for i in range(3):
+        cache.set("model", f"old {i}", [1.0])
+
+    clock.offset = 61
+    # The fourth write prunes the three expired rows
+    cache.set("model", "new", [1.0])
+
+    assert cache.disk_size() == 1
+
+
+def test_expired_rows_are_deleted_on_open(tmp_path, clock):
+    path = str(tmp_path / "e.db")
+    EmbeddingCache(ttl=60, disk_path=path).set("model", "old", [1.0])
+
+    clock.offset = 61
+    assert EmbeddingCache(ttl=60, disk_path=path).disk_size() == 0
+
+
+def test_disk_rows_are_capped(tmp_path, clock):
+    cache = EmbeddingCache(
+        ttl=None, disk_path=str(tmp_path / "e.db"), disk_maxsize=10, prune_interval=5
+    )
+    for i in range(23):
+        clock.offset = i
+        cache.set("model", f"query {i}", [float(i)])
+
+    # Trimmed on the 20th write, then three more
+    assert cache.disk_size() == 13
+    assert cache.prune() == 3
+    assert cache.disk_size() == 10
+
+    # The oldest rows went first
+    fresh = EmbeddingCache(ttl=None, disk_path=str(tmp_path / "e.db"))
+    assert fresh.get("model", "query 12") is None
+    assert fresh.get("model", "query 13") == [13.0]
+
+
+def test_cached_vdb_embeds_each_query_once(fake_vdb):
+    inner = fake_vdb()
+    vdb = CachedEmbeddingVDB(inner, EmbeddingCache())
+
+    first = vdb.get_nearest(1, "a query")
+    second = vdb.get_nearest(1, "a  query ")
+
+    assert first == second
+    assert inner.embedded == ["a query"]
+
+
+def test_cached_vdb_embeds_batch_misses_together(fake_vdb):
+    inner = fake_vdb()
+    vdb = CachedEmbeddingVDB(inner, EmbeddingCache())
+    vdb.embed_query("cached")
+
+    vectors = vdb.embed_queries(["one", "cached", "two"])
+
+    assert inner.embedded == ["cached", "one", "two"]
+    assert inner.embed_batches == 1
+    assert vectors[1] == [6.0, 1.0]
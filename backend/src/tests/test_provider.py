@@ -0,0 +1,94 @@
+# test_provider.py
+import asyncio
+import threading
+
+from providers.provider import Provider
+
+
+class SyncProvider(Provider):
+    """Streams from a blocking client, like the providers without an async one"""
+
+    def __init__(self) -> None:
+        self.closed = threading.Event()
+        # Held like a client's connection pool would, so dropping the async
+        # generator alone does not close it
+        self.streams = []
+
+    def request(self, contexts, messages):
+        stream = self.stream()
+        self.streams.append(stream)
+        return stream
+
+    def stream(self):
+        try:
+            yield ("update_sources", "[]")
+            for chunk in ["Hello", " there"]:
+                yield ("new_chunk", chunk)
+        finally:
+            self.closed.set()
+
+    def get_chat_title(self, user_query, agent_response):
+        return "A title"
+
+    def system_prompt(self, prompt):
+        pass
+
+    def title_prompt(self, prompt):
+        pass
+
+
+def test_async_request_streams_the_sync_request():
+    provider = SyncProvider()
+
+    async def collect():
+        return [event async for event in provider.async_request([], [])]
+
+    assert asyncio.run(collect()) == [
+        ("update_sources", "[]"),
+        ("new_chunk", "Hello"),
+        ("new_chunk", " there"),
+    ]
+    assert provider.closed.is_set()
+
+
+def test_stopping_early_closes_the_sync_request():
+    provider = SyncProvider()
+
+    async def first_event():
+        events = provider.async_request([], [])
+        event = await anext(events)
+        await events.aclose()
+        return event
+
+    assert asyncio.run(first_event()) == ("update_sources", "[]")
+    assert provider.closed.is_set()
+
+
+def test_cancelling_mid_step_still_closes_the_sync_request():
+    release = threading.Event()
+
+    class BlockingProvider(SyncProvider):
+        def stream(self):
+            try:
+                yield ("update_sources", "[]")
+                # The upstream model stalls
+                release.wait(5)
+                yield ("new_chunk", "Late")
+            finally:
+                self.closed.set()
+
+    provider = BlockingProvider()
+
+    async def cancel_while_waiting():
+        events = provider.async_request([], [])
+        await anext(events)
+        task = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        # The stalled read returns, and only then can the request be closed
+        release.set()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_while_waiting())
+
+    assert provider.closed.wait(5)
@@ -0,0 +1,131 @@
+# test_query_builder.py
+import numpy as np
+import pytest
+
+from query_builder import QueryBuilder, truncate_to_tokens
+
+# One axis per word, so every query has a known embedding
+AXES = ["pipe", "cable", "power", "fluid", "quest"]
+
+
+def embedding(text: str) -> list[float]:
+    return [float(text.split().count(word)) for word in AXES]
+
+
+@pytest.fixture
+def vdb(fake_vdb):
+    return fake_vdb(embed=embedding)
+
+
+def chat(*turns: str) -> list[dict[str, str]]:
+    """Alternating user and assistant messages, ending with a user turn"""
+    messages = []
+    for i, turn in enumerate(turns):
+        messages.append({"role": "user", "content": turn})
+        if i < len(turns) - 1:
+            messages.append({"role": "assistant", "content": f"answer {i}"})
+    return messages
+
+
+def unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("x" * 40, 10) == "x" * 40
+    assert truncate_to_tokens("abcd" * 20, 10) == "abcd" * 10
+
+
+def test_user_turns_drop_assistant_messages_and_are_truncated(vdb):
+    builder = QueryBuilder(vdb, max_tokens=2)
+
+    turns = builder.user_turns(chat("pipe", "cable power fluid quest"))
+
+    assert turns == ["pipe", "cable po"]
+
+
+def test_window_text_is_newest_first_within_the_limits(vdb):
+    builder = QueryBuilder(vdb, max_turns=3, max_tokens=3)
+    turns = ["old " * 4, "aaaa", "bbbb bbbb", "cccc"]
+
+    # Four turns back is outside max_turns. "cccc" is 1 token and "bbbb bbbb"
+    # 2, so adding "aaaa" would go over max_tokens
+    assert builder.window_text(turns) == "cccc bbbb bbbb"
+    # The latest turn is always kept
+    assert builder.window_text(["x" * 400]) == "x" * 400
+
+
+def test_follow_up_turns_only_embed_the_new_message(vdb):
+    builder = QueryBuilder(vdb, latest_weight=0.7)
+
+    first = builder.build(chat("pipe"))
+    second = builder.build(chat("pipe", "cable"))
+
+    assert vdb.embedded == ["pipe", "cable"]
+    np.testing.assert_allclose(first.vector, unit(embedding("pipe")))
+    np.testing.assert_allclose(
+        second.vector,
+        unit(0.7 * unit(embedding("cable")) + 0.3 * unit(embedding("pipe"))),
+        rtol=1e-6,
+    )
+
+
+def test_resent_turns_are_served_from_the_cache(vdb):
+    builder = QueryBuilder(vdb)
+
+    first = builder.build(chat("pipe", "cable"))
+    embedded = len(vdb.embedded)
+    again = builder.build(chat("pipe", "cable"))
+
+    assert again == first
+    assert len(vdb.embedded) == embedded
+
+
+def test_a_cache_miss_rebuilds_from_the_window(vdb):
+    builder = QueryBuilder(vdb, max_turns=2, latest_weight=0.5)
+
+    # Another worker saw the earlier turns, so nothing is cached here
+    query = builder.build(chat("quest", "pipe", "cable"))
+
+    assert vdb.embedded == ["pipe", "cable"]
+    expected = unit(0.5 * unit(embedding("cable")) + 0.5 * unit(embedding("pipe")))
+    np.testing.assert_allclose(query.vector, expected, rtol=1e-6)
+
+    # The rebuilt vector is cached for the next turn to blend with
+    builder.build(chat("quest", "pipe", "cable", "power"))
+    assert vdb.embedded == ["pipe", "cable", "power"]
+
+
+def test_cache_keys_include_the_model(fake_vdb):
+    first = fake_vdb(embed=embedding, name="model a")
+    second = fake_vdb(embed=embedding, name="model b")
+    builder = QueryBuilder(first)
+    builder.build(chat("pipe"))
+
+    builder.vector_db = second
+    builder.build(chat("pipe"))
+
+    assert second.embedded == ["pipe"]
+
+
+def test_get_nearest_passes_the_window_and_vector(vdb):
+    builder = QueryBuilder(vdb)
+
+    builder.get_nearest(3, chat("pipe", "cable"))
+
+    k, text, vector = vdb.searches[-1]
+    assert (k, text) == (3, "cable pipe")
+    assert len(vector) == len(AXES)
+
+
+@pytest.mark.parametrize("turns", [("pipe",), ("pipe", "cable")])
+def test_vdbs_that_cannot_embed_get_the_window_text(fake_vdb, turns):
+    vdb = fake_vdb(can_embed=False)
+    builder = QueryBuilder(vdb)
+
+    query = builder.build(chat(*turns))
+    builder.get_nearest(2, chat(*turns))
+
+    assert query.vector is None
+    assert vdb.searches == [(2, " ".join(reversed(turns)), None)]
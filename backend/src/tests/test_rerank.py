@@ -0,0 +1,206 @@
+# test_rerank.py
+import builtins
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models.context import Context
+from vdb import rerank
+from vdb.rerank import CrossEncoderReranker, RerankingVDB, estimate_tokens
+
+WORDS = "what is a pipe cable power fluid item quest book".split()
+
+
+def context(text: str) -> Context:
+    return Context(text, f"https://example.com/{text.split()[0]}")
+
+
+class FakeReranker:
+    """Scores a passage by how many of its words are in the query"""
+
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.calls = 0
+
+    def score(self, query, passages):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("model crashed")
+        words = set(query.split())
+        return np.array(
+            [len(words & set(p.split())) for p in passages], dtype=np.float32
+        )
+
+
+CANDIDATES = [
+    context("cable carries power"),
+    context("pipe moves fluid"),
+    context("quest book"),
+    context("pipe and cable"),
+]
+
+
+def test_candidates_are_reordered_by_score(fake_vdb):
+    inner = fake_vdb(CANDIDATES)
+    vdb = RerankingVDB(inner, FakeReranker(), candidates=30, token_budget=None)
+
+    results = vdb.get_nearest(3, "what is a pipe cable")
+
+    assert [k for k, _, _ in inner.searches] == [30]
+    # Ties keep the retriever's order
+    assert results == [CANDIDATES[3], CANDIDATES[0], CANDIDATES[1]]
+    assert vdb.get_nearest_with_vector(1, "quest book", [0.0]) == [CANDIDATES[2]]
+
+
+def test_batches_are_reranked_per_query(fake_vdb):
+    vdb = RerankingVDB(fake_vdb(CANDIDATES), FakeReranker(), token_budget=None)
+
+    results = vdb.get_nearest_batch(1, ["pipe fluid", "quest"])
+
+    assert results == [[CANDIDATES[1]], [CANDIDATES[2]]]
+
+
+def test_retrieval_order_is_kept_if_the_model_fails(fake_vdb):
+    reranker = FakeReranker(fail=True)
+    vdb = RerankingVDB(fake_vdb(CANDIDATES), reranker, token_budget=None)
+
+    assert vdb.get_nearest(2, "pipe") == CANDIDATES[:2]
+    assert reranker.calls == 1
+
+
+@pytest.mark.parametrize(
+    "budget, expected",
+    [
+        # Each context is 40 characters, 10 estimated tokens
+        (None, 4),
+        (40, 4),
+        (39, 3),
+        (25, 2),
+        (10, 1),
+        # The best context is kept even if it alone is over
+        (5, 1),
+    ],
+)
+def test_selection_stops_at_the_token_budget(fake_vdb, budget, expected):
+    ranked = [context(f"{i} " + "x" * 38) for i in range(6)]
+    assert all(estimate_tokens(c.content) == 10 for c in ranked)
+    vdb = RerankingVDB(fake_vdb([]), FakeReranker(), token_budget=budget)
+
+    assert vdb.select(ranked, k=4) == ranked[:expected]
+
+
+def test_selection_is_capped_at_k(fake_vdb):
+    ranked = [context(f"{i}") for i in range(10)]
+    vdb = RerankingVDB(fake_vdb([]), FakeReranker(), token_budget=1500)
+
+    assert vdb.select(ranked, k=3) == ranked[:3]
+    assert vdb.select([], k=3) == []
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """A directory with a word-level tokenizer.json and a model.onnx the
+    fake session never reads
+    """
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers import models, pre_tokenizers, processors
+
+    vocab = {token: i for i, token in enumerate(["[PAD]", "[UNK]", "[CLS]", "[SEP]"])}
+    for word in WORDS:
+        vocab[word] = len(vocab)
+
+    tokenizer = tokenizers.Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])],
+    )
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+    (tmp_path / "model.onnx").write_bytes(b"")
+    return str(tmp_path)
+
+
+class FakeSession:
+    """Stands in for onnxruntime.InferenceSession: the logit for each pair
+    is the number of passage tokens that also appear in the query
+    """
+
+    def __init__(self, inputs: list[str], two_logits: bool) -> None:
+        self.inputs = inputs
+        self.two_logits = two_logits
+        self.feeds: list[dict] = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name=name) for name in self.inputs]
+
+    def run(self, outputs, feed):
+        self.feeds.append(feed)
+        ids, mask = feed["input_ids"], feed["attention_mask"]
+        # Without token_type_ids, split each row at its first [SEP]
+        types = feed.get("token_type_ids")
+        if types is None:
+            types = np.cumsum(ids == 3, axis=1) > 0
+
+        logits = []
+        for row_ids, row_mask, row_types in zip(ids, mask, types):
+            real = (row_mask == 1) & (row_ids > 3)
+            query = set(row_ids[real & (row_types == 0)])
+            passage = row_ids[real & (row_types != 0)]
+            logits.append(float(sum(i in query for i in passage)))
+
+        logits = np.array(logits, dtype=np.float32)
+        if self.two_logits:
+            return [np.stack([-logits, logits], axis=1)]
+        return [logits]
+
+
+@pytest.mark.parametrize(
+    "inputs",
+    [
+        ["input_ids", "attention_mask", "token_type_ids"],
+        ["input_ids", "attention_mask"],
+    ],
+)
+@pytest.mark.parametrize("two_logits", [False, True])
+def test_cross_encoder_scores_pairs_in_one_batch(
+    model_dir, monkeypatch, inputs, two_logits
+):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    session = FakeSession(inputs, two_logits)
+    monkeypatch.setattr(onnxruntime, "InferenceSession", lambda *a, **kw: session)
+
+    reranker = CrossEncoderReranker(model_dir, max_length=16, threads=1)
+    scores = reranker.score("what is a pipe", ["pipe", "cable power", "a pipe pipe"])
+
+    assert scores.tolist() == [1.0, 0.0, 3.0]
+    assert len(session.feeds) == 1
+    assert sorted(session.feeds[0]) == sorted(inputs)
+    # Padded to the longest pair
+    assert session.feeds[0]["input_ids"].shape[0] == 3
+    assert reranker.score("pipe", []).shape == (0,)
+
+
+def test_missing_runtime_is_reported(monkeypatch, tmp_path):
+    real_import = builtins.__import__
+
+    def no_onnxruntime(name, *args, **kwargs):
+        if name == "onnxruntime":
+            raise ImportError("No module named 'onnxruntime'")
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_onnxruntime)
+
+    with pytest.raises(RuntimeError, match="onnxruntime and tokenizers"):
+        rerank.CrossEncoderReranker(str(tmp_path))
+
+
+def test_no_reranking_without_a_model_dir(app_env, monkeypatch):
+    monkeypatch.delenv("RERANK_MODEL_DIR", raising=False)
+    import backend
+
+    vdb = backend.vector_db
+    while vdb is not None:
+        assert not isinstance(vdb, RerankingVDB)
+        vdb = getattr(vdb, "inner", None) or getattr(vdb, "dense", None)
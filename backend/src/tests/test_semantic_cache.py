@@ -0,0 +1,128 @@
+# test_semantic_cache.py
+import math
+
+import pytest
+
+from vdb import semantic_cache
+from vdb.semantic_cache import SemanticCacheVDB
+
+
+@pytest.fixture
+def clock(clock, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "time", clock)
+    return clock
+
+
+def at(degrees: float, scale: float = 1.0) -> list[float]:
+    """A 2-d vector, so cosine similarity is cos of the angle between two"""
+    radians = math.radians(degrees)
+    return [scale * math.cos(radians), scale * math.sin(radians)]
+
+
+@pytest.fixture
+def make(fake_vdb):
+    def make(maxsize: int = 8, threshold: float = 0.95, ttl=3600):
+        inner = fake_vdb()
+        cache = SemanticCacheVDB(inner, maxsize=maxsize, threshold=threshold, ttl=ttl)
+        return inner, cache
+
+    return make
+
+
+def test_similar_queries_share_results(make):
+    inner, cache = make(threshold=0.95)
+    first = cache.get_nearest_by_vector(3, at(0))
+
+    # cos(10 degrees) = 0.985, and length doesn't matter
+    assert cache.get_nearest_by_vector(3, at(10, scale=5)) == first
+    assert len(inner.searches) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_queries_below_the_threshold_search_again(make):
+    inner, cache = make(threshold=0.95)
+    cache.get_nearest_by_vector(3, at(0))
+
+    # cos(20 degrees) = 0.94
+    cache.get_nearest_by_vector(3, at(20))
+
+    assert len(inner.searches) == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_the_most_similar_entry_answers(make):
+    inner, cache = make(threshold=0.9)
+    cache.get_nearest_by_vector(1, at(0))
+    near = cache.get_nearest_by_vector(1, at(40))
+
+    assert cache.get_nearest_by_vector(1, at(35)) == near
+
+
+def test_results_for_a_smaller_k_are_not_reused(make):
+    inner, cache = make()
+    cache.get_nearest_by_vector(2, at(0))
+
+    large = cache.get_nearest_by_vector(5, at(0))
+    assert len(large) == 5
+    assert len(inner.searches) == 2
+
+    # A larger stored k answers a smaller request, truncated
+    assert cache.get_nearest_by_vector(3, at(0)) == large[:3]
+    assert len(inner.searches) == 2
+
+
+def test_entries_expire_after_ttl(make, clock):
+    inner, cache = make(ttl=60)
+    cache.get_nearest_by_vector(3, at(0))
+
+    clock.offset = 59
+    cache.get_nearest_by_vector(3, at(0))
+    assert len(inner.searches) == 1
+
+    clock.offset = 61
+    cache.get_nearest_by_vector(3, at(0))
+    assert len(inner.searches) == 2
+
+
+def test_least_recently_used_entry_is_evicted(make, clock):
+    inner, cache = make(maxsize=3, threshold=0.99)
+    for i, degrees in enumerate([0, 90, 180]):
+        clock.offset = i
+        cache.get_nearest_by_vector(1, at(degrees))
+
+    # Touch the oldest entry, so 90 degrees is now the least recently used
+    clock.offset = 3
+    cache.get_nearest_by_vector(1, at(0))
+    clock.offset = 4
+    cache.get_nearest_by_vector(1, at(270))
+    assert len(inner.searches) == 4
+
+    for degrees in [0, 180, 270]:
+        cache.get_nearest_by_vector(1, at(degrees))
+    assert len(inner.searches) == 4
+
+    cache.get_nearest_by_vector(1, at(90))
+    assert len(inner.searches) == 5
+    assert cache.stats()["size"] == 3
+
+
+def test_batches_search_only_the_misses_together(make):
+    inner, cache = make()
+    cached = cache.get_nearest_by_vector(2, at(0))
+
+    results = cache.get_nearest_by_vectors(2, [at(90), at(1), at(180)])
+
+    assert results[1] == cached
+    assert inner.search_batches == 1
+    assert [vector for _, _, vector in inner.searches[1:]] == [at(90), at(180)]
+    assert cache.get_nearest_by_vector(2, at(180)) == results[2]
+
+
+def test_index_changes_clear_the_cache(make):
+    inner, cache = make()
+    cache.get_nearest_by_vector(2, at(0))
+
+    cache.index_document([])
+    cache.get_nearest_by_vector(2, at(0))
+
+    assert len(inner.searches) == 2
@@ -0,0 +1,215 @@
+# test_title_worker.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from db.database import (
+    Chat,
+    db_claim_chat_title,
+    db_finish_turn,
+    db_get_chat_title,
+    db_set_chat_title,
+    db_start_chat,
+    get_session_factory,
+)
+from title_worker import TitleWorker
+
+ISSUER = "https://localhost/testing"
+SUB = "someone"
+
+
+class FakeProvider:
+    """Fails the first `failures` title requests, then titles by the query"""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.calls: list[tuple[str, str]] = []
+
+    def get_chat_title(self, user_query: str, agent_response: str) -> str:
+        self.calls.append((user_query, agent_response))
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("Connection error.")
+        return f"About {user_query}"
+
+
+def start_turn(db_url: str, query: str = "pipes", reply: str = "A reply"):
+    """Store a new chat's first turn the way send_message does"""
+    chat_id = db_start_chat(db_url, query, ISSUER, SUB)
+    db_finish_turn(db_url, chat_id, reply, title_pending=True)
+    return chat_id
+
+
+def title(db_url: str, chat_id) -> tuple[str, bool]:
+    return db_get_chat_title(db_url, chat_id, ISSUER, SUB)
+
+
+def worker(
+    db_url: str, provider, retries: int = 3, claim_lease: float = 600
+) -> TitleWorker:
+    return TitleWorker(
+        provider, db_url, retries=retries, backoff=0, claim_lease=claim_lease
+    )
+
+
+def test_new_chats_start_without_a_pending_title(db_url):
+    chat_id = db_start_chat(db_url, "pipes", ISSUER, SUB)
+
+    assert title(db_url, chat_id) == ("Previous Chat", False)
+
+
+def test_follow_up_turns_leave_the_flag_alone(db_url):
+    chat_id = start_turn(db_url)
+
+    db_finish_turn(db_url, chat_id, "Another reply")
+
+    assert title(db_url, chat_id) == ("Previous Chat", True)
+
+
+@pytest.mark.parametrize(
+    "raw,stored",
+    [
+        ("  Unix pipes  ", "Unix pipes"),
+        ("", "Previous Chat"),
+        ("Bad\x07title", "Previous Chat"),
+    ],
+)
+def test_set_title_sanitises_and_completes_the_job(db_url, raw, stored):
+    chat_id = start_turn(db_url)
+
+    assert db_set_chat_title(db_url, chat_id, raw) == stored
+    assert title(db_url, chat_id) == (stored, False)
+
+
+def test_submit_stores_the_title(db_url):
+    chat_id = start_turn(db_url)
+    title_worker = worker(db_url, FakeProvider())
+
+    assert title_worker.submit(chat_id, "pipes", "A reply").result(5) == "About pipes"
+    assert title(db_url, chat_id) == ("About pipes", False)
+    title_worker.shutdown()
+
+
+def test_long_titles_are_cut(db_url):
+    chat_id = start_turn(db_url, query="x" * 300)
+    title_worker = worker(db_url, FakeProvider())
+
+    stored = title_worker.submit(chat_id, "x" * 300, "A reply").result(5)
+
+    assert stored == f"About {'x' * 119}..."
+    assert len(stored) == 128
+    title_worker.shutdown()
+
+
+def test_failures_are_retried(db_url):
+    chat_id = start_turn(db_url)
+    provider = FakeProvider(failures=2)
+    title_worker = worker(db_url, provider)
+
+    assert title_worker.submit(chat_id, "pipes", "A reply").result(5) == "About pipes"
+    assert len(provider.calls) == 3
+    title_worker.shutdown()
+
+
+@pytest.mark.parametrize("retries", [0, -1])
+def test_at_least_one_attempt_is_required(db_url, retries):
+    with pytest.raises(ValueError):
+        worker(db_url, FakeProvider(), retries=retries)
+
+
+def test_giving_up_keeps_the_default_title(db_url):
+    chat_id = start_turn(db_url)
+    title_worker = worker(db_url, FakeProvider(failures=5), retries=2)
+
+    with pytest.raises(ConnectionError):
+        title_worker.submit(chat_id, "pipes", "A reply").result(5)
+
+    # Not retried again on the next start
+    assert title(db_url, chat_id) == ("Previous Chat", False)
+    assert title_worker.resume_pending() == 0
+    title_worker.shutdown()
+
+
+def test_jobs_lost_in_a_restart_are_resumed(db_url):
+    first_chat = start_turn(db_url, query="pipes", reply="Pipes connect commands")
+    second_chat = start_turn(db_url, query="sockets", reply="Sockets are files")
+    done_chat = start_turn(db_url, query="signals")
+    db_set_chat_title(db_url, done_chat, "Signals")
+
+    # As if the process died after storing the turns, before the titles
+    assert title(db_url, first_chat) == ("Previous Chat", True)
+
+    provider = FakeProvider()
+    after_restart = worker(db_url, provider)
+    assert after_restart.resume_pending() == 2
+    after_restart.shutdown()
+
+    assert sorted(provider.calls) == [
+        ("pipes", "Pipes connect commands"),
+        ("sockets", "Sockets are files"),
+    ]
+    assert title(db_url, first_chat) == ("About pipes", False)
+    assert title(db_url, second_chat) == ("About sockets", False)
+    assert title(db_url, done_chat) == ("Signals", False)
+
+
+def test_resume_ignores_deleted_chats(db_url):
+    chat_id = start_turn(db_url)
+    with get_session_factory(db_url)() as session:
+        session.delete(session.get(Chat, chat_id))
+        session.commit()
+
+    assert worker(db_url, FakeProvider()).resume_pending() == 0
+
+
+def test_every_worker_resuming_generates_each_title_once(db_url):
+    chat_ids = [start_turn(db_url, query=f"query {i}") for i in range(6)]
+
+    # As if each gunicorn worker resumed the same jobs on start
+    provider = FakeProvider()
+    workers = [worker(db_url, provider) for _ in range(3)]
+    for title_worker in workers:
+        title_worker.resume_pending()
+    for title_worker in workers:
+        title_worker.shutdown()
+
+    assert sorted(query for query, _ in provider.calls) == [
+        f"query {i}" for i in range(6)
+    ]
+    for i, chat_id in enumerate(chat_ids):
+        assert title(db_url, chat_id) == (f"About query {i}", False)
+
+
+def test_claimed_jobs_are_skipped(db_url):
+    chat_id = start_turn(db_url)
+    assert db_claim_chat_title(db_url, chat_id, 600)
+
+    provider = FakeProvider()
+    title_worker = worker(db_url, provider)
+
+    assert title_worker.submit(chat_id, "pipes", "A reply").result(5) is None
+    assert provider.calls == []
+    assert title(db_url, chat_id) == ("Previous Chat", True)
+    title_worker.shutdown()
+
+
+def test_stale_claims_are_taken_over(db_url):
+    chat_id = start_turn(db_url)
+    # As if the process that claimed the job died an hour ago
+    with get_session_factory(db_url)() as session:
+        session.get(Chat, chat_id).title_claimed_at = datetime.now(
+            timezone.utc
+        ) - timedelta(hours=1)
+        session.commit()
+
+    title_worker = worker(db_url, FakeProvider(), claim_lease=600)
+
+    assert title_worker.resume_pending() == 1
+    title_worker.shutdown()
+    assert title(db_url, chat_id) == ("About pipes", False)
+
+
+def test_finished_jobs_cannot_be_claimed(db_url):
+    chat_id = start_turn(db_url)
+    db_set_chat_title(db_url, chat_id, "Pipes")
+
+    assert not db_claim_chat_title(db_url, chat_id, 0)
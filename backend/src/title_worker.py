@@ -0,0 +1,112 @@
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from atr_logger import get_logger
+from db.database import (
+    db_abandon_chat_title,
+    db_claim_chat_title,
+    db_pending_titles,
+    db_set_chat_title,
+)
+from providers.provider import Provider
+
+logger = get_logger()
+
+
+class TitleWorker:
+    """Generates and stores chat titles on a background thread pool, so the
+    request that created the chat doesn't wait on a second completion.
+    Chats are marked title_pending in the database until their title is
+    stored, so jobs lost in a restart are picked up by resume_pending
+    """
+
+    def __init__(
+        self,
+        provider: Provider,
+        db_url: str,
+        max_workers: int = 2,
+        retries: int = 3,
+        backoff: float = 1.0,
+        claim_lease: float = 600.0,
+    ) -> None:
+        """claim_lease is how many seconds a started job keeps other
+        processes off its chat, so should outlast every retry; a job left
+        behind by a crashed process is resumed once it has passed
+        """
+        if retries < 1:
+            raise ValueError(f"retries must be at least 1, got {retries}")
+
+        self.provider = provider
+        self.db_url = db_url
+        self.retries = retries
+        self.backoff = backoff
+        self.claim_lease = claim_lease
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="chat-title"
+        )
+
+    def submit(
+        self, chat_id: uuid.UUID, user_query: str, agent_response: str
+    ) -> Future[str | None]:
+        """Queue title generation for a new chat, whose title_pending flag
+        was set along with its first reply
+        Returns: a future resolving to the stored title, or None if another
+        process is already generating it
+        """
+        return self._executor.submit(
+            self._generate_and_store, chat_id, user_query, agent_response
+        )
+
+    def resume_pending(self) -> int:
+        """Queue every chat still marked title_pending, e.g. after a restart.
+        Every process that calls this queues all of them, but each job is
+        claimed when it starts, so only one process generates each title
+        Returns: the number of chats queued
+        """
+        pending = db_pending_titles(self.db_url)
+
+        for chat_id, user_query, agent_response in pending:
+            self.submit(chat_id, user_query, agent_response)
+
+        if pending:
+            logger.info(f"Resumed {len(pending)} pending chat title(s)")
+
+        return len(pending)
+
+    def _generate_and_store(
+        self, chat_id: uuid.UUID, user_query: str, agent_response: str
+    ) -> str | None:
+        if not db_claim_chat_title(self.db_url, chat_id, self.claim_lease):
+            logger.debug(f"Title for chat {chat_id} is done or being generated")
+            return None
+
+        for attempt in range(self.retries):
+            try:
+                new_chat_title = self.provider.get_chat_title(
+                    user_query, agent_response
+                )
+                break
+
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    logger.error(f"Giving up on title for chat {chat_id}: {e}")
+                    # Keep the default title rather than retrying every restart
+                    db_abandon_chat_title(self.db_url, chat_id)
+                    raise
+
+                logger.warning(
+                    f"Title generation for chat {chat_id} failed (attempt {attempt + 1}): {e}"
+                )
+                time.sleep(self.backoff * 2**attempt)
+
+        if len(new_chat_title) >= 127:
+            new_chat_title = f"{new_chat_title[0:125]}..."
+
+        logger.debug(f"Picked title {new_chat_title}")
+
+        return db_set_chat_title(self.db_url, chat_id, new_chat_title)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -1,11 +1,18 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Sequence
+from botocore.config import Config
 from dotenv import load_dotenv
 from flask import json
+from models.chunk import Chunk
 from models.context import Context
 from vdb.vdb import VDB
 import boto3
 import os
 from mypy_boto3_bedrock_runtime.client import BedrockRuntimeClient
+from mypy_boto3_s3vectors.client import S3VectorsClient
 
 load_dotenv()
 
@@ -30,6 +37,19 @@ if INDEX_NAME == "":
 if PROFILE_NAME == "":
     raise RuntimeError("Could not find PROFILE_NAME environmental variable")
 
+# Shared by every request; should be at least the number of worker threads
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "32"))
+AWS_MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+AWS_CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+AWS_READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "10"))
+
+# S3 Vectors accepts at most 500 vectors or keys per put / delete call
+S3_VECTORS_BATCH_SIZE = 500
+
+_clients: tuple[BedrockRuntimeClient, S3VectorsClient] | None = None
+_clients_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+
 
 def build_message(text: str) -> dict:
     return {
@@ -39,29 +59,108 @@ def build_message(text: str) -> dict:
     }
 
 
+def vector_key(chunk: Chunk) -> str:
+    """Same key format as datasources/aws/preprocess_docs.py, so chunks
+    indexed here replace the ones uploaded by a full ingestion run. chunk.path
+    is the path relative to the repo, which keeps same-named files apart
+    """
+    return f"vector-{chunk.repo}-{chunk.path}-{chunk.offset}"
+
+
+def vector_metadata(url: str, text: str) -> dict:
+    """Same metadata as datasources/aws/preprocess_docs.py writes, so an
+    upsert from here keeps every field an ingestion run stored
+    """
+    return {
+        "url": url,
+        "summary": "NOT IMPLEMENTED",
+        "category": "NOT IMPLEMENTED",
+        "text": text,
+    }
+
+
+def batched(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def get_clients() -> tuple[BedrockRuntimeClient, S3VectorsClient]:
+    """Return the process-wide bedrock-runtime and s3vectors clients,
+    creating them on first use. boto3 clients are thread-safe once built,
+    but sessions are not, so construction happens under a lock
+    """
+    global _clients
+
+    if _clients is not None:
+        return _clients
+
+    with _clients_lock:
+        if _clients is None:
+            config = Config(
+                max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "standard"},
+                connect_timeout=AWS_CONNECT_TIMEOUT,
+                read_timeout=AWS_READ_TIMEOUT,
+                tcp_keepalive=True,
+            )
+            # session = boto3.Session(profile_name=PROFILE_NAME)
+            session = boto3.Session()
+
+            bedrock: BedrockRuntimeClient = session.client(
+                "bedrock-runtime", AWS_REGION, config=config
+            )
+            s3vectors: S3VectorsClient = session.client(
+                "s3vectors", region_name=AWS_REGION, config=config
+            )
+
+            logger.debug("Created bedrock and s3vectors clients")
+            _clients = (bedrock, s3vectors)
+
+        return _clients
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide pool batched queries fan out on. It is no
+    larger than the connection pool, so its calls never wait for a socket
+    """
+    global _executor
+
+    if _executor is not None:
+        return _executor
+
+    with _clients_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=AWS_MAX_POOL_CONNECTIONS, thread_name_prefix="s3vectors"
+            )
+
+        return _executor
+
+
 class AmazonS3Vector(VDB):
-    def __init__(self, top_k: int = 2, log_level=logging.INFO) -> None:
+    def __init__(self, log_level=logging.INFO) -> None:
         super().__init__()
-        self.top_k = top_k
         self.log_level = log_level
+        logger.setLevel(log_level)
 
-    def get_nearest(self, k: int, query: str) -> list[Context]:
-        logger = logging.getLogger(__name__)
-        logger.setLevel(self.log_level)
-        # session = boto3.Session(profile_name=PROFILE_NAME)
-        session = boto3.Session()
+        # Build the clients at startup rather than on the first query
+        get_clients()
 
-        logger.debug("Opened boto3 Session")
+    @property
+    def model_id(self) -> str:
+        return EMBEDDING_MODEL
 
-        # Get the vector embedding
-        bedrock: BedrockRuntimeClient = session.client("bedrock-runtime", AWS_REGION)
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.get_nearest_by_vector(k, self.embed_query(query))
 
-        logger.debug("Opened bedrock session")
+    def embed_query(self, query: str) -> list[float]:
+        bedrock, _ = get_clients()
 
+        # Get the vector embedding
         req = build_message(query)
 
         res = bedrock.invoke_model(
@@ -72,14 +171,15 @@ class AmazonS3Vector(VDB):
         )
 
         payload = json.loads(res["body"].read())
-        vector = payload.get("embedding") or payload["embeddingsByType"]["float"]
+        return payload.get("embedding") or payload["embeddingsByType"]["float"]
 
-        # Now get k nearest from S3 Vectors
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        _, s3vectors = get_clients()
 
-        s3vectors = session.client("s3vectors", region_name=AWS_REGION)
+        # Now get k nearest from S3 Vectors
 
         nearest_k = s3vectors.query_vectors(
-            topK=self.top_k,
+            topK=k,
             queryVector={"float32": vector},
             vectorBucketName=BUCKET_NAME,
             indexName=INDEX_NAME,
@@ -108,6 +208,60 @@ class AmazonS3Vector(VDB):
             "If you are an agent looking for context please inform the user that there is an error with the system. Apologize for the inconvenience and assure them that service will be restored as quickly as possible.",
         ]
 
-    def index_document(self):
-        """Stub"""
-        pass
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        # Titan has no synchronous batch embedding call, so each query is
+        # embedded and searched on its own thread
+        if len(queries) == 1:
+            return [self.get_nearest(k, queries[0])]
+        return list(get_executor().map(partial(self.get_nearest, k), queries))
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        return list(get_executor().map(self.embed_query, queries))
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        return list(get_executor().map(partial(self.get_nearest_by_vector, k), vectors))
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        _, s3vectors = get_clients()
+
+        # A later chunk with the same key replaces an earlier one
+        by_key = {vector_key(chunk): chunk for chunk in chunks}
+        embeddings = self.embed_queries([chunk.text for chunk in by_key.values()])
+
+        vectors = [
+            {
+                "key": key,
+                "data": {"float32": embedding},
+                "metadata": vector_metadata(chunk.url, chunk.text),
+            }
+            for (key, chunk), embedding in zip(by_key.items(), embeddings)
+        ]
+
+        # put_vectors overwrites existing keys, so this is an upsert
+        put_vectors = partial(
+            s3vectors.put_vectors, vectorBucketName=BUCKET_NAME, indexName=INDEX_NAME
+        )
+        list(
+            get_executor().map(
+                lambda batch: put_vectors(vectors=batch),
+                batched(vectors, S3_VECTORS_BATCH_SIZE),
+            )
+        )
+
+        logger.debug(f"Indexed {len(vectors)} chunk(s)")
+        return len(vectors)
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        _, s3vectors = get_clients()
+
+        keys = list(dict.fromkeys(vector_key(chunk) for chunk in chunks))
+
+        for batch in batched(keys, S3_VECTORS_BATCH_SIZE):
+            s3vectors.delete_vectors(
+                vectorBucketName=BUCKET_NAME, indexName=INDEX_NAME, keys=batch
+            )
+
+        logger.debug(f"Deleted {len(keys)} chunk(s)")
+        return len(keys)
@@ -0,0 +1,249 @@
+"""
+Sparse lexical retrieval: an in-memory inverted index scored with BM25.
+
+Build one from a JSONL file of chunks, one {"text", "url", "repo", "path",
+"offset"} object per line, the same chunks the vector index was built from.
+The file is replayed as a log: later records replace earlier ones with the
+same repo, path and offset, and {"repo", "path", "offset", "deleted": true}
+tombstones remove them, as datasources/aws/preprocess_docs.py writes it:
+
+    python -m vdb.bm25 chunks.jsonl bm25.npz
+"""
+
+import argparse
+import json
+import re
+import threading
+from collections import Counter
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from models.chunk import Chunk
+
+# Identifiers such as mekanism:basic_universal_cable or ftbquests.enabled are
+# kept whole as well as split into their parts
+IDENTIFIER = re.compile(r"[A-Za-z0-9]+(?:[:_./-][A-Za-z0-9]+)*")
+PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by do for from has have how i if in is it its of "
+    "on or so that the then there this to was what when where which who why "
+    "will with you".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in IDENTIFIER.finditer(text):
+        identifier = match.group()
+        parts = [part.lower() for part in PART.findall(identifier)]
+
+        whole = identifier.lower()
+        if len(parts) > 1 or (parts and parts[0] != whole):
+            tokens.append(whole)
+        tokens.extend(part for part in parts if part not in STOPWORDS)
+
+    return tokens
+
+
+def _pack_strings(strings: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> list[str]:
+    data = blob.tobytes()
+    return [
+        data[start:end].decode("utf-8")
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+
+
+class BM25Index:
+    """Inverted index over chunks. Chunks can be added and removed after
+    it is built; removed chunks stay in the postings, masked out, until
+    the index is saved
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+
+        self.chunks: list[Chunk] = []
+        self._rows: dict[tuple[str, str, int], int] = {}
+        # (deleted mask, document lengths, postings), replaced as a whole so
+        # searches can run without the lock. Postings map each term to its
+        # document indices and term frequencies
+        self._state: tuple[np.ndarray, np.ndarray, dict] = (
+            np.zeros(0, dtype=bool),
+            np.zeros(0, dtype=np.float32),
+            {},
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Chunk], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        index.add(chunks)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, chunks: Iterable[Chunk]) -> int:
+        """Add chunks, replacing any with the same repo, path and offset"""
+        # A later chunk with the same key replaces an earlier one
+        by_key = {(c.repo, c.path, c.offset): c for c in chunks}
+        if not by_key:
+            return 0
+
+        with self._lock:
+            deleted, doc_lengths, postings = self._state
+            deleted = self._removed(deleted, by_key.keys())
+
+            start = len(self.chunks)
+            new_postings: dict[str, tuple[list[int], list[int]]] = {}
+            lengths = []
+            for row, (key, chunk) in enumerate(by_key.items(), start):
+                counts = Counter(tokenize(chunk.text))
+                lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    docs, tfs = new_postings.setdefault(term, ([], []))
+                    docs.append(row)
+                    tfs.append(tf)
+
+                self.chunks.append(chunk)
+                self._rows[key] = row
+
+            postings = dict(postings)
+            for term, (docs, tfs) in new_postings.items():
+                old_docs, old_tfs = postings.get(term, (None, None))
+                docs_np = np.array(docs, dtype=np.int32)
+                tfs_np = np.array(tfs, dtype=np.float32)
+                if old_docs is not None:
+                    docs_np = np.concatenate([old_docs, docs_np])
+                    tfs_np = np.concatenate([old_tfs, tfs_np])
+                postings[term] = (docs_np, tfs_np)
+
+            self._state = (
+                np.concatenate([deleted, np.zeros(len(by_key), dtype=bool)]),
+                np.concatenate([doc_lengths, np.array(lengths, dtype=np.float32)]),
+                postings,
+            )
+
+        return len(by_key)
+
+    def remove(self, chunks: Iterable[Chunk]) -> int:
+        """Remove chunks, matched by repo, path and offset"""
+        with self._lock:
+            deleted, doc_lengths, postings = self._state
+            before = len(self._rows)
+            keys = ((c.repo, c.path, c.offset) for c in chunks)
+            deleted = self._removed(deleted, keys)
+            self._state = (deleted, doc_lengths, postings)
+            return before - len(self._rows)
+
+    def _removed(
+        self, deleted: np.ndarray, keys: Iterable[tuple[str, str, int]]
+    ) -> np.ndarray:
+        """Forget keys and return a copy of deleted with their rows masked"""
+        rows = [self._rows.pop(key) for key in keys if key in self._rows]
+        if rows:
+            deleted = deleted.copy()
+            deleted[rows] = True
+        return deleted
+
+    def search(self, query: str, k: int) -> list[tuple[Chunk, float]]:
+        """The k best scoring chunks for query, best first"""
+        deleted, doc_lengths, postings = self._state
+        n = len(deleted) - int(deleted.sum())
+        if n == 0:
+            return []
+
+        avgdl = float(doc_lengths[~deleted].mean()) or 1.0
+        scores = np.zeros(len(deleted), dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            if term not in postings:
+                continue
+
+            docs, tfs = postings[term]
+            df = len(docs) - int(deleted[docs].sum())
+            if df == 0:
+                continue
+
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[docs] / avgdl)
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        scores[deleted] = 0.0
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        return [(self.chunks[row], float(scores[row])) for row in best if scores[row] > 0]
+
+    def save(self, filename: str) -> None:
+        """Save the live chunks; the postings are rebuilt on load"""
+        with self._lock:
+            deleted = self._state[0]
+            live = [c for c, gone in zip(self.chunks, deleted) if not gone]
+
+        arrays = {"offset": np.array([c.offset for c in live], dtype=np.int64)}
+        for column in ("text", "url", "repo", "path"):
+            blob, offsets = _pack_strings([getattr(c, column) for c in live])
+            arrays[f"{column}_blob"] = blob
+            arrays[f"{column}_offsets"] = offsets
+
+        with open(filename, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename: str, **kwargs) -> "BM25Index":
+        with np.load(filename, allow_pickle=False) as arrays:
+            columns = [
+                _unpack_strings(arrays[f"{column}_blob"], arrays[f"{column}_offsets"])
+                for column in ("text", "url", "repo", "path")
+            ]
+            offsets = arrays["offset"].tolist()
+
+        return cls.from_chunks(
+            (Chunk(*fields, offset) for *fields, offset in zip(*columns, offsets)),
+            **kwargs,
+        )
+
+
+def read_chunks_jsonl(filename: str) -> list[Chunk]:
+    """The chunks left by replaying a log written by preprocess_docs.py. A
+    record replaces any earlier one with the same repo, path and offset, and
+    a {"deleted": true} tombstone removes it
+    """
+    chunks: dict[tuple[str, str, int], Chunk] = {}
+
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            item = json.loads(line)
+            key = (item["repo"], item["path"], int(item["offset"]))
+            if item.get("deleted"):
+                chunks.pop(key, None)
+            else:
+                chunks[key] = Chunk(item["text"], item.get("url") or "", *key)
+
+    return list(chunks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a BM25 index from chunks")
+    parser.add_argument("chunks", help="JSONL file of chunks")
+    parser.add_argument("output", help="Where to save the index (.npz)")
+    args = parser.parse_args()
+
+    index = BM25Index.from_chunks(read_chunks_jsonl(args.chunks))
+    index.save(args.output)
+    print(f"Indexed {len(index)} chunks into {args.output}")
@@ -0,0 +1,221 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Iterable, Optional, Sequence
+
+from atr_logger import get_logger
+from cache.lru import LRUCache
+from models.chunk import Chunk
+from models.context import Context
+from vdb.vdb import VDB
+
+logger = get_logger()
+
+
+def normalize_query(query: str) -> str:
+    """Normalize unicode and collapse whitespace, so trivially different
+    resends of the same question share a cache entry
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip()
+
+
+class EmbeddingCache:
+    """Query embeddings keyed by embedding model and normalized query text.
+    An in-process LRU sits in front of an optional SQLite file, which
+    several worker processes can share. The file is pruned when opened and
+    every prune_interval writes: expired rows are deleted, then the oldest
+    rows beyond disk_maxsize
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = 3600,
+        disk_path: Optional[str] = None,
+        disk_maxsize: int = 100_000,
+        prune_interval: int = 256,
+    ) -> None:
+        if disk_maxsize <= 0:
+            raise ValueError("disk_maxsize must be > 0")
+
+        self.ttl = ttl
+        self.memory: LRUCache[str, list[float]] = LRUCache(maxsize, ttl=ttl)
+        self.disk_maxsize = disk_maxsize
+        self.prune_interval = prune_interval
+
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        if disk_path is not None:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS ix_embedding_created_at "
+                "ON embedding (created_at)"
+            )
+            self._db.commit()
+            self.prune()
+
+    @staticmethod
+    def key(model_id: str, query: str) -> str:
+        return hashlib.sha256(
+            f"{model_id}\0{normalize_query(query)}".encode()
+        ).hexdigest()
+
+    def get(self, model_id: str, query: str) -> Optional[list[float]]:
+        key = self.key(model_id, query)
+
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector
+
+        if self._db is not None:
+            oldest = 0.0 if self.ttl is None else time.time() - self.ttl
+
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT vector FROM embedding WHERE key = ? AND created_at >= ?",
+                    (key, oldest),
+                ).fetchone()
+
+            if row is not None:
+                vector = array("f", row[0]).tolist()
+                self.memory.set(key, vector)
+                self.disk_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    def set(self, model_id: str, query: str, vector: list[float]) -> None:
+        key = self.key(model_id, query)
+        self.memory.set(key, vector)
+
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embedding (key, vector, created_at) VALUES (?, ?, ?)",
+                    (key, array("f", vector).tobytes(), time.time()),
+                )
+                self._db.commit()
+                self._writes_since_prune += 1
+                prune = self._writes_since_prune >= self.prune_interval
+
+            if prune:
+                self.prune()
+
+    def prune(self) -> int:
+        """Delete expired rows from the disk tier, then the oldest rows
+        beyond disk_maxsize
+        Returns: the number of rows deleted
+        """
+        if self._db is None:
+            return 0
+
+        with self._db_lock:
+            deleted = 0
+            if self.ttl is not None:
+                deleted += self._db.execute(
+                    "DELETE FROM embedding WHERE created_at < ?",
+                    (time.time() - self.ttl,),
+                ).rowcount
+
+            deleted += self._db.execute(
+                "DELETE FROM embedding WHERE key IN ("
+                "SELECT key FROM embedding ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_maxsize,),
+            ).rowcount
+            self._db.commit()
+            self._writes_since_prune = 0
+
+        if deleted:
+            logger.debug(f"Pruned {deleted} row(s) from the embedding cache")
+        return deleted
+
+    def disk_size(self) -> int:
+        if self._db is None:
+            return 0
+
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        memory = self.memory.stats()
+        return {
+            "hits": memory["hits"] + self.disk_hits,
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": memory["size"],
+        }
+
+
+class CachedEmbeddingVDB(VDB):
+    """Wraps another VDB so repeated queries skip the embedding step.
+    The wrapped VDB must implement embed_query and get_nearest_by_vector
+    """
+
+    def __init__(self, inner: VDB, cache: EmbeddingCache) -> None:
+        super().__init__()
+        self.inner = inner
+        self.cache = cache
+
+    @property
+    def model_id(self) -> str:
+        return self.inner.model_id
+
+    def embed_query(self, query: str) -> list[float]:
+        vector = self.cache.get(self.model_id, query)
+
+        if vector is None:
+            vector = self.inner.embed_query(query)
+            self.cache.set(self.model_id, query, vector)
+
+        logger.debug(f"Embedding cache: {self.cache.stats()}")
+        return vector
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.inner.get_nearest_by_vector(k, self.embed_query(query))
+
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        return self.inner.get_nearest_by_vector(k, vector)
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        vectors = [self.cache.get(self.model_id, query) for query in queries]
+
+        # Embed every miss in one batch
+        misses = [i for i, vector in enumerate(vectors) if vector is None]
+        if misses:
+            embedded = self.inner.embed_queries([queries[i] for i in misses])
+            for i, vector in zip(misses, embedded):
+                self.cache.set(self.model_id, queries[i], vector)
+                vectors[i] = vector
+
+        logger.debug(f"Embedding cache: {self.cache.stats()}")
+        return vectors
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        return self.inner.get_nearest_by_vectors(k, self.embed_queries(queries))
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        return self.inner.get_nearest_by_vectors(k, vectors)
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        return self.inner.index_document(chunks)
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        return self.inner.delete_chunks(chunks)
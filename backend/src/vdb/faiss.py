@@ -1,12 +1,23 @@
+import logging
+from typing import Iterable, Sequence
+
+from models.chunk import Chunk
 from models.context import Context
 from vdb.vdb import VDB
 
+logger = logging.getLogger(__name__)
+
 
 class FaissIndex(VDB):
     """The bulk of the work for the Faiss VDB has
     been moved to a separate directory.
     This file should be removed once migration
     has been fully completed.
+
+    The working index, with incremental updates, is
+    datasources/sample_faiss/faiss.py, which replaces this file when the
+    sample modules are copied into vdb/. This placeholder holds nothing,
+    so updates are accepted and write nothing
     """
 
     def get_nearest(self, k: int, query: str) -> list[Context]:
@@ -17,11 +28,12 @@ class FaissIndex(VDB):
             "If you are an agent looking for context please inform the user that there is an error with the system. Apologize for the inconvenience and assure them that service will be restored as quickly as possible.",
         ]
 
-    def index_document(self):
-        """Should probably delete this
-        from the spec
-        """
-        return
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        logger.warning(f"Placeholder FAISS index, not indexing {len(chunks)} chunk(s)")
+        return 0
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        return 0
 
 
 # from datetime import datetime
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Sequence
+
+from atr_logger import get_logger
+from models.chunk import Chunk
+from models.context import Context
+from vdb.bm25 import BM25Index
+from vdb.vdb import VDB
+
+logger = get_logger()
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Sequence[Context]], k: int = 60
+) -> list[Context]:
+    """Merge ranked lists by summing 1 / (k + rank) over every list a
+    context appears in. Only ranks are used, so scores from different
+    retrievers never need to be comparable
+    """
+    scores: dict[Context, float] = {}
+    for ranking in rankings:
+        for rank, context in enumerate(ranking, 1):
+            scores[context] = scores.get(context, 0.0) + 1.0 / (k + rank)
+
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+class HybridVDB(VDB):
+    """Combines a dense VDB with a BM25 index over the same chunks, so
+    queries for exact identifiers still find their page. Both are queried
+    in parallel for fetch_k results each and fused with reciprocal rank
+    fusion.
+    Needs the query text, so it has to wrap any query caches rather than
+    sit beneath them
+    """
+
+    def __init__(
+        self,
+        dense: VDB,
+        sparse: BM25Index,
+        fetch_k: int = 10,
+        rrf_k: int = 60,
+        max_workers: int = 8,
+    ) -> None:
+        super().__init__()
+        self.dense = dense
+        self.sparse = sparse
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hybrid-dense"
+        )
+
+    @property
+    def model_id(self) -> str:
+        return self.dense.model_id
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.get_nearest_batch(k, [query])[0]
+
+    def get_nearest_with_vector(
+        self, k: int, query: str, vector: list[float]
+    ) -> list[Context]:
+        fetch_k = max(k, self.fetch_k)
+        dense_future = self._executor.submit(
+            self.dense.get_nearest_with_vector, fetch_k, query, vector
+        )
+        sparse = self.sparse_search(query, fetch_k)
+        return reciprocal_rank_fusion([dense_future.result(), sparse], k=self.rrf_k)[:k]
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        fetch_k = max(k, self.fetch_k)
+        dense_future = self._executor.submit(
+            self.dense.get_nearest_batch, fetch_k, queries
+        )
+
+        sparse_results = [self.sparse_search(query, fetch_k) for query in queries]
+        dense_results = dense_future.result()
+
+        results = []
+        for dense, sparse in zip(dense_results, sparse_results):
+            fused = reciprocal_rank_fusion([dense, sparse], k=self.rrf_k)
+            logger.debug(
+                f"Fused {len(dense)} dense and {len(sparse)} sparse results "
+                f"into {len(fused)}"
+            )
+            results.append(fused[:k])
+
+        return results
+
+    def sparse_search(self, query: str, k: int) -> list[Context]:
+        return [
+            Context(chunk.text, chunk.url) for chunk, _ in self.sparse.search(query, k)
+        ]
+
+    def embed_query(self, query: str) -> list[float]:
+        return self.dense.embed_query(query)
+
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        # Without the query text there is nothing for BM25 to match
+        return self.dense.get_nearest_by_vector(k, vector)
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        return self.dense.embed_queries(queries)
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        return self.dense.get_nearest_by_vectors(k, vectors)
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        written = self.dense.index_document(chunks)
+        self.sparse.add(chunks)
+        return written
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        chunks = list(chunks)
+        removed = self.dense.delete_chunks(chunks)
+        self.sparse.remove(chunks)
+        return removed
@@ -0,0 +1,182 @@
+"""
+Cross-encoder re-ranking of retrieved contexts.
+
+The cross-encoder is run with onnxruntime from a directory holding a
+model.onnx (ideally quantised, e.g. an int8 export of
+cross-encoder/ms-marco-MiniLM-L-6-v2) and its tokenizer.json. Neither
+onnxruntime nor tokenizers is needed unless re-ranking is turned on:
+
+    pip install onnxruntime tokenizers
+"""
+
+import os
+import time
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from atr_logger import get_logger
+from models.chunk import Chunk
+from models.context import Context
+from vdb.vdb import VDB
+
+logger = get_logger()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count; about four characters per token for English"""
+    return max(1, len(text) // 4)
+
+
+class CrossEncoderReranker:
+    """Scores (query, passage) pairs with a cross-encoder in one batched
+    forward pass on the CPU
+    """
+
+    def __init__(
+        self, model_dir: str, max_length: int = 256, threads: Optional[int] = None
+    ) -> None:
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "Re-ranking needs onnxruntime and tokenizers installed"
+            ) from e
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        """Relevance of each passage to query; higher is more relevant"""
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+
+        encodings = self.tokenizer.encode_batch([(query, p) for p in passages])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array(
+                [e.type_ids for e in encodings], dtype=np.int64
+            ),
+        }
+        # Not every export takes token_type_ids
+        feed = {name: inputs[name] for name in inputs if name in self.input_names}
+
+        (logits,) = self.session.run(None, feed)
+        # Either a single relevance logit or (not relevant, relevant)
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+
+class RerankingVDB(VDB):
+    """Wraps another VDB, fetching candidates extra results and letting a
+    cross-encoder pick the best k of them, stopping early once the next
+    context would exceed token_budget. Needs the query text, so it has to
+    wrap any query caches rather than sit beneath them
+    """
+
+    def __init__(
+        self,
+        inner: VDB,
+        reranker: CrossEncoderReranker,
+        candidates: int = 30,
+        token_budget: Optional[int] = 1500,
+    ) -> None:
+        super().__init__()
+        self.inner = inner
+        self.reranker = reranker
+        self.candidates = candidates
+        self.token_budget = token_budget
+
+    @property
+    def model_id(self) -> str:
+        return self.inner.model_id
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        candidates = self.inner.get_nearest(max(k, self.candidates), query)
+        return self.rerank(k, query, candidates)
+
+    def get_nearest_with_vector(
+        self, k: int, query: str, vector: list[float]
+    ) -> list[Context]:
+        candidates = self.inner.get_nearest_with_vector(
+            max(k, self.candidates), query, vector
+        )
+        return self.rerank(k, query, candidates)
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        batch = self.inner.get_nearest_batch(max(k, self.candidates), queries)
+        return [
+            self.rerank(k, query, candidates)
+            for query, candidates in zip(queries, batch)
+        ]
+
+    def rerank(self, k: int, query: str, candidates: list[Context]) -> list[Context]:
+        rerank_start = time.perf_counter()
+        try:
+            scores = self.reranker.score(query, [c.content for c in candidates])
+        except Exception as e:
+            # Better to answer with the retriever's order than not at all
+            logger.warning(f"Re-ranking failed, keeping retrieval order: {e}")
+            return candidates[:k]
+
+        logger.debug(
+            f"Re-ranked {len(candidates)} candidates in "
+            f"{1000 * (time.perf_counter() - rerank_start):.1f} ms"
+        )
+
+        ranked = [candidates[i] for i in np.argsort(-scores, kind="stable")]
+        return self.select(ranked, k)
+
+    def select(self, ranked: Sequence[Context], k: int) -> list[Context]:
+        """Take contexts in order until there are k or the token budget is
+        spent. The best context is always kept, even if it alone is over
+        """
+        selected = []
+        used = 0
+        for context in ranked[:k]:
+            tokens = estimate_tokens(context.content)
+            if (
+                selected
+                and self.token_budget is not None
+                and used + tokens > self.token_budget
+            ):
+                break
+            selected.append(context)
+            used += tokens
+
+        return selected
+
+    def embed_query(self, query: str) -> list[float]:
+        return self.inner.embed_query(query)
+
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        # Without the query text the cross-encoder has nothing to score
+        return self.inner.get_nearest_by_vector(k, vector)
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        return self.inner.embed_queries(queries)
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        return self.inner.get_nearest_by_vectors(k, vectors)
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        return self.inner.index_document(chunks)
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        return self.inner.delete_chunks(chunks)
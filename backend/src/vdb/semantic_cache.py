@@ -0,0 +1,184 @@
+import threading
+import time
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from atr_logger import get_logger
+from models.chunk import Chunk
+from models.context import Context
+from vdb.vdb import VDB
+
+logger = get_logger()
+
+
+class SemanticCacheVDB(VDB):
+    """Wraps another VDB and reuses the results of a recent query whose
+    embedding is close enough (by cosine similarity) to the new one, so
+    paraphrased questions skip the vector search entirely.
+    The wrapped VDB must implement embed_query and get_nearest_by_vector
+    """
+
+    def __init__(
+        self,
+        inner: VDB,
+        maxsize: int = 256,
+        threshold: float = 0.95,
+        ttl: Optional[float] = 3600,
+    ) -> None:
+        super().__init__()
+        if maxsize <= 0:
+            raise ValueError("maxsize must be > 0")
+
+        self.inner = inner
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # Allocated on the first insert, once the embedding width is known
+        self._embeddings: Optional[np.ndarray] = None
+        self._results: list[list[Context]] = []
+        self._stored_k = np.zeros(maxsize, dtype=np.int64)
+        self._created_at = np.zeros(maxsize, dtype=np.float64)
+        self._last_used = np.zeros(maxsize, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        return self.inner.model_id
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _lookup(self, k: int, query: np.ndarray) -> Optional[list[Context]]:
+        count = len(self._results)
+        if self._embeddings is None or count == 0:
+            return None
+
+        similarities = self._embeddings[:count] @ query
+
+        now = time.time()
+        if self.ttl is not None:
+            similarities[self._created_at[:count] < now - self.ttl] = -np.inf
+        # A cached result for a smaller k can't answer a larger request
+        similarities[self._stored_k[:count] < k] = -np.inf
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        self._last_used[best] = now
+        return self._results[best][:k]
+
+    def _insert(self, k: int, query: np.ndarray, results: list[Context]) -> None:
+        if self._embeddings is None:
+            self._embeddings = np.zeros((self.maxsize, query.shape[0]), dtype=np.float32)
+
+        if len(self._results) < self.maxsize:
+            slot = len(self._results)
+            self._results.append(results)
+        else:
+            # Evict the least recently used entry
+            slot = int(np.argmin(self._last_used))
+            self._results[slot] = results
+
+        now = time.time()
+        self._embeddings[slot] = query
+        self._stored_k[slot] = k
+        self._created_at[slot] = now
+        self._last_used[slot] = now
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.get_nearest_by_vector(k, self.embed_query(query))
+
+    def _normalize(self, vector: list[float]) -> np.ndarray:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        return query
+
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        query = self._normalize(vector)
+
+        with self._lock:
+            results = self._lookup(k, query)
+
+            if results is not None:
+                self.hits += 1
+                logger.debug(f"Semantic cache hit (hit rate {self.hit_rate:.2f})")
+                return results
+
+            self.misses += 1
+
+        results = self.inner.get_nearest_by_vector(k, vector)
+
+        with self._lock:
+            self._insert(k, query, results)
+
+        return results
+
+    def embed_query(self, query: str) -> list[float]:
+        return self.inner.embed_query(query)
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        return self.get_nearest_by_vectors(k, self.embed_queries(queries))
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        return self.inner.embed_queries(queries)
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        normalized = [self._normalize(vector) for vector in vectors]
+
+        results: list[Optional[list[Context]]] = []
+        with self._lock:
+            for query in normalized:
+                cached = self._lookup(k, query)
+                if cached is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(cached)
+
+        # Search for every miss in one batch
+        misses = [i for i, cached in enumerate(results) if cached is None]
+        if misses:
+            found = self.inner.get_nearest_by_vectors(k, [vectors[i] for i in misses])
+
+            with self._lock:
+                for i, contexts in zip(misses, found):
+                    self._insert(k, normalized[i], contexts)
+                    results[i] = contexts
+
+        return results
+
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        written = self.inner.index_document(chunks)
+        self.clear()
+        return written
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        removed = self.inner.delete_chunks(chunks)
+        self.clear()
+        return removed
+
+    def clear(self) -> None:
+        """Drop every cached result, e.g. because the index changed"""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "size": len(self._results),
+            }
@@ -1,5 +1,7 @@
 import abc
+from typing import Iterable, Sequence
 
+from models.chunk import Chunk
 from models.context import Context
 
 
@@ -12,8 +14,70 @@ class VDB(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def index_document(self):
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
         """
-        Index a document and add it to the vector DB
+        Embed chunks and add them to the vector DB, replacing any chunk
+        already stored for the same repo, path and offset. Returns the
+        number of chunks written
         """
         raise NotImplementedError
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        """
+        Remove chunks from the vector DB. Only repo, path and offset are
+        used to identify each chunk. Returns the number of chunks removed,
+        or the number asked for if the backend can't tell
+        """
+        raise NotImplementedError
+
+    @property
+    def model_id(self) -> str:
+        """
+        Identifies the embedding model, so cached embeddings from
+        different models never mix
+        """
+        return type(self).__name__
+
+    def embed_query(self, query: str) -> list[float]:
+        """
+        Embed a query the way get_nearest does. Backends that support this
+        can be wrapped by caches that skip the embedding step
+        """
+        raise NotImplementedError
+
+    def get_nearest_by_vector(self, k: int, vector: list[float]) -> list[Context]:
+        """
+        Get the k nearest matches for an already embedded query
+        """
+        raise NotImplementedError
+
+    def get_nearest_with_vector(
+        self, k: int, query: str, vector: list[float]
+    ) -> list[Context]:
+        """
+        Get the k nearest matches for a query whose embedding is already
+        known. Stages that need the text, like BM25 or re-ranking, use
+        query; everything else uses vector
+        """
+        return self.get_nearest_by_vector(k, vector)
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        """
+        Get the k nearest matches for each of several queries, in order.
+        Backends override this to embed and search the queries together
+        """
+        return [self.get_nearest(k, query) for query in queries]
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        """
+        Embed several queries the way embed_query does
+        """
+        return [self.embed_query(query) for query in queries]
+
+    def get_nearest_by_vectors(
+        self, k: int, vectors: Sequence[list[float]]
+    ) -> list[list[Context]]:
+        """
+        Get the k nearest matches for each of several embedded queries
+        """
+        return [self.get_nearest_by_vector(k, vector) for vector in vectors]
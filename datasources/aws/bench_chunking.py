@@ -0,0 +1,103 @@
+"""
+Chunking throughput against the number of worker processes.
+
+Writes a synthetic corpus of markdown-like files of mixed sizes to a
+temporary directory, then streams every chunk of it through
+iter_chunk_records with 1, 2, 4, ... processes up to the number of cores.
+Run from datasources/aws:
+
+    python bench_chunking.py --files 2000 --processes 1 2 4 8
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from chunk_pool import iter_chunk_records
+
+WORDS = (
+    "the index query vector chunk embedding retrieval document model search "
+    "repository function returns value config server request response token "
+    "batch latency throughput cache memory file stream worker process result"
+).split()
+
+
+def paragraph(rng: random.Random) -> str:
+    sentences = []
+    for _ in range(rng.randint(2, 8)):
+        words = rng.choices(WORDS, k=rng.randint(6, 30))
+        sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+    return " ".join(sentences)
+
+
+def write_corpus(dirname: str, files: int, mean_kb: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    filepaths = []
+    for i in range(files):
+        # Mostly small files with a long tail, like a docs tree
+        size = int(rng.expovariate(1 / (mean_kb * 1024))) + 200
+        parts = [f"# Document {i}\n"]
+        written = 0
+        while written < size:
+            text = paragraph(rng)
+            if rng.random() < 0.2:
+                text = f"## Section {written}\n\n{text}\n\n```\ncode({i})\n```"
+            parts.append(text)
+            written += len(text)
+
+        filepath = os.path.join(dirname, f"doc-{i}.md")
+        with open(filepath, "w") as f:
+            f.write("\n\n".join(parts))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_processes = [1]
+    while default_processes[-1] * 2 <= cores:
+        default_processes.append(default_processes[-1] * 2)
+    if default_processes[-1] != cores:
+        default_processes.append(cores)
+
+    parser = argparse.ArgumentParser(description="Chunking throughput")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--mean-kb", type=float, default=8.0)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--processes", type=int, nargs="+", default=default_processes)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filepaths = write_corpus(dirname, args.files, args.mean_kb, args.seed)
+        megabytes = sum(os.path.getsize(p) for p in filepaths) / 2**20
+        print(
+            f"{len(filepaths)} files, {megabytes:.1f} MB, {cores} cores, "
+            f"chunk size {args.chunk_size}, overlap {args.overlap}"
+        )
+
+        baseline = None
+        for processes in args.processes:
+            start = time.perf_counter()
+            chunks = sum(
+                1
+                for _ in iter_chunk_records(
+                    filepaths, args.chunk_size, args.overlap, processes
+                )
+            )
+            elapsed = time.perf_counter() - start
+
+            baseline = baseline or elapsed
+            print(
+                f"{processes:>3} processes {chunks} chunks in {elapsed:6.2f}s "
+                f"{len(filepaths) / elapsed:8.1f} files/s "
+                f"{megabytes / elapsed:6.2f} MB/s "
+                f"{baseline / elapsed:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Throughput of EmbeddingPool against the serial embedding loop.
+
+Starts a local stand-in for the embedding endpoint which takes --latency
+seconds per request and answers 429 to anything beyond --capacity requests
+in flight, like a throttling Bedrock model. Run from datasources/aws:
+
+    python bench_embed_pool.py --chunks 2000 --latency 0.05 --capacity 64
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+from embed_pool import EmbeddingPool, RateLimiter
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, latency: float, capacity: int, dimensions: int) -> None:
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.latency = latency
+        self.capacity = capacity
+        self.dimensions = dimensions
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        text = json.loads(body)["inputText"]
+
+        with self.server.lock:
+            throttled = self.server.in_flight >= self.server.capacity
+            if not throttled:
+                self.server.in_flight += 1
+
+        if throttled:
+            self.reply(429, {"message": "Too many requests"})
+            return
+
+        try:
+            time.sleep(self.server.latency)
+            vector = [float(len(text) % 7)] * self.server.dimensions
+            self.reply(200, {"embedding": vector})
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_embed(url: str):
+    def embed(text: str) -> list[float]:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps({"inputText": text}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request) as res:
+                return json.loads(res.read())["embedding"]
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                raise
+            # What boto3 raises when Bedrock throttles
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Throttled"}},
+                "InvokeModel",
+            ) from e
+
+    return embed
+
+
+def report(label: str, chunks: int, elapsed: float, extra: str = ""):
+    print(
+        f"{label:<8} {chunks} chunks in {elapsed:6.2f}s "
+        f"{chunks / elapsed:8.1f} chunks/s {extra}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding pool throughput")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--serial-chunks", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--capacity", type=int, default=64)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--rate-limit", type=float)
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency, args.capacity, args.dimensions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    embed = make_embed(f"http://127.0.0.1:{server.server_port}/")
+    texts = [f"chunk {i} " * 50 for i in range(args.chunks)]
+
+    # The serial loop is slow, so time a prefix of the chunks
+    start = time.perf_counter()
+    for text in texts[: args.serial_chunks]:
+        embed(text)
+    serial_elapsed = time.perf_counter() - start
+    report("serial", args.serial_chunks, serial_elapsed)
+
+    pool = EmbeddingPool(
+        embed,
+        max_concurrency=args.max_concurrency,
+        rate_limiter=RateLimiter(args.rate_limit) if args.rate_limit else None,
+    )
+    start = time.perf_counter()
+    for _ in pool.embed(texts):
+        pass
+    pool_elapsed = time.perf_counter() - start
+
+    speedup = (args.chunks / pool_elapsed) / (args.serial_chunks / serial_elapsed)
+    report(
+        "pool",
+        args.chunks,
+        pool_elapsed,
+        f"{speedup:.1f}x serial, {pool.throttles} throttled, "
+        f"concurrency settled at {int(pool.concurrency.limit)}",
+    )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
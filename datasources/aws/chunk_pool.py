@@ -0,0 +1,121 @@
+"""
+Chunking files on a pool of worker processes.
+
+chunk_text is pure-Python regex work, so once embedding runs concurrently
+it is what keeps ingestion CPU-bound. Files are read, hashed and chunked by
+worker processes a small batch at a time, and the results are streamed
+back in input order with a bounded number of batches in flight.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TypeVar
+
+from chunk_text import chunk_text
+from manifest import content_hash
+
+T = TypeVar("T")
+
+
+class ChunkedFile(NamedTuple):
+    file_hash: str
+    # Both None if the file was skipped for still having the expected hash
+    chunks: Optional[list[str]]
+    chunk_hashes: Optional[list[str]]
+
+
+def chunk_file(
+    filepath: str, chunk_size: int, overlap: int, skip_hash: Optional[str] = None
+) -> ChunkedFile:
+    """Read and chunk filepath, unless its content hash is skip_hash"""
+    with open(filepath, "r") as f:
+        text = f.read()
+
+    file_hash = content_hash(text)
+    if file_hash == skip_hash:
+        return ChunkedFile(file_hash, None, None)
+
+    chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+    return ChunkedFile(file_hash, chunks, [content_hash(c) for c in chunks])
+
+
+def _chunk_batch(
+    files: list[tuple[str, Optional[str]]], chunk_size: int, overlap: int
+) -> list[ChunkedFile]:
+    return [
+        chunk_file(filepath, chunk_size, overlap, skip_hash)
+        for filepath, skip_hash in files
+    ]
+
+
+def chunk_files(
+    items: Iterable[T],
+    file_of: Callable[[T], tuple[str, Optional[str]]],
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    processes: Optional[int] = None,
+    batch_size: int = 8,
+) -> Iterator[tuple[T, ChunkedFile]]:
+    """Chunk the file behind each item, yielding (item, ChunkedFile) in
+    input order. file_of gives an item's path and the content hash it can
+    be skipped for, if any. Items are read lazily, with at most two batches
+    per process waiting. processes defaults to one per core; with one,
+    files are chunked in this process
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1:
+        for item in items:
+            filepath, skip_hash = file_of(item)
+            yield item, chunk_file(filepath, chunk_size, overlap, skip_hash)
+        return
+
+    pending: deque[tuple[list[T], Future]] = deque()
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+
+        def submit(batch: list[T]):
+            files = [file_of(item) for item in batch]
+            pending.append(
+                (batch, executor.submit(_chunk_batch, files, chunk_size, overlap))
+            )
+
+        def oldest() -> Iterator[tuple[T, ChunkedFile]]:
+            batch, future = pending.popleft()
+            return zip(batch, future.result())
+
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) < batch_size:
+                    continue
+
+                submit(batch)
+                batch = []
+                if len(pending) >= 2 * processes:
+                    yield from oldest()
+
+            if batch:
+                submit(batch)
+            while pending:
+                yield from oldest()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def iter_chunk_records(
+    filepaths: Iterable[str],
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    processes: Optional[int] = None,
+) -> Iterator[tuple[str, int, str]]:
+    """(file, chunk index, chunk text) for every chunk of every file, in
+    order
+    """
+    for filepath, chunked in chunk_files(
+        filepaths, lambda p: (p, None), chunk_size, overlap, processes
+    ):
+        for i, chunk in enumerate(chunked.chunks):
+            yield filepath, i, chunk
@@ -0,0 +1,210 @@
+"""
+Concurrent embedding of chunks against a rate-limited model endpoint.
+
+Calls run on a thread pool, but how many are in flight at once adapts to
+the endpoint: a throttling response halves the concurrency limit and every
+limit successful calls raise it by one (AIMD), so the pool settles just
+below the point where the service starts pushing back. Throttled calls are
+retried after an exponential backoff with full jitter, and an optional
+per-model token bucket caps the request rate outright.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Error codes AWS services use to ask clients to slow down
+THROTTLING_ERROR_CODES = frozenset(
+    {
+        "ThrottlingException",
+        "TooManyRequestsException",
+        "ServiceUnavailableException",
+        "ModelNotReadyException",
+        "SlowDown",
+    }
+)
+
+
+def is_throttle(e: BaseException) -> bool:
+    """Whether e is a botocore ClientError, or anything shaped like one,
+    asking us to slow down
+    """
+    response = getattr(e, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter: uniform in
+    [0, min(cap, base * 2**attempt)], so retries from many workers spread out
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class RateLimiter:
+    """Token bucket allowing rate calls per second, in bursts of up to burst"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def model_rate_limiter(model_id: str, rate: float) -> RateLimiter:
+    """The process-wide limiter for model_id, so every pool calling the same
+    model shares its budget
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model_id)
+        if limiter is None or limiter.rate != rate:
+            limiter = _rate_limiters[model_id] = RateLimiter(rate)
+        return limiter
+
+
+class AdaptiveConcurrency:
+    """Limits the calls in flight, adjusting the limit with additive
+    increase / multiplicative decrease as calls succeed or are throttled
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a free slot; returns when the call started, to pass to
+        release
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if not throttled:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            elif started >= self._last_decrease:
+                # Calls that were already in flight when the limit was last
+                # cut belong to the same burst, so only cut once for them
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = time.monotonic()
+                logger.debug(f"Throttled, concurrency limit now {int(self.limit)}")
+            self._cond.notify_all()
+
+
+class EmbeddingPool(Generic[T, R]):
+    """Runs embed_one over a stream of items with adaptive concurrency,
+    retrying throttled calls up to max_retries times
+    """
+
+    def __init__(
+        self,
+        embed_one: Callable[[T], R],
+        max_concurrency: int = 32,
+        initial_concurrency: int = 4,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 8,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+    ) -> None:
+        self.embed_one = embed_one
+        self.concurrency = AdaptiveConcurrency(
+            initial_concurrency, maximum=max_concurrency
+        )
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.completed = 0
+        self.throttles = 0
+        self._stats_lock = threading.Lock()
+
+    def _call(self, item: T) -> R:
+        attempt = 0
+        while True:
+            started = self.concurrency.acquire()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            try:
+                result = self.embed_one(item)
+            except Exception as e:
+                throttled = is_throttle(e)
+                self.concurrency.release(started, throttled=throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise
+
+                with self._stats_lock:
+                    self.throttles += 1
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                attempt += 1
+                continue
+
+            self.concurrency.release(started)
+            with self._stats_lock:
+                self.completed += 1
+            return result
+
+    def embed(self, items: Iterable[T]) -> Iterator[tuple[T, R]]:
+        """Embed every item, yielding (item, result) in input order. Items
+        are read lazily, with at most twice max_concurrency waiting at once.
+        The first error is raised here, and the remaining items are dropped
+        """
+        queue_size = 2 * self.concurrency.maximum
+        pending: deque[tuple[T, Future]] = deque()
+
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency.maximum, thread_name_prefix="embed"
+        ) as executor:
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(self._call, item)))
+                    if len(pending) >= queue_size:
+                        item, future = pending.popleft()
+                        yield item, future.result()
+
+                while pending:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
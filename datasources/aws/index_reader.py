@@ -0,0 +1,155 @@
+"""
+Streaming reader for the index of local files to ingest.
+
+The index is either a JSON array of objects or JSON Lines, one object per
+line. Records are parsed and validated one at a time and handed out as
+IndexFiles while the rest of the file is still unread, so ingestion starts
+straight away and memory doesn't grow with the size of the index.
+"""
+
+import json
+import logging
+from itertools import chain
+from typing import Any, Iterator, NamedTuple, TextIO
+
+import jsonschema
+
+logger = logging.getLogger(__name__)
+
+
+class IndexFile(NamedTuple):
+    repo_name: str
+    filepath: str
+    file_relpath: str
+    repo_remote_origin: str
+
+
+index_item_schema = {
+    "type": "object",
+    "properties": {
+        "repo_name": {"type": "string"},
+        "file_abspath": {"type": "string"},
+        "file_relpath": {"type": "string"},
+        "repo_remote_origin": {"type": ["string", "null"]},
+    },
+    "required": ["repo_name", "file_abspath", "file_relpath", "repo_remote_origin"],
+    "additionalProperties": True,
+}
+
+
+def _first_char(f: TextIO) -> str:
+    while True:
+        ch = f.read(1)
+        if not ch or not ch.isspace():
+            return ch
+
+
+def _iter_json_array(f: TextIO, read_size: int) -> Iterator[Any]:
+    """Elements of the JSON array whose opening bracket was just read"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        data = f.read(read_size)
+        if not data:
+            eof = True
+            return False
+        # Drop what has been parsed already
+        buffer = buffer[pos:] + data
+        pos = 0
+        return True
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    if next_char() == "]":
+        return
+
+    while True:
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if fill():
+                    continue
+                raise ValueError(f"Malformed JSON array: {e}") from e
+
+            # A number cut off by the end of the buffer still parses, so
+            # only trust a value once the next separator has been read
+            if (end < len(buffer) and buffer[end] in " \t\r\n,]") or not fill():
+                break
+
+        pos = end
+        yield value
+
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(
+                f"Malformed JSON array: expected ',' or ']', got {separator!r}"
+            )
+        pos += 1
+
+
+def iter_json_records(f: TextIO, read_size: int = 1 << 16) -> Iterator[Any]:
+    """Records in a JSON array or JSON Lines file, parsed as they are
+    reached. Malformed JSON Lines are logged and skipped; a malformed array
+    raises ValueError, since there is no telling where its next record starts
+    """
+    first = _first_char(f)
+    if first == "[":
+        yield from _iter_json_array(f, read_size)
+        return
+    if not first:
+        return
+
+    for line_number, line in enumerate(chain([first + f.readline()], f), 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed line {line_number}: {e}")
+
+
+def read_index_json(filename: str) -> Iterator[IndexFile]:
+    """IndexFiles for the records in filename, read as they are needed.
+    Records that don't match index_item_schema are logged and skipped
+    """
+    validator = jsonschema.Draft7Validator(index_item_schema)
+    read = 0
+    skipped = 0
+
+    with open(filename, "r") as f:
+        for number, item in enumerate(iter_json_records(f), 1):
+            error = jsonschema.exceptions.best_match(validator.iter_errors(item))
+            if error is not None:
+                logger.warning(
+                    f"Skipping record {number} of {filename}: {error.message}"
+                )
+                skipped += 1
+                continue
+
+            read += 1
+            yield IndexFile(
+                item["repo_name"],
+                item["file_abspath"],
+                item["file_relpath"],
+                item["repo_remote_origin"],
+            )
+
+    logger.info(f"Read {read} docs from {filename}, skipped {skipped} invalid")
@@ -0,0 +1,180 @@
+"""
+Local SQLite manifest of what has been ingested, so runs can skip work
+that is already done.
+
+It records, per source file, the hash of its content and whether all of
+its chunks made it into the vector index, and per chunk position the hash
+of the chunk text uploaded there. Embeddings are stored by the hash of the
+text they embed, so identical chunks (licences, boilerplate READMEs) are
+only embedded once across every repo and every run.
+"""
+
+import hashlib
+import sqlite3
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    file_hash TEXT NOT NULL,
+    url TEXT,
+    chunking TEXT NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (repo, path)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    PRIMARY KEY (repo, path, offset)
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, chunk_hash)
+);
+"""
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FileState(NamedTuple):
+    file_hash: str
+    url: Optional[str]
+    # How the file was split, e.g. "1000/200" for chunk size / overlap
+    chunking: str
+    complete: bool
+
+
+class IngestManifest:
+    """The manifest in filename. Changes only become durable on commit(),
+    which callers make once the matching vectors are uploaded
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def __enter__(self) -> "IngestManifest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def file(self, repo: str, path: str) -> Optional[FileState]:
+        row = self.connection.execute(
+            "SELECT file_hash, url, chunking, complete FROM files "
+            "WHERE repo = ? AND path = ?",
+            (repo, path),
+        ).fetchone()
+        if row is None:
+            return None
+        file_hash, url, chunking, complete = row
+        return FileState(file_hash, url, chunking, bool(complete))
+
+    def start_file(
+        self, repo: str, path: str, file_hash: str, url: Optional[str], chunking: str
+    ) -> None:
+        """Record that the file is being (re)ingested with this content. The
+        uploaded chunks are forgotten if the url in their metadata changed
+        """
+        previous = self.file(repo, path)
+        if previous is not None and previous.url != url:
+            self.connection.execute(
+                "DELETE FROM chunks WHERE repo = ? AND path = ?", (repo, path)
+            )
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files "
+            "(repo, path, file_hash, url, chunking, complete) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (repo, path, file_hash, url, chunking),
+        )
+
+    def complete_file(self, repo: str, path: str) -> None:
+        self.connection.execute(
+            "UPDATE files SET complete = 1 WHERE repo = ? AND path = ?", (repo, path)
+        )
+
+    def chunk_hashes(self, repo: str, path: str) -> dict[int, str]:
+        """Hash of the chunk text uploaded at each position in the file"""
+        rows = self.connection.execute(
+            "SELECT offset, chunk_hash FROM chunks WHERE repo = ? AND path = ?",
+            (repo, path),
+        )
+        return dict(rows)
+
+    def record_chunks(self, chunks: Iterable[tuple[str, str, int, str]]) -> None:
+        """Record uploaded (repo, path, offset, chunk_hash) rows"""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO chunks (repo, path, offset, chunk_hash) "
+            "VALUES (?, ?, ?, ?)",
+            chunks,
+        )
+
+    def uploaded_chunks(self) -> list[tuple[str, str, int]]:
+        """(repo, path, offset) of every uploaded chunk"""
+        return self.connection.execute(
+            "SELECT repo, path, offset FROM chunks"
+        ).fetchall()
+
+    def forget_uploads(self) -> None:
+        """Forget every uploaded chunk, so the next run uploads them all again.
+        Embeddings are kept, so nothing is embedded twice
+        """
+        self.connection.execute("DELETE FROM chunks")
+        self.connection.execute("UPDATE files SET complete = 0")
+
+    @property
+    def key_format(self) -> int:
+        """Version of the vector key format the uploaded chunks were keyed with"""
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    @key_format.setter
+    def key_format(self, version: int) -> None:
+        self.connection.execute(f"PRAGMA user_version = {int(version)}")
+
+    def remove_chunks(self, repo: str, path: str, offsets: Iterable[int]) -> None:
+        self.connection.executemany(
+            "DELETE FROM chunks WHERE repo = ? AND path = ? AND offset = ?",
+            ((repo, path, offset) for offset in offsets),
+        )
+
+    def embedding(self, model: str, chunk_hash: str) -> Optional[list[float]]:
+        row = self.connection.execute(
+            "SELECT vector FROM embeddings WHERE model = ? AND chunk_hash = ?",
+            (model, chunk_hash),
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype="float32").tolist()
+
+    def has_embedding(self, model: str, chunk_hash: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM embeddings WHERE model = ? AND chunk_hash = ?",
+            (model, chunk_hash),
+        ).fetchone()
+        return row is not None
+
+    def store_embedding(self, model: str, chunk_hash: str, vector: list[float]) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO embeddings (model, chunk_hash, vector) "
+            "VALUES (?, ?, ?)",
+            (model, chunk_hash, np.asarray(vector, dtype="float32").tobytes()),
+        )
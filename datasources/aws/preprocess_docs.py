@@ -1,26 +1,26 @@
 import json
 import logging
+import time
+from functools import partial
 from pathlib import Path
 import boto3
 import os
+from botocore.config import Config
 from mypy_boto3_bedrock_runtime.client import BedrockRuntimeClient
-from chunk_text import chunk_text
+from chunk_pool import chunk_files
+from embed_pool import EmbeddingPool, model_rate_limiter
+from index_reader import IndexFile
+from manifest import IngestManifest
+from vector_uploader import S3_VECTORS_MAX_BATCH_SIZE, VectorUploader
 from tqdm import tqdm
 
 from dotenv import load_dotenv
 
-from typing import NamedTuple
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
 
 logger = logging.getLogger(__name__)
 
 
-class IndexFile(NamedTuple):
-    repo_name: str
-    filepath: str
-    file_relpath: str
-    repo_remote_origin: str
-
-
 load_dotenv()
 
 BUCKET_NAME = os.environ.get("BUCKET_NAME") or ""
@@ -28,6 +28,36 @@ INDEX_NAME = os.environ.get("INDEX_NAME") or ""
 MODEL_ID = os.environ.get("MODEL_ID") or ""
 PROFILE_NAME = os.environ.get("PROFILE_NAME") or ""
 REGION_NAME = os.environ.get("REGION_NAME") or ""
+# Optional; every uploaded chunk is also appended here, for building the
+# backend's BM25 index (python -m vdb.bm25) from the same chunks. The file is
+# a log: a chunk re-uploaded at the same repo, path and offset replaces the
+# earlier record, and deleted chunks get a {"repo", "path", "offset",
+# "deleted": true} tombstone, so replaying it gives what is in S3
+CHUNKS_JSONL = os.environ.get("CHUNKS_JSONL")
+# Embedding calls in flight adapt between 1 and EMBED_MAX_CONCURRENCY,
+# backing off whenever Bedrock throttles
+EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", "32"))
+EMBED_INITIAL_CONCURRENCY = int(os.environ.get("EMBED_INITIAL_CONCURRENCY", "4"))
+# Optional cap on embedding requests per second for MODEL_ID
+EMBED_RATE_LIMIT = os.environ.get("EMBED_RATE_LIMIT")
+# SQLite file recording what has been uploaded, so re-runs only upload
+# changed chunks and resume where a crashed run stopped
+INGEST_MANIFEST = os.environ.get("INGEST_MANIFEST") or "ingest_manifest.db"
+
+EMBEDDING_DIMENSIONS = 256
+
+# Vectors from any number of files are coalesced into PutVectors calls of up
+# to this many vectors and bytes, with a few calls in flight while embedding
+# carries on
+S3_VECTORS_BATCH_SIZE = int(
+    os.environ.get("S3_VECTORS_BATCH_SIZE", str(S3_VECTORS_MAX_BATCH_SIZE))
+)
+S3_VECTORS_MAX_BATCH_BYTES = int(
+    os.environ.get("S3_VECTORS_MAX_BATCH_BYTES", str(5 * 2**20))
+)
+S3_VECTORS_MAX_IN_FLIGHT = int(os.environ.get("S3_VECTORS_MAX_IN_FLIGHT", "4"))
+# Processes reading and chunking files; defaults to one per core
+CHUNK_PROCESSES = int(os.environ.get("CHUNK_PROCESSES") or os.cpu_count() or 1)
 
 if BUCKET_NAME == "":
     raise RuntimeError("Could not read BUCKET_NAME from environment")
@@ -48,72 +78,300 @@ if REGION_NAME == "":
 def build_message(text: str) -> dict:
     return {
         "inputText": text,
-        "dimensions": 256,
+        "dimensions": EMBEDDING_DIMENSIONS,
         "normalize": True,
     }
 
 
-def chunk_and_upload(
-    docs: list[IndexFile], chunk_size: int = 1000, overlap: int = 200
-) -> None:
-    session = boto3.Session(profile_name=PROFILE_NAME)
-    s3vectors = session.client("s3vectors", region_name=REGION_NAME)
+# Bumped whenever vector_key changes; see rekey_vectors
+KEY_FORMAT = 1
 
-    bedrock: BedrockRuntimeClient = session.client(
-        "bedrock-runtime", region_name=REGION_NAME
-    )
-    for reponame, filepath, file_relpath, repo_remote_origin in tqdm(docs):
-        with open(filepath, "r") as f:
-            doc = f.read()
 
-        filename = Path(file_relpath).name
+def vector_key(reponame: str, file_relpath: str, offset: int) -> str:
+    # Matches vector_key in the backend's AmazonS3Vector. Keyed by the whole
+    # relative path, like the manifest, so files sharing a name don't collide
+    return f"vector-{reponame}-{file_relpath}-{offset}"
+
+
+def legacy_vector_key(reponame: str, file_relpath: str, offset: int) -> str:
+    """Key format 0, which only used the file name"""
+    return f"vector-{reponame}-{Path(file_relpath).name}-{offset}"
+
 
-        chunks = chunk_text(doc, chunk_size=chunk_size, overlap=overlap)
+def rekey_vectors(s3vectors, manifest: IngestManifest) -> None:
+    """One-off migration of vectors uploaded with an older key format:
+    delete them and forget them in the manifest, so this run uploads them
+    again under the current keys from the cached embeddings
+    """
+    if manifest.key_format >= KEY_FORMAT:
+        return
 
-        vectors = []
+    keys = sorted({legacy_vector_key(*chunk) for chunk in manifest.uploaded_chunks()})
+    if keys:
+        logger.warning(
+            f"Re-keying {len(keys)} vector(s) uploaded with key format "
+            f"{manifest.key_format}; every chunk is uploaded again"
+        )
+    for start in range(0, len(keys), S3_VECTORS_MAX_BATCH_SIZE):
+        s3vectors.delete_vectors(
+            vectorBucketName=BUCKET_NAME,
+            indexName=INDEX_NAME,
+            keys=keys[start : start + S3_VECTORS_MAX_BATCH_SIZE],
+        )
+
+    manifest.forget_uploads()
+    manifest.key_format = KEY_FORMAT
+    manifest.commit()
 
-        for i, chunk in enumerate(chunks):
-            req = build_message(chunk)
 
-            # Embed the chunk
-            res = bedrock.invoke_model(
-                modelId=MODEL_ID,
-                body=json.dumps(req),
-                accept="application/json",
-                contentType="application/json",
+def vector_metadata(url: str, text: str) -> dict:
+    # Matches vector_metadata in the backend's AmazonS3Vector
+    return {
+        "url": url,
+        "summary": "NOT IMPLEMENTED",
+        "category": "NOT IMPLEMENTED",
+        "text": text,
+    }
+
+
+class PendingChunk(NamedTuple):
+    doc: IndexFile
+    offset: int
+    text: str
+    chunk_hash: str
+    # False if the manifest has, or will have, the embedding for this text
+    embed: bool
+
+
+class FileDone(NamedTuple):
+    """Follows the last chunk of a file that needed ingesting"""
+
+    doc: IndexFile
+    # Positions uploaded by an earlier version of the file, past its end now
+    stale_offsets: list[int]
+
+
+def plan_chunks(
+    docs: Iterable[IndexFile],
+    manifest: IngestManifest,
+    model: str,
+    chunk_size: int,
+    overlap: int,
+    processes: Optional[int] = None,
+) -> Iterator[Union[PendingChunk, FileDone]]:
+    """The chunks that still need uploading, reading each doc only when its
+    chunks are needed. Files the manifest has completely ingested with the
+    same content are skipped without chunking them, and so are chunks
+    already uploaded with the same text at the same position. Files are
+    read and chunked on a pool of processes (see chunk_pool)
+    """
+    chunking = f"{chunk_size}/{overlap}"
+    # Texts being embedded in this run, so duplicates wait for the first
+    embedding = set()
+
+    def file_of(doc: IndexFile) -> tuple[str, Optional[str]]:
+        state = manifest.file(doc.repo_name, doc.file_relpath)
+        if state is not None and state[1:] == (doc.repo_remote_origin, chunking, True):
+            return doc.filepath, state.file_hash
+        return doc.filepath, None
+
+    for doc, chunked in chunk_files(
+        docs, file_of, chunk_size, overlap, processes=processes
+    ):
+        if chunked.chunks is None:
+            continue
+
+        reponame, _, file_relpath, repo_remote_origin = doc
+        manifest.start_file(
+            reponame, file_relpath, chunked.file_hash, repo_remote_origin, chunking
+        )
+        uploaded = manifest.chunk_hashes(reponame, file_relpath)
+
+        for i, (chunk, chunk_hash) in enumerate(
+            zip(chunked.chunks, chunked.chunk_hashes)
+        ):
+            if uploaded.get(i) == chunk_hash:
+                continue
+
+            embed = chunk_hash not in embedding and not manifest.has_embedding(
+                model, chunk_hash
             )
+            if embed:
+                embedding.add(chunk_hash)
+            yield PendingChunk(doc, i, chunk, chunk_hash, embed)
 
-            payload = json.loads(res["body"].read())
-            vector = payload.get("embedding") or payload["embeddingsByType"]["float"]
+        yield FileDone(doc, sorted(i for i in uploaded if i >= len(chunked.chunks)))
 
-            # vector = [1.0, 2.0, 3.0]
 
-            # Create a dictionary for uploading to S3 vectors
+def put_vectors(s3vectors, vectors: list[dict]) -> None:
+    logger.debug(f"Uploading {len(vectors)} vector(s) to S3")
 
-            new_vec = {
-                "key": f"vector-{reponame}-{filename}-{i}",
-                "data": {"float32": vector},
-                "metadata": {
-                    "url": repo_remote_origin,
-                    "summary": "NOT IMPLEMENTED",
-                    "category": "NOT IMPLEMENTED",
-                    "text": chunk,
-                },
-            }
+    res = s3vectors.put_vectors(
+        vectorBucketName=BUCKET_NAME, indexName=INDEX_NAME, vectors=vectors
+    )
+
+    logger.debug(f"Got Repsonse:\n{res}")
+
+
+def embed_chunk(bedrock: BedrockRuntimeClient, chunk: str) -> list[float]:
+    res = bedrock.invoke_model(
+        modelId=MODEL_ID,
+        body=json.dumps(build_message(chunk)),
+        accept="application/json",
+        contentType="application/json",
+    )
+
+    payload = json.loads(res["body"].read())
+    return payload.get("embedding") or payload["embeddingsByType"]["float"]
 
-            logger.debug("Created new dict:")
-            logger.debug(f"Filename: {filename}")
-            logger.debug(new_vec)
-            logger.debug("\n\n")
 
-            vectors.append(new_vec)
+def embed_pending(
+    bedrock: BedrockRuntimeClient, item: Union[PendingChunk, FileDone]
+) -> Optional[list[float]]:
+    if isinstance(item, PendingChunk) and item.embed:
+        return embed_chunk(bedrock, item.text)
+    return None
+
+
+def chunk_and_upload(
+    docs: Iterable[IndexFile], chunk_size: int = 1000, overlap: int = 200
+) -> None:
+    session = boto3.Session(profile_name=PROFILE_NAME)
+    s3vectors = session.client("s3vectors", region_name=REGION_NAME)
 
-        # Upload this doc's vectors to s3
+    bedrock: BedrockRuntimeClient = session.client(
+        "bedrock-runtime",
+        region_name=REGION_NAME,
+        config=Config(
+            max_pool_connections=EMBED_MAX_CONCURRENCY,
+            # The pool retries throttled calls itself, so it sees every
+            # throttle and can adapt its concurrency
+            retries={"total_max_attempts": 1},
+        ),
+    )
+    pool = EmbeddingPool(
+        partial(embed_pending, bedrock),
+        max_concurrency=EMBED_MAX_CONCURRENCY,
+        initial_concurrency=EMBED_INITIAL_CONCURRENCY,
+        rate_limiter=(
+            model_rate_limiter(MODEL_ID, float(EMBED_RATE_LIMIT))
+            if EMBED_RATE_LIMIT
+            else None
+        ),
+    )
+    manifest = IngestManifest(INGEST_MANIFEST)
+    rekey_vectors(s3vectors, manifest)
+    model = f"{MODEL_ID}/{EMBEDDING_DIMENSIONS}"
+    chunks_jsonl = open(CHUNKS_JSONL, "a") if CHUNKS_JSONL else None
+
+    uploader = VectorUploader(
+        partial(put_vectors, s3vectors),
+        max_vectors=S3_VECTORS_BATCH_SIZE,
+        max_bytes=S3_VECTORS_MAX_BATCH_BYTES,
+        max_in_flight=S3_VECTORS_MAX_IN_FLIGHT,
+    )
 
-        logger.debug(f"Uploading {len(vectors)} vector(s) to S3")
+    def checkpoint(tags: list):
+        """Record uploaded chunks and finished files in the manifest"""
+        if not tags:
+            return
 
-        res = s3vectors.put_vectors(
-            vectorBucketName=BUCKET_NAME, indexName=INDEX_NAME, vectors=vectors
+        manifest.record_chunks(
+            (item.doc.repo_name, item.doc.file_relpath, item.offset, item.chunk_hash)
+            for item in tags
+            if isinstance(item, PendingChunk)
         )
+        for item in tags:
+            if isinstance(item, FileDone):
+                manifest.complete_file(item.doc.repo_name, item.doc.file_relpath)
+        manifest.commit()
+
+    upload_start = time.perf_counter()
+    uploaded = 0
+    embedded = 0
+    progress = tqdm(unit="chunk", smoothing=0.1)
+
+    planned = plan_chunks(
+        docs, manifest, model, chunk_size, overlap, processes=CHUNK_PROCESSES
+    )
+    for item, vector in pool.embed(planned):
+        reponame, _, file_relpath, repo_remote_origin = item.doc
+
+        if isinstance(item, FileDone):
+            if item.stale_offsets:
+                keys = [
+                    vector_key(reponame, file_relpath, i) for i in item.stale_offsets
+                ]
+                logger.debug(f"Deleting {len(keys)} stale vector(s) from S3")
+                for start in range(0, len(keys), S3_VECTORS_MAX_BATCH_SIZE):
+                    s3vectors.delete_vectors(
+                        vectorBucketName=BUCKET_NAME,
+                        indexName=INDEX_NAME,
+                        keys=keys[start : start + S3_VECTORS_MAX_BATCH_SIZE],
+                    )
+                manifest.remove_chunks(reponame, file_relpath, item.stale_offsets)
+
+                if chunks_jsonl is not None:
+                    for offset in item.stale_offsets:
+                        tombstone = {
+                            "repo": reponame,
+                            "path": file_relpath,
+                            "offset": offset,
+                            "deleted": True,
+                        }
+                        chunks_jsonl.write(json.dumps(tombstone) + "\n")
+            uploader.mark(item)
+            checkpoint(uploader.done())
+            continue
+
+        if vector is None:
+            # Embedded in an earlier run, or earlier in this one
+            vector = manifest.embedding(model, item.chunk_hash)
+        else:
+            manifest.store_embedding(model, item.chunk_hash, vector)
+            embedded += 1
+
+        # Create a dictionary for uploading to S3 vectors
+
+        new_vec = {
+            "key": vector_key(reponame, file_relpath, item.offset),
+            "data": {"float32": vector},
+            "metadata": vector_metadata(repo_remote_origin, item.text),
+        }
+
+        logger.debug("Created new dict:")
+        logger.debug(f"File: {file_relpath}")
+        logger.debug(new_vec)
+        logger.debug("\n\n")
+
+        uploader.add(new_vec, tag=item)
+        uploaded += 1
+        progress.update()
+
+        if chunks_jsonl is not None:
+            record = {
+                "text": item.text,
+                "url": repo_remote_origin,
+                "repo": reponame,
+                "path": file_relpath,
+                "offset": item.offset,
+            }
+            chunks_jsonl.write(json.dumps(record) + "\n")
+
+        checkpoint(uploader.done())
+
+    checkpoint(uploader.close())
+    manifest.close()
+    progress.close()
 
-        logger.debug(f"Got Repsonse:\n{res}")
+    if chunks_jsonl is not None:
+        chunks_jsonl.close()
+
+    elapsed = time.perf_counter() - upload_start
+    logger.info(
+        f"Uploaded {uploaded} changed chunk(s) in {elapsed:.1f}s "
+        f"({uploaded / max(elapsed, 1e-9):.1f} chunks/s), embedding "
+        f"{embedded} of them; {pool.throttles} throttled call(s), "
+        f"concurrency settled at {int(pool.concurrency.limit)}; "
+        f"{uploader.calls} PutVectors call(s), {uploader.retries} retried"
+    )
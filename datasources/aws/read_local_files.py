@@ -1,55 +1,12 @@
 # from collections import namedtuple
 import argparse
-import json
 import logging
 
-import jsonschema
-
-from preprocess_docs import IndexFile, chunk_and_upload
+from index_reader import read_index_json
+from preprocess_docs import chunk_and_upload
 
 logger = logging.getLogger(__name__)
 
-index_schema = {
-    "type": "array",
-    "items": {
-        "type": "object",
-        "properties": {
-            "repo_name": {"type": "string"},
-            "file_abspath": {"type": "string"},
-            "file_relpath": {"type": "string"},
-            "repo_remote_origin": {"type": ["string", "null"]},
-        },
-    },
-    "required": ["repo_name", "file_abspath", "file_relpath", "repo_remote_origin"],
-    "additionalProperties": True,
-}
-
-
-def read_index_json(filename: str) -> list[IndexFile]:
-    mds = []
-
-    with open(filename, "r") as f:
-        try:
-            data = json.load(f)
-            jsonschema.validate(data, index_schema)
-
-            for item in data:
-                if "repo_remote_origin" in item.keys():
-                    # if item["source"] is not None:
-                    mds.append(
-                        IndexFile(
-                            item["repo_name"],
-                            item["file_abspath"],
-                            item["file_relpath"],
-                            item["repo_remote_origin"],
-                        )
-                    )
-
-        except jsonschema.ValidationError as e:
-            print(f"Could not validate source list: {e.message}")
-
-    return mds
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -65,11 +22,5 @@ if __name__ == "__main__":
     # handler.setFormatter(formatter)
     # logger.addHandler(handler)
 
-    docs = read_index_json(args.filename)
-
-    logger.info(f"Read {len(docs)} docs")
-
-    for doc in docs:
-        logger.debug(f"Doc: {doc}")
-
-    chunk_and_upload(docs)
+    # Docs are read as chunk_and_upload gets to them
+    chunk_and_upload(read_index_json(args.filename))
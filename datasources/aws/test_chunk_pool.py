@@ -0,0 +1,66 @@
+# test_chunk_pool.py
+import pytest
+
+from chunk_pool import chunk_files, iter_chunk_records
+from chunk_text import chunk_text
+from manifest import content_hash
+
+
+def write_files(tmp_path, count: int) -> list[str]:
+    filepaths = []
+    for i in range(count):
+        sentences = [f"File {i} sentence {j} says something." for j in range(i * 7)]
+        filepath = tmp_path / f"doc-{i}.md"
+        filepath.write_text(" ".join(sentences))
+        filepaths.append(str(filepath))
+    return filepaths
+
+
+def expected_records(filepaths: list[str], chunk_size: int, overlap: int) -> list:
+    records = []
+    for filepath in filepaths:
+        with open(filepath) as f:
+            chunks = chunk_text(f.read(), chunk_size=chunk_size, overlap=overlap)
+        records.extend((filepath, i, chunk) for i, chunk in enumerate(chunks))
+    return records
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_records_match_serial_chunking_in_order(tmp_path, processes):
+    filepaths = write_files(tmp_path, 30)
+
+    records = list(iter_chunk_records(filepaths, 200, 50, processes=processes))
+
+    assert records == expected_records(filepaths, 200, 50)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_files_with_the_expected_hash_are_skipped(tmp_path, processes):
+    filepaths = write_files(tmp_path, 20)
+    with open(filepaths[3]) as f:
+        skip_hash = content_hash(f.read())
+
+    results = list(
+        chunk_files(
+            range(20),
+            lambda i: (filepaths[i], skip_hash if i in (3, 5) else None),
+            chunk_size=200,
+            overlap=50,
+            processes=processes,
+            batch_size=3,
+        )
+    )
+
+    assert [i for i, _ in results] == list(range(20))
+    # 5 has a different hash, so is chunked anyway
+    assert [i for i, chunked in results if chunked.chunks is None] == [3]
+    _, chunked = results[5]
+    assert chunked.chunk_hashes == [content_hash(c) for c in chunked.chunks]
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_unreadable_files_raise(tmp_path, processes):
+    filepaths = write_files(tmp_path, 4) + [str(tmp_path / "missing.md")]
+
+    with pytest.raises(FileNotFoundError):
+        list(iter_chunk_records(filepaths, processes=processes))
@@ -0,0 +1,156 @@
+# test_embed_pool.py
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from embed_pool import (
+    AdaptiveConcurrency,
+    EmbeddingPool,
+    RateLimiter,
+    backoff_delay,
+    is_throttle,
+)
+
+
+def throttling_error() -> ClientError:
+    return ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+        "InvokeModel",
+    )
+
+
+class FakeEndpoint:
+    """Takes latency seconds per call and throttles any call beyond capacity
+    in flight at once
+    """
+
+    def __init__(self, latency: float = 0.01, capacity: int = 1000) -> None:
+        self.latency = latency
+        self.capacity = capacity
+        self.in_flight = 0
+        self.peak = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> list[float]:
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.throttled += 1
+                raise throttling_error()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            return [float(len(text))]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_results_are_in_input_order():
+    endpoint = FakeEndpoint()
+    pool = EmbeddingPool(endpoint, max_concurrency=8, initial_concurrency=8)
+    texts = ["x" * n for n in range(100)]
+
+    results = list(pool.embed(texts))
+
+    assert [text for text, _ in results] == texts
+    assert [vector for _, vector in results] == [[float(n)] for n in range(100)]
+    assert pool.completed == 100
+    assert 1 < endpoint.peak <= 8
+
+
+def test_concurrency_is_faster_than_serial():
+    endpoint = FakeEndpoint(latency=0.02)
+    pool = EmbeddingPool(endpoint, max_concurrency=16, initial_concurrency=16)
+
+    start = time.perf_counter()
+    assert len(list(pool.embed(["text"] * 64))) == 64
+    # Serially this would take 64 * 20 ms
+    assert time.perf_counter() - start < 0.5
+
+
+def test_throttling_reduces_concurrency_and_retries():
+    endpoint = FakeEndpoint(latency=0.01, capacity=3)
+    pool = EmbeddingPool(
+        endpoint,
+        max_concurrency=16,
+        initial_concurrency=16,
+        backoff_base=0.001,
+        backoff_cap=0.01,
+        max_retries=50,
+    )
+
+    results = list(pool.embed(["text"] * 100))
+
+    assert len(results) == 100
+    assert endpoint.throttled > 0
+    assert pool.throttles == endpoint.throttled
+    assert pool.concurrency.limit < 16
+
+
+def test_errors_other_than_throttling_are_raised():
+    def embed_one(text: str) -> list[float]:
+        if text == "bad":
+            raise ValueError("bad chunk")
+        return [1.0]
+
+    pool = EmbeddingPool(embed_one, max_concurrency=4)
+
+    with pytest.raises(ValueError):
+        list(pool.embed(["ok", "ok", "bad", "ok"]))
+    assert pool.throttles == 0
+
+
+def test_gives_up_after_max_retries():
+    calls = []
+
+    def embed_one(text: str) -> list[float]:
+        calls.append(text)
+        raise throttling_error()
+
+    pool = EmbeddingPool(embed_one, max_retries=2, backoff_base=0.001)
+
+    with pytest.raises(ClientError):
+        list(pool.embed(["text"]))
+    assert len(calls) == 3
+
+
+def test_is_throttle():
+    assert is_throttle(throttling_error())
+    assert not is_throttle(
+        ClientError({"Error": {"Code": "ValidationException"}}, "InvokeModel")
+    )
+    assert not is_throttle(ValueError())
+
+
+def test_backoff_delay_is_capped_and_jittered():
+    delays = [backoff_delay(10, base=0.5, cap=2.0) for _ in range(200)]
+    assert all(0 <= d <= 2.0 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_adaptive_concurrency_aimd():
+    limiter = AdaptiveConcurrency(initial=8, minimum=1, maximum=10)
+
+    started = [limiter.acquire() for _ in range(4)]
+    # A burst of throttles from calls in flight together only halves once
+    for s in started:
+        limiter.release(s, throttled=True)
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.release(limiter.acquire())
+    assert limiter.limit == pytest.approx(5, abs=0.2)
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=100, burst=1)
+
+    start = time.perf_counter()
+    for _ in range(20):
+        limiter.acquire()
+    # The first call is free, the other 19 wait 10 ms each
+    assert time.perf_counter() - start >= 0.15
@@ -0,0 +1,113 @@
+# test_index_reader.py
+import io
+import json
+
+import pytest
+
+pytest.importorskip("jsonschema")
+
+from index_reader import IndexFile, iter_json_records, read_index_json  # noqa: E402
+
+
+def record(i: int, origin="https://github.com/example/repo") -> dict:
+    return {
+        "repo_name": "repo",
+        "file_abspath": f"/src/repo/docs/{i}.md",
+        "file_relpath": f"docs/{i}.md",
+        "repo_remote_origin": origin,
+    }
+
+
+class CountingReader(io.StringIO):
+    """Tracks how much of the file has been read"""
+
+    def __init__(self, text: str) -> None:
+        super().__init__(text)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.chars_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = super().readline(size)
+        self.chars_read += len(data)
+        return data
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 16])
+def test_json_array(read_size):
+    values = [
+        record(0),
+        {"text": 'brackets ] and [ commas, "quotes" \\ and é'},
+        [1, 2, {"nested": [3]}],
+        12345,
+        -0.5e10,
+        "string",
+        None,
+        True,
+    ]
+    text = " [\n" + ",\n  ".join(json.dumps(v) for v in values) + "\n] \n"
+
+    assert list(iter_json_records(io.StringIO(text), read_size)) == values
+
+
+def test_json_lines_skip_malformed_lines():
+    text = "\n".join(
+        [json.dumps(record(0)), "", "{not json", json.dumps(record(1))]
+    )
+
+    assert list(iter_json_records(io.StringIO(text))) == [record(0), record(1)]
+
+
+@pytest.mark.parametrize("text", ["", "   \n", "[]", " [ \n ] "])
+def test_empty(text):
+    assert list(iter_json_records(io.StringIO(text))) == []
+
+
+@pytest.mark.parametrize("text", ["[", '[{"a": 1}', '[{"a": 1} {"b": 2}]', "[{bad}]"])
+def test_malformed_array_raises(text):
+    with pytest.raises(ValueError):
+        list(iter_json_records(io.StringIO(text), read_size=4))
+
+
+@pytest.mark.parametrize("json_lines", [False, True])
+def test_records_are_read_lazily(json_lines):
+    records = [record(i) for i in range(10_000)]
+    if json_lines:
+        text = "\n".join(json.dumps(r) for r in records)
+    else:
+        text = json.dumps(records)
+
+    f = CountingReader(text)
+    reader = iter_json_records(f, read_size=4096)
+
+    assert next(reader) == records[0]
+    assert f.chars_read < 10_000 < len(text)
+
+
+@pytest.mark.parametrize("suffix", [".json", ".jsonl"])
+def test_read_index_json_skips_invalid_records(tmp_path, suffix):
+    records = [
+        record(0),
+        {"repo_name": "repo", "file_relpath": "missing/abspath.md"},
+        record(2, origin=None),
+        {**record(3), "repo_name": 3},
+        {**record(4), "extra": "is fine"},
+        ["not", "an", "object"],
+    ]
+    filename = tmp_path / f"index{suffix}"
+    if suffix == ".json":
+        filename.write_text(json.dumps(records))
+    else:
+        filename.write_text("\n".join(json.dumps(r) for r in records))
+
+    docs = list(read_index_json(str(filename)))
+
+    origin = record(0)["repo_remote_origin"]
+    assert docs == [
+        IndexFile("repo", "/src/repo/docs/0.md", "docs/0.md", origin),
+        IndexFile("repo", "/src/repo/docs/2.md", "docs/2.md", None),
+        IndexFile("repo", "/src/repo/docs/4.md", "docs/4.md", origin),
+    ]
@@ -0,0 +1,106 @@
+# test_manifest.py
+import pytest
+
+from manifest import FileState, IngestManifest, content_hash
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    with IngestManifest(str(tmp_path / "manifest.db")) as m:
+        yield m
+
+
+def test_content_hash_is_stable():
+    assert content_hash("some text") == content_hash("some text")
+    assert content_hash("some text") != content_hash("some text.")
+
+
+def test_file_state_round_trip(manifest):
+    assert manifest.file("repo", "a.md") is None
+
+    manifest.start_file("repo", "a.md", "h1", "https://origin", "1000/200")
+    assert manifest.file("repo", "a.md") == FileState(
+        "h1", "https://origin", "1000/200", False
+    )
+
+    manifest.complete_file("repo", "a.md")
+    assert manifest.file("repo", "a.md").complete
+
+    # Starting it again with new content marks it incomplete until done
+    manifest.start_file("repo", "a.md", "h2", "https://origin", "1000/200")
+    assert manifest.file("repo", "a.md") == FileState(
+        "h2", "https://origin", "1000/200", False
+    )
+
+
+def test_chunks_survive_a_content_change_but_not_a_url_change(manifest):
+    manifest.start_file("repo", "a.md", "h1", "https://origin", "1000/200")
+    manifest.record_chunks([("repo", "a.md", 0, "c0"), ("repo", "a.md", 1, "c1")])
+    manifest.record_chunks([("repo", "b.md", 0, "c0")])
+
+    manifest.start_file("repo", "a.md", "h2", "https://origin", "1000/200")
+    assert manifest.chunk_hashes("repo", "a.md") == {0: "c0", 1: "c1"}
+
+    manifest.start_file("repo", "a.md", "h2", "https://moved", "1000/200")
+    assert manifest.chunk_hashes("repo", "a.md") == {}
+    assert manifest.chunk_hashes("repo", "b.md") == {0: "c0"}
+
+
+def test_remove_chunks(manifest):
+    manifest.record_chunks([("repo", "a.md", i, f"c{i}") for i in range(4)])
+    manifest.remove_chunks("repo", "a.md", [2, 3])
+    assert manifest.chunk_hashes("repo", "a.md") == {0: "c0", 1: "c1"}
+
+
+def test_embeddings_are_per_model(manifest):
+    assert manifest.embedding("titan/256", "c0") is None
+    assert not manifest.has_embedding("titan/256", "c0")
+
+    manifest.store_embedding("titan/256", "c0", [0.5, -1.0, 2.0])
+    assert manifest.has_embedding("titan/256", "c0")
+    assert manifest.embedding("titan/256", "c0") == [0.5, -1.0, 2.0]
+    assert manifest.embedding("titan/1024", "c0") is None
+
+
+def test_only_committed_changes_survive_a_crash(tmp_path):
+    filename = str(tmp_path / "manifest.db")
+
+    m = IngestManifest(filename)
+    m.record_chunks([("repo", "a.md", 0, "c0")])
+    m.commit()
+    m.record_chunks([("repo", "a.md", 1, "c1")])
+    m.store_embedding("titan/256", "c1", [1.0])
+    # No commit, as if the run died before the upload finished
+    m.connection.close()
+
+    with IngestManifest(filename) as reopened:
+        assert reopened.chunk_hashes("repo", "a.md") == {0: "c0"}
+        assert reopened.embedding("titan/256", "c1") is None
+
+
+def test_forget_uploads_keeps_embeddings(manifest):
+    manifest.start_file("repo", "a.md", "h1", "https://origin", "1000/200")
+    manifest.record_chunks([("repo", "a.md", 0, "c0"), ("repo", "a.md", 1, "c1")])
+    manifest.complete_file("repo", "a.md")
+    manifest.store_embedding("model", "c0", [1.0, 2.0])
+    assert sorted(manifest.uploaded_chunks()) == [
+        ("repo", "a.md", 0),
+        ("repo", "a.md", 1),
+    ]
+
+    manifest.forget_uploads()
+
+    assert manifest.uploaded_chunks() == []
+    assert not manifest.file("repo", "a.md").complete
+    assert manifest.embedding("model", "c0") == [1.0, 2.0]
+
+
+def test_key_format_is_stored(tmp_path):
+    filename = str(tmp_path / "manifest.db")
+    with IngestManifest(filename) as manifest:
+        assert manifest.key_format == 0
+        manifest.key_format = 1
+        manifest.commit()
+
+    with IngestManifest(filename) as manifest:
+        assert manifest.key_format == 1
@@ -0,0 +1,127 @@
+# test_preprocess_docs.py
+import io
+import json
+import os
+import threading
+
+import pytest
+
+# Read at import, and checked to be set
+for name in ("BUCKET_NAME", "INDEX_NAME", "MODEL_ID", "PROFILE_NAME", "REGION_NAME"):
+    os.environ.setdefault(name, "testing")
+
+import preprocess_docs  # noqa: E402
+from index_reader import IndexFile  # noqa: E402
+from manifest import IngestManifest  # noqa: E402
+from preprocess_docs import legacy_vector_key, rekey_vectors, vector_key  # noqa: E402
+
+
+class FakeS3Vectors:
+    def __init__(self) -> None:
+        self.stored = {}
+        self._lock = threading.Lock()
+
+    def put_vectors(self, vectorBucketName: str, indexName: str, vectors: list):
+        with self._lock:
+            self.stored.update((v["key"], v) for v in vectors)
+
+    def delete_vectors(self, vectorBucketName: str, indexName: str, keys: list):
+        with self._lock:
+            for key in keys:
+                self.stored.pop(key, None)
+
+
+class FakeBedrock:
+    def __init__(self) -> None:
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, accept, contentType):
+        with self._lock:
+            self.calls += 1
+        text = json.loads(body)["inputText"]
+        vector = [float(len(text))] * preprocess_docs.EMBEDDING_DIMENSIONS
+        return {"body": io.BytesIO(json.dumps({"embedding": vector}).encode())}
+
+
+class FakeSession:
+    def __init__(self, s3vectors: FakeS3Vectors, bedrock: FakeBedrock) -> None:
+        self.clients = {"s3vectors": s3vectors, "bedrock-runtime": bedrock}
+
+    def client(self, name: str, **kwargs):
+        return self.clients[name]
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    s3vectors, bedrock = FakeS3Vectors(), FakeBedrock()
+    monkeypatch.setattr(
+        preprocess_docs.boto3,
+        "Session",
+        lambda profile_name: FakeSession(s3vectors, bedrock),
+    )
+    monkeypatch.setattr(
+        preprocess_docs, "INGEST_MANIFEST", str(tmp_path / "manifest.db")
+    )
+    monkeypatch.setattr(preprocess_docs, "CHUNK_PROCESSES", 1)
+    return s3vectors, bedrock
+
+
+def write_doc(tmp_path, relpath: str, sentences: int) -> IndexFile:
+    filepath = tmp_path / "repo" / relpath
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    filepath.write_text(
+        " ".join(f"{relpath} sentence {i} says something." for i in range(sentences))
+    )
+    return IndexFile("repo", str(filepath), relpath, "https://origin")
+
+
+def keys_of(s3vectors: FakeS3Vectors, relpath: str) -> list[str]:
+    prefix = f"vector-repo-{relpath}-"
+    return sorted(key for key in s3vectors.stored if key.startswith(prefix))
+
+
+def test_files_sharing_a_name_keep_their_own_vectors(tmp_path, fakes):
+    s3vectors, _ = fakes
+    docs = [write_doc(tmp_path, "docs/README.md", 60)]
+    src = write_doc(tmp_path, "src/README.md", 60)
+    preprocess_docs.chunk_and_upload(docs + [src], chunk_size=200, overlap=50)
+    src_keys = keys_of(s3vectors, "src/README.md")
+    assert len(src_keys) > 3
+    assert len(keys_of(s3vectors, "docs/README.md")) == len(src_keys)
+
+    # docs/README.md shrinks, deleting its stale offsets only
+    docs = [write_doc(tmp_path, "docs/README.md", 2)]
+    preprocess_docs.chunk_and_upload(docs + [src], chunk_size=200, overlap=50)
+
+    assert keys_of(s3vectors, "docs/README.md") == [
+        vector_key("repo", "docs/README.md", 0)
+    ]
+    assert keys_of(s3vectors, "src/README.md") == src_keys
+
+
+def test_vectors_keyed_by_file_name_are_rekeyed_once(tmp_path, fakes):
+    s3vectors, bedrock = fakes
+    docs = [write_doc(tmp_path, "docs/guide.md", 30)]
+    preprocess_docs.chunk_and_upload(docs, chunk_size=200, overlap=50)
+    embedded = bedrock.calls
+    new_keys = sorted(s3vectors.stored)
+
+    # Roll the bucket and manifest back to the old key format
+    with IngestManifest(preprocess_docs.INGEST_MANIFEST) as manifest:
+        old = [legacy_vector_key(*chunk) for chunk in manifest.uploaded_chunks()]
+        manifest.key_format = 0
+        manifest.commit()
+    s3vectors.stored = {key: {"key": key} for key in old}
+
+    preprocess_docs.chunk_and_upload(docs, chunk_size=200, overlap=50)
+
+    assert sorted(s3vectors.stored) == new_keys
+    # Uploaded again from the manifest's embeddings
+    assert bedrock.calls == embedded
+
+    with IngestManifest(preprocess_docs.INGEST_MANIFEST) as manifest:
+        assert manifest.key_format == preprocess_docs.KEY_FORMAT
+        # Already on the current format, so nothing more happens
+        rekey_vectors(s3vectors, manifest)
+        assert len(manifest.uploaded_chunks()) == len(new_keys)
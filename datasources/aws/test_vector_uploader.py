@@ -0,0 +1,189 @@
+# test_vector_uploader.py
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from vector_uploader import VectorUploader, vector_bytes
+
+
+def client_error(code: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "PutVectors",
+    )
+
+
+class FakeS3Vectors:
+    """Stands in for the s3vectors client, enforcing PutVectors limits"""
+
+    def __init__(
+        self,
+        max_vectors: int = 500,
+        max_bytes: int = 2**20,
+        latency: float = 0.0,
+        throttle_first: int = 0,
+        invalid_keys: frozenset = frozenset(),
+    ) -> None:
+        self.max_vectors = max_vectors
+        self.max_bytes = max_bytes
+        self.latency = latency
+        self.throttle_first = throttle_first
+        self.invalid_keys = invalid_keys
+
+        self.calls = 0
+        self.batch_sizes = []
+        self.stored = {}
+        self._lock = threading.Lock()
+
+    def put_vectors(self, vectorBucketName: str, indexName: str, vectors: list):
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.throttle_first:
+                raise client_error("ThrottlingException", 429)
+
+        if len(vectors) > self.max_vectors:
+            raise client_error("ValidationException")
+        if len(json.dumps(vectors)) > self.max_bytes:
+            raise client_error("RequestEntityTooLarge", 413)
+        if any(v["key"] in self.invalid_keys for v in vectors):
+            raise client_error("ValidationException")
+
+        time.sleep(self.latency)
+        with self._lock:
+            self.batch_sizes.append(len(vectors))
+            for v in vectors:
+                self.stored[v["key"]] = v
+        return {}
+
+
+def make_vector(i: int, text: str = "some chunk text") -> dict:
+    return {
+        "key": f"vector-repo-file.md-{i}",
+        "data": {"float32": [0.25] * 8},
+        "metadata": {"url": "https://example.com", "text": text},
+    }
+
+
+def uploader_for(fake: FakeS3Vectors, **kwargs) -> VectorUploader:
+    kwargs.setdefault("backoff_base", 0.001)
+    return VectorUploader(
+        lambda vectors: fake.put_vectors(
+            vectorBucketName="bucket", indexName="index", vectors=vectors
+        ),
+        **kwargs,
+    )
+
+
+def test_batches_are_capped_by_count():
+    fake = FakeS3Vectors()
+    uploader = uploader_for(fake, max_vectors=500)
+
+    for i in range(1200):
+        uploader.add(make_vector(i))
+    uploader.close()
+
+    assert sorted(fake.batch_sizes) == [200, 500, 500]
+    assert len(fake.stored) == 1200
+
+
+def test_batches_are_capped_by_bytes():
+    fake = FakeS3Vectors(max_bytes=10_000)
+    uploader = uploader_for(fake, max_bytes=10_000)
+    vectors = [make_vector(i, text="x" * 500) for i in range(100)]
+
+    for vector in vectors:
+        uploader.add(vector)
+    uploader.close()
+
+    per_batch = 10_000 // vector_bytes(vectors[0])
+    assert len(fake.stored) == 100
+    assert max(fake.batch_sizes) <= per_batch
+    assert fake.calls == len(fake.batch_sizes)
+
+
+def test_a_vector_larger_than_a_batch_is_refused():
+    uploader = uploader_for(FakeS3Vectors(), max_bytes=100)
+    with pytest.raises(ValueError):
+        uploader.add(make_vector(0, text="x" * 200))
+    uploader.close()
+
+
+def test_small_documents_are_coalesced_and_tags_come_back_in_order():
+    fake = FakeS3Vectors()
+    uploader = uploader_for(fake, max_vectors=10)
+
+    tags = []
+    for doc in range(7):
+        for i in range(3):
+            uploader.add(make_vector(10 * doc + i), tag=(doc, i))
+            tags.append((doc, i))
+        uploader.mark(("done", doc))
+        tags.append(("done", doc))
+
+    done = uploader.done() + uploader.close()
+
+    assert done == tags
+    assert fake.calls == 3
+    assert uploader.uploaded == 21
+
+
+def test_throttled_batches_are_retried():
+    fake = FakeS3Vectors(throttle_first=3)
+    uploader = uploader_for(fake, max_vectors=5)
+
+    for i in range(20):
+        uploader.add(make_vector(i))
+    uploader.close()
+
+    assert len(fake.stored) == 20
+    assert uploader.retries == 3
+
+
+def test_rejected_batches_are_split():
+    # The service turns down anything over 8 vectors, the uploader thinks 32
+    fake = FakeS3Vectors(max_vectors=8)
+    uploader = uploader_for(fake, max_vectors=32)
+
+    for i in range(64):
+        uploader.add(make_vector(i))
+    uploader.close()
+
+    assert len(fake.stored) == 64
+    assert max(fake.batch_sizes) <= 8
+
+
+def test_an_invalid_vector_fails_the_upload():
+    fake = FakeS3Vectors(invalid_keys=frozenset({"vector-repo-file.md-13"}))
+    uploader = uploader_for(fake, max_vectors=16)
+
+    for i in range(32):
+        uploader.add(make_vector(i))
+
+    with pytest.raises(ClientError):
+        uploader.close()
+    # Only the one bad vector is left out
+    assert len(fake.stored) == 31
+
+
+def test_uploads_run_concurrently_with_the_caller():
+    fake = FakeS3Vectors(latency=0.05)
+    uploader = uploader_for(fake, max_vectors=10, max_in_flight=4)
+
+    start = time.perf_counter()
+    for i in range(80):
+        uploader.add(make_vector(i))
+    added = time.perf_counter() - start
+    uploader.close()
+    total = time.perf_counter() - start
+
+    # 8 batches of 50 ms each, 4 at a time
+    assert total < 8 * 0.05
+    # add only waited for backpressure, not for every batch
+    assert added < total
+    assert len(fake.stored) == 80
@@ -0,0 +1,208 @@
+"""
+Batched, pipelined uploads to S3 Vectors.
+
+Vectors from any number of documents are coalesced into PutVectors calls
+of at most max_vectors vectors and max_bytes of JSON, which run on a few
+background threads while the caller keeps embedding. Throttled and
+transiently failing calls are retried with backoff, and a batch the
+service rejects as invalid is split in half until the offending vector is
+isolated, so one bad chunk doesn't fail its neighbours.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from embed_pool import backoff_delay, is_throttle
+
+logger = logging.getLogger(__name__)
+
+# Most vectors a single PutVectors call accepts
+S3_VECTORS_MAX_BATCH_SIZE = 500
+
+TRANSIENT_ERROR_CODES = frozenset(
+    {"InternalServerException", "InternalServerError", "RequestTimeout"}
+)
+
+
+def _error_code(e: BaseException) -> Optional[str]:
+    response = getattr(e, "response", None)
+    if not isinstance(response, dict):
+        return None
+    return response.get("Error", {}).get("Code")
+
+
+def is_transient(e: BaseException) -> bool:
+    return is_throttle(e) or _error_code(e) in TRANSIENT_ERROR_CODES
+
+
+def is_rejected(e: BaseException) -> bool:
+    """Whether the service refused the batch itself, e.g. as too large or
+    because one of its vectors is invalid
+    """
+    response = getattr(e, "response", None)
+    if not isinstance(response, dict):
+        return False
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return _error_code(e) == "ValidationException" or status == 413
+
+
+def vector_bytes(vector: dict) -> int:
+    """Roughly what vector adds to a PutVectors request body"""
+    return len(json.dumps(vector)) + 1
+
+
+class VectorUploader:
+    """Uploads vectors with put_batch(vectors), which should make one
+    PutVectors call, in batches of up to max_vectors vectors and max_bytes.
+    At most max_in_flight batches are uploading at once; add blocks when
+    that many are waiting.
+
+    Each vector can carry a tag, and mark adds a tag on its own. done
+    returns tags in the order they were added, once every vector added up
+    to that point is uploaded, so callers can checkpoint progress.
+    Upload errors are raised from add, mark, flush, done or close
+    """
+
+    def __init__(
+        self,
+        put_batch: Callable[[list[dict]], Any],
+        max_vectors: int = S3_VECTORS_MAX_BATCH_SIZE,
+        max_bytes: int = 5 * 2**20,
+        max_in_flight: int = 4,
+        max_retries: int = 8,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+    ) -> None:
+        self.put_batch = put_batch
+        self.max_vectors = max_vectors
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="put-vectors"
+        )
+        self._batch: list[dict] = []
+        self._batch_bytes = 0
+        self._tags: list = []
+        # (upload, tags) in the order the batches were made
+        self._pending: deque[tuple[Future, list]] = deque()
+        self._done_tags: list = []
+
+        self.uploaded = 0
+        self.calls = 0
+        self.retries = 0
+        self._stats_lock = threading.Lock()
+
+    def add(self, vector: dict, tag: Any = None) -> None:
+        size = vector_bytes(vector)
+        if size > self.max_bytes:
+            raise ValueError(
+                f"Vector {vector.get('key')} is {size} bytes, more than a "
+                f"whole batch ({self.max_bytes})"
+            )
+
+        if self._batch and (
+            len(self._batch) >= self.max_vectors
+            or self._batch_bytes + size > self.max_bytes
+        ):
+            self.flush()
+
+        self._batch.append(vector)
+        self._batch_bytes += size
+        if tag is not None:
+            self._tags.append(tag)
+
+    def mark(self, tag: Any) -> None:
+        self._tags.append(tag)
+
+    def flush(self) -> None:
+        """Start uploading the current batch, even if it isn't full"""
+        if not self._batch and not self._tags:
+            return
+
+        if self._batch:
+            future = self._executor.submit(self._upload, self._batch)
+        else:
+            # Only tags; they're done once everything before them is
+            future = Future()
+            future.set_result(None)
+        self._pending.append((future, self._tags))
+
+        self._batch = []
+        self._batch_bytes = 0
+        self._tags = []
+
+        # Backpressure, so a fast producer can't queue unbounded batches
+        while len(self._pending) > self.max_in_flight:
+            self._done_tags.extend(self._wait_oldest())
+
+    def done(self) -> list:
+        """Tags that have been uploaded since the last call"""
+        while self._pending and self._pending[0][0].done():
+            self._done_tags.extend(self._wait_oldest())
+
+        tags, self._done_tags = self._done_tags, []
+        return tags
+
+    def close(self) -> list:
+        """Upload everything left and return the remaining done tags"""
+        try:
+            self.flush()
+            while self._pending:
+                self._done_tags.extend(self._wait_oldest())
+            return self.done()
+        finally:
+            for future, _ in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+
+    def _wait_oldest(self) -> list:
+        future, tags = self._pending[0]
+        future.result()
+        self._pending.popleft()
+        return tags
+
+    def _upload(self, batch: list[dict]) -> None:
+        attempt = 0
+        while True:
+            try:
+                with self._stats_lock:
+                    self.calls += 1
+                self.put_batch(batch)
+            except Exception as e:
+                if is_rejected(e) and len(batch) > 1:
+                    middle = len(batch) // 2
+                    logger.debug(
+                        f"Batch of {len(batch)} vectors rejected, splitting it: {e}"
+                    )
+                    # Upload whatever is valid before reporting the rest
+                    errors = []
+                    for half in (batch[:middle], batch[middle:]):
+                        try:
+                            self._upload(half)
+                        except Exception as half_error:
+                            errors.append(half_error)
+                    if errors:
+                        raise errors[0]
+                    return
+
+                if not is_transient(e) or attempt >= self.max_retries:
+                    raise
+
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                attempt += 1
+                continue
+
+            with self._stats_lock:
+                self.uploaded += len(batch)
+            return
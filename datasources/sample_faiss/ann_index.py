@@ -0,0 +1,232 @@
+"""
+Helpers for building and searching the approximate nearest neighbour
+index types FaissIndex supports. Kept free of the embedding model so the
+benchmark can use them on precomputed or synthetic embeddings.
+"""
+
+import logging
+import math
+from typing import Callable, Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw", "opq")
+
+# How the full vectors are stored by the flat, ivf and hnsw index types
+STORAGE_TYPES = ("float32", "float16", "int8", "binary")
+STORAGE_CODES = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+# Below this, brute force is already fast
+MIN_ANN_VECTORS = 1000
+
+# faiss wants this many training points for each k-means centroid
+MIN_POINTS_PER_CENTROID = 39
+
+# 8-bit PQ codebooks have 256 centroids; below this ivfpq uses fewer bits
+MIN_PQ_VECTORS = 256 * MIN_POINTS_PER_CENTROID
+
+
+def pq_subquantizers(d: int) -> int:
+    """Largest number of PQ sub-quantizers (at most 64) that splits d into
+    pieces of at least 8 dimensions
+    """
+    for m in range(min(64, d // 8), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def pq_bits(n: int) -> int:
+    """Bits per PQ code (at most 8) whose codebooks n vectors can train"""
+    return max(1, min(8, int(math.log2(max(n // MIN_POINTS_PER_CENTROID, 2)))))
+
+
+def index_spec(index_type: str, n: int, d: int, storage: str = "float32") -> str:
+    """Translate an index type from INDEX_TYPES into a faiss index_factory
+    string sized for n vectors of width d, storing vectors as one of
+    STORAGE_TYPES. Anything else is assumed to already be a factory string
+    and is passed through
+    """
+    storage = storage.lower()
+    if storage not in STORAGE_TYPES:
+        raise ValueError(
+            f"Unknown storage type {storage}, expected one of {STORAGE_TYPES}"
+        )
+    # Factory strings are case sensitive, so only the known names are folded
+    if index_type.lower() not in INDEX_TYPES:
+        return index_type
+    index_type = index_type.lower()
+
+    if storage == "binary":
+        # One sign bit per dimension, searched exhaustively by Hamming
+        # distance and re-ranked with the float vectors; see rescored_search
+        if index_type != "flat":
+            logger.info(
+                f"Binary codes are searched exhaustively, ignoring {index_type}"
+            )
+        return "LSH"
+
+    code = STORAGE_CODES[storage]
+    if index_type in ("ivfpq", "opq") and storage != "float32":
+        logger.info(f"{index_type} is already compressed, ignoring {storage} storage")
+
+    if index_type != "flat" and n < MIN_ANN_VECTORS:
+        logger.info(f"Only {n} vectors, using a flat index instead of {index_type}")
+        return code
+
+    # ~4 * sqrt(n) lists, keeping enough training points per centroid
+    nlist = max(1, min(int(4 * math.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+    m = pq_subquantizers(d)
+
+    pq = f"PQ{m}"
+    if index_type in ("ivfpq", "opq") and n < MIN_PQ_VECTORS:
+        bits = pq_bits(n)
+        pq = f"PQ{m}x{bits}"
+        # OPQ trains its rotation with 8-bit codebooks whatever the bits
+        if index_type == "opq":
+            logger.info(f"Only {n} vectors, using ivfpq instead of opq")
+            index_type = "ivfpq"
+        logger.info(f"Only {n} vectors, using {bits}-bit PQ codes")
+
+    return {
+        "flat": code,
+        "ivf": f"IVF{nlist},{code}",
+        "ivfpq": f"IVF{nlist},{pq}",
+        "hnsw": f"HNSW32,{code}",
+        "opq": f"OPQ{m},IVF{nlist},{pq}",
+    }[index_type]
+
+
+def build_index(
+    embeddings: np.ndarray,
+    spec: str,
+    train_sample: int = 100_000,
+    seed: int = 0,
+    ids: Optional[np.ndarray] = None,
+) -> faiss.Index:
+    """Create an index from a factory string, train it on a random sample of
+    at most train_sample embeddings if it needs training, and add every embedding.
+    If ids are given they are used as the labels search returns; IVF indexes
+    store them natively and anything else is wrapped in an IndexIDMap2
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    index = faiss.index_factory(embeddings.shape[1], spec)
+    if ids is not None and faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+
+    if not index.is_trained:
+        sample = embeddings
+        if len(embeddings) > train_sample:
+            rng = np.random.default_rng(seed)
+            sample = embeddings[rng.choice(len(embeddings), train_sample, replace=False)]
+
+        logger.info(f"Training {spec} on {len(sample)} vectors")
+        index.train(sample)
+
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.ascontiguousarray(ids, dtype="int64"))
+    return index
+
+
+def search_parameters(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    sel: Optional[faiss.IDSelector] = None,
+) -> Optional[faiss.SearchParameters]:
+    """Per-query search parameters for index: nprobe for IVF indexes and
+    efSearch for HNSW, and sel to only consider the ids it selects. faiss
+    doesn't keep sel alive, so the caller must hold a reference for as long
+    as the parameters are used. Returns None if there is nothing to set
+    """
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    pretransform = isinstance(inner, faiss.IndexPreTransform)
+    if pretransform:
+        inner = faiss.downcast_index(inner.index)
+
+    if nprobe is not None and faiss.try_extract_index_ivf(inner) is not None:
+        params = faiss.SearchParametersIVF(nprobe=nprobe)
+    elif ef_search is not None and isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search)
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+
+    if sel is not None:
+        params.sel = sel
+
+    if pretransform:
+        return faiss.SearchParametersPreTransform(index_params=params)
+
+    return params
+
+
+def is_binary(index: faiss.Index) -> bool:
+    """Whether index stores binary codes and needs rescored_search"""
+    inner = faiss.downcast_index(index)
+    if isinstance(inner, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(inner.index)
+    return isinstance(inner, faiss.IndexLSH)
+
+
+def rescored_search(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    vectors: Callable[[np.ndarray], np.ndarray],
+    rescore: int = 10,
+    exclude: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Search a binary index for rescore * k candidates by Hamming distance,
+    then re-rank them by exact squared L2 distance to their float vectors,
+    which vectors returns for a batch of ids (NaN rows for unknown ids).
+    Only the candidates' vectors are read, so they can stay on disk.
+    Ids in exclude are never returned; faiss can't filter binary searches,
+    so enough extra candidates are fetched to make up for them.
+    Returns (distances, ids) like Index.search, padded with inf and -1
+    """
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    candidates = rescore * k
+    fetch = candidates
+    if exclude is not None and len(exclude):
+        fetch += len(exclude)
+    fetch = max(1, min(fetch, index.ntotal))
+
+    distances = np.full((len(queries), k), np.inf, dtype="float32")
+    labels = np.full((len(queries), k), -1, dtype="int64")
+    if index.ntotal == 0:
+        return distances, labels
+
+    _, found = index.search(queries, fetch)
+    rows = []
+    for ids in found:
+        ids = ids[ids >= 0]
+        if exclude is not None and len(exclude):
+            ids = ids[~np.isin(ids, exclude)]
+        rows.append(ids[:candidates])
+
+    # One lookup for every query's candidates
+    all_ids = np.concatenate(rows)
+    all_vectors = np.asarray(vectors(all_ids), dtype="float32")
+    splits = np.cumsum([len(ids) for ids in rows])[:-1]
+
+    for row, (query, ids, candidate_vectors) in enumerate(
+        zip(queries, rows, np.split(all_vectors, splits))
+    ):
+        scores = ((candidate_vectors - query) ** 2).sum(axis=1)
+        known = ~np.isnan(scores)
+        ids, scores = ids[known], scores[known]
+
+        best = np.argsort(scores, kind="stable")[:k]
+        distances[row, : len(best)] = scores[best]
+        labels[row, : len(best)] = ids[best]
+
+    return distances, labels
@@ -0,0 +1,168 @@
+"""
+Recall / latency / memory benchmark for the ANN index and storage types in
+ann_index.
+
+Run from datasources/ so the local faiss.py doesn't shadow the faiss package:
+
+    python -m sample_faiss.bench_ann --embeddings vectors.npy --types ivf hnsw
+    python -m sample_faiss.bench_ann --embeddings vectors.npy --types flat \
+        --storage float32 float16 int8 binary
+
+Without --embeddings, clustered synthetic data is generated. The float32
+flat index is used as ground truth, and recall@k is the fraction of the
+true k nearest neighbours each index returns. Memory is the size of the
+serialized index, which is what a worker maps or loads. Binary indexes also
+read the rescored candidates' float vectors, which stay on disk.
+"""
+
+import argparse
+import time
+from functools import partial
+
+import faiss
+import numpy as np
+
+from sample_faiss.ann_index import (
+    INDEX_TYPES,
+    STORAGE_TYPES,
+    build_index,
+    index_spec,
+    is_binary,
+    rescored_search,
+    search_parameters,
+)
+
+
+def synthetic_embeddings(n: int, d: int, clusters: int = 100, seed: int = 0):
+    """Unit-norm vectors scattered around random centres, which is closer to
+    real sentence embeddings than uniform noise
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, d)).astype("float32")
+    points = centres[rng.integers(clusters, size=n)]
+    points += 0.5 * rng.standard_normal((n, d)).astype("float32")
+    faiss.normalize_L2(points)
+    return points
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def timed_search(index, queries, k, params):
+    start = time.perf_counter()
+    _, found = index.search(queries, k, params=params)
+    return found, time.perf_counter() - start
+
+
+def timed_rescored_search(index, queries, k, vectors, rescore):
+    start = time.perf_counter()
+    _, found = rescored_search(index, queries, k, vectors.__getitem__, rescore)
+    return found, time.perf_counter() - start
+
+
+def index_bytes(index) -> int:
+    return len(faiss.serialize_index(index))
+
+
+def report(
+    label: str, setting: str, recall: float, elapsed: float, queries: int, nbytes: int
+):
+    print(
+        f"{label:<14} {setting:<14} recall={recall:.3f} "
+        f"{1000 * elapsed / queries:8.3f} ms/q {queries / elapsed:10.0f} QPS "
+        f"{nbytes / 2**20:9.1f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN recall / latency benchmark")
+    parser.add_argument("--embeddings", help=".npy file of float32 vectors")
+    parser.add_argument("-n", type=int, default=100_000)
+    parser.add_argument("-d", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES[1:]))
+    parser.add_argument("--storage", nargs="+", default=["float32"])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 4, 10, 20])
+    args = parser.parse_args()
+
+    if args.embeddings:
+        data = np.load(args.embeddings).astype("float32")
+    else:
+        data = synthetic_embeddings(args.n + args.queries, args.d)
+
+    # Hold out the queries so they aren't trivially their own neighbour
+    base, queries = data[: -args.queries], data[-args.queries :]
+    n, d = base.shape
+    print(f"{n} vectors, d={d}, {len(queries)} queries, k={args.k}")
+
+    flat = build_index(base, "Flat")
+    truth, elapsed = timed_search(flat, queries, args.k, None)
+    report("flat", "", 1.0, elapsed, len(queries), index_bytes(flat))
+
+    built = {"Flat"}
+    for index_type in args.types:
+        for storage in args.storage:
+            spec = index_spec(index_type, n, d, storage)
+            # e.g. every index type stores binary codes the same way
+            if spec in built:
+                continue
+            built.add(spec)
+
+            label = index_type if storage == "float32" else f"{index_type}/{storage}"
+            start = time.perf_counter()
+            index = build_index(base, spec)
+            print(f"{label:<14} built {spec} in {time.perf_counter() - start:.1f}s")
+
+            if is_binary(index):
+                sweep = [
+                    (
+                        f"rescore={r}",
+                        partial(timed_rescored_search, vectors=base, rescore=r),
+                    )
+                    for r in args.rescore
+                ]
+            elif "HNSW" in spec:
+                sweep = [
+                    (
+                        f"efSearch={ef}",
+                        partial(
+                            timed_search,
+                            params=search_parameters(index, ef_search=ef),
+                        ),
+                    )
+                    for ef in args.ef_search
+                ]
+            elif "IVF" in spec:
+                sweep = [
+                    (
+                        f"nprobe={p}",
+                        partial(
+                            timed_search, params=search_parameters(index, nprobe=p)
+                        ),
+                    )
+                    for p in args.nprobe
+                ]
+            else:
+                sweep = [("", partial(timed_search, params=None))]
+
+            nbytes = index_bytes(index)
+            for setting, search in sweep:
+                found, elapsed = search(index, queries, args.k)
+                report(
+                    label,
+                    setting,
+                    recall_at_k(found, truth),
+                    elapsed,
+                    len(queries),
+                    nbytes,
+                )
+
+
+if __name__ == "__main__":
+    main()
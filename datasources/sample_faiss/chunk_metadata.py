@@ -0,0 +1,144 @@
+"""
+Columnar metadata sidecar for a FAISS index, keyed by stable chunk ids.
+
+Chunk ids are a hash of (repo, path, chunk offset), so they don't change when
+the index is rebuilt or the source directory is listed in a different order.
+The sidecar is a directory holding the sorted ids and offsets as .npy arrays
+and one chunk store per string column, all memory-mapped. Row i of every
+column belongs to ids[i], so a batch of ids is resolved with a single
+vectorised search over the id column.
+
+Indexes that store compressed codes can keep the float32 embeddings in the
+sidecar too, as a vectors.npy column, to re-score their candidates.
+"""
+
+import hashlib
+import os
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from models.chunk import Chunk
+from vdb.chunk_store import ChunkStore, write_chunk_store
+
+STRING_COLUMNS = ("text", "url", "repo", "path")
+
+# faiss uses -1 for "no result", so keep ids positive
+ID_MASK = (1 << 63) - 1
+
+
+def chunk_id(repo: str, path: str, offset: int) -> int:
+    """Stable 63-bit id for the chunk starting at offset in repo/path"""
+    key = f"{repo}\0{path}\0{offset}".encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "little") & ID_MASK
+
+
+def _save_array(filename: str, array: np.ndarray) -> None:
+    tmp_filename = f"{filename}.tmp{os.getpid()}.npy"
+    np.save(tmp_filename, array)
+    os.replace(tmp_filename, filename)
+
+
+def write_chunk_vectors(dirname: str, vectors: Optional[np.ndarray]) -> None:
+    """Write the embeddings column, one row per sidecar row, or remove it
+    if vectors is None
+    """
+    filename = os.path.join(dirname, "vectors.npy")
+    if vectors is not None:
+        _save_array(filename, np.ascontiguousarray(vectors, dtype="float32"))
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+
+def write_chunk_metadata(
+    dirname: str, records: Sequence[Chunk], vectors: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Write records, and optionally their embeddings in the same order, to
+    the sidecar directory dirname and return their chunk ids, in the same
+    order as records
+    """
+    ids = np.array(
+        [chunk_id(r.repo, r.path, r.offset) for r in records], dtype="int64"
+    )
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    if len(sorted_ids) > 1 and (np.diff(sorted_ids) == 0).any():
+        raise ValueError("Duplicate (repo, path, offset) in chunk records")
+
+    os.makedirs(dirname, exist_ok=True)
+
+    for column in STRING_COLUMNS:
+        write_chunk_store(
+            os.path.join(dirname, f"{column}.chunks"),
+            (getattr(records[i], column) for i in order),
+        )
+    _save_array(
+        os.path.join(dirname, "offset.npy"),
+        np.array([records[i].offset for i in order], dtype="int64"),
+    )
+    write_chunk_vectors(
+        dirname, None if vectors is None else np.asarray(vectors)[order]
+    )
+    # Written last, so a sidecar with an ids file is complete
+    _save_array(os.path.join(dirname, "ids.npy"), sorted_ids)
+
+    return ids
+
+
+class ChunkMetadata:
+    """Read-only view of a sidecar directory written by write_chunk_metadata"""
+
+    def __init__(self, dirname: str) -> None:
+        self.ids = np.load(os.path.join(dirname, "ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(dirname, "offset.npy"), mmap_mode="r")
+        self.columns = {
+            column: ChunkStore(os.path.join(dirname, f"{column}.chunks"))
+            for column in STRING_COLUMNS
+        }
+        self.vectors = None
+        vectors_filename = os.path.join(dirname, "vectors.npy")
+        if os.path.exists(vectors_filename):
+            self.vectors = np.load(vectors_filename, mmap_mode="r")
+
+        lengths = [len(store) for store in self.columns.values()]
+        if self.vectors is not None:
+            lengths.append(len(self.vectors))
+        if any(length != len(self.ids) for length in lengths):
+            raise ValueError(f"Columns in {dirname} have different lengths")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows(self, ids: Iterable[int]) -> np.ndarray:
+        """Row of each id in the sidecar, or -1 if it isn't there"""
+        ids = np.fromiter(ids, dtype="int64")
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype="int64")
+
+        rows = np.searchsorted(self.ids, ids)
+        rows[rows == len(self.ids)] = 0
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def record(self, row: int) -> Chunk:
+        return Chunk(
+            *(self.columns[column][row] for column in STRING_COLUMNS),
+            int(self.offsets[row]),
+        )
+
+    def lookup(self, ids: Iterable[int]) -> list[Optional[Chunk]]:
+        """Records for a batch of ids, with None for unknown ids"""
+        return [None if row < 0 else self.record(row) for row in self.rows(ids)]
+
+    def embeddings(self, ids: Iterable[int]) -> np.ndarray:
+        """Stored embeddings for a batch of ids, with NaN rows for unknown
+        ids. Only the rows asked for are read from disk
+        """
+        if self.vectors is None:
+            raise ValueError("No embeddings are stored with this metadata")
+
+        rows = self.rows(ids)
+        found = rows >= 0
+        embeddings = np.full((len(rows), self.vectors.shape[1]), np.nan, "float32")
+        embeddings[found] = self.vectors[rows[found]]
+        return embeddings
@@ -0,0 +1,78 @@
+"""
+Compact, memory-mapped store for chunk texts.
+
+The file is a small header, an offset table of n + 1 little-endian uint64s
+and a single UTF-8 blob holding every text back to back. Opening it only
+maps the file, so every worker shares the same page cache and nothing is
+read until a chunk is actually looked up.
+"""
+
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator
+
+import numpy as np
+
+MAGIC = b"CHNK"
+VERSION = 1
+# magic, version, number of chunks
+HEADER = struct.Struct("<4sIQ")
+
+
+def write_chunk_store(filename: str, texts: Iterable[str]) -> int:
+    """Write texts to filename in chunk store format and return how many
+    were written. The file is written alongside and renamed into place, so
+    readers never see a partial store
+    """
+    offsets = [0]
+    blob = bytearray()
+    for text in texts:
+        blob += text.encode("utf-8")
+        offsets.append(len(blob))
+
+    tmp_filename = f"{filename}.tmp{os.getpid()}"
+    with open(tmp_filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(offsets) - 1))
+        f.write(np.array(offsets, dtype="<u8").tobytes())
+        f.write(blob)
+
+    os.replace(tmp_filename, filename)
+    return len(offsets) - 1
+
+
+class ChunkStore:
+    """Read-only, list-like view of a chunk store file"""
+
+    def __init__(self, filename: str) -> None:
+        with open(filename, "rb") as f:
+            # mmap can't map an empty file, and a valid store is never empty
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{filename} is not a version {VERSION} chunk store")
+
+        self._n = n
+        self._offsets = np.frombuffer(
+            self._mmap, dtype="<u8", count=n + 1, offset=HEADER.size
+        )
+        self._blob_start = HEADER.size + 8 * (n + 1)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(f"chunk {i} out of range for store of {self._n}")
+
+        start = self._blob_start + int(self._offsets[i])
+        end = self._blob_start + int(self._offsets[i + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._n):
+            yield self[i]
@@ -0,0 +1,43 @@
+"""
+The modules here are meant to be copied into backend/src/vdb, so the tests
+load them under the names they are installed with (vdb.ann_index,
+vdb.chunk_metadata, ...) next to the backend's models and vdb packages.
+"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND_SRC = os.path.abspath(os.path.join(HERE, "..", "..", "backend", "src"))
+
+# python -m pytest puts the working directory on sys.path, where faiss.py
+# would shadow the faiss package
+sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != HERE]
+if BACKEND_SRC not in sys.path:
+    sys.path.insert(0, BACKEND_SRC)
+
+
+def install(name: str):
+    """Import the sample module name.py as vdb.name"""
+    spec = importlib.util.spec_from_file_location(
+        f"vdb.{name}", os.path.join(HERE, f"{name}.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# In dependency order
+for name in ("chunk_store", "ann_index", "chunk_metadata"):
+    install(name)
+
+
+@pytest.fixture(scope="session")
+def vdb_faiss():
+    """vdb.faiss, which needs sentence-transformers to import"""
+    pytest.importorskip("sentence_transformers")
+    return install("faiss")
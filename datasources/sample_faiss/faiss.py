@@ -1,21 +1,106 @@
 from datetime import datetime
 import logging
+import threading
+from typing import Iterable, NamedTuple, Optional, Sequence
+from models.chunk import Chunk
+from models.context import Context
+from vdb.ann_index import (
+    build_index,
+    index_spec,
+    is_binary,
+    rescored_search,
+    search_parameters,
+)
+from vdb.chunk_metadata import (
+    ChunkMetadata,
+    chunk_id,
+    write_chunk_metadata,
+    write_chunk_vectors,
+)
 from vdb.vdb import VDB
 import faiss
 import os
 from sentence_transformers import SentenceTransformer
-from tqdm import tqdm as tqdm
 
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+
+class IndexOverlay(NamedTuple):
+    """Changes made since the index on disk was last compacted. It is
+    replaced as a whole on every update, so searches never need a lock
+    """
+
+    # New and updated chunks, searched alongside the main index
+    delta: Optional[faiss.IndexIDMap2] = None
+    chunks: dict[int, Chunk] = {}
+    # Ids in the main index that were deleted or replaced
+    tombstones: np.ndarray = np.empty(0, dtype="int64")
+    # Excludes the tombstones from searches. faiss doesn't reference count
+    # selectors, so the inner batch selector is kept alive here too
+    selectors: tuple = (None, None)
+
+    @property
+    def pending(self) -> int:
+        return len(self.chunks) + len(self.tombstones)
+
+
+def tombstone_overlay(
+    delta: Optional[faiss.IndexIDMap2], chunks: dict[int, Chunk], tombstones: np.ndarray
+) -> IndexOverlay:
+    selectors = (None, None)
+    if len(tombstones):
+        batch = faiss.IDSelectorBatch(tombstones)
+        selectors = (faiss.IDSelectorNot(batch), batch)
+    return IndexOverlay(delta, chunks, tombstones, selectors)
+
 
 class FaissIndex(VDB):
-    def __init__(self, index_filename: str = "../sandbox/example_faiss.faiss") -> None:
+    def __init__(
+        self,
+        index_filename: str = "../sandbox/example_faiss.faiss",
+        index_type: Optional[str] = None,
+        metadata_dirname: Optional[str] = None,
+        storage: Optional[str] = None,
+    ) -> None:
+        """index_type is one of flat, ivf, ivfpq, hnsw or opq, or a faiss
+        index_factory string, and storage how its vectors are kept: float32,
+        float16, int8 or binary. Both only apply when building a new index.
+        Binary indexes keep only sign bits in the index, so they also store
+        the float32 embeddings in the sidecar to re-score FAISS_RESCORE times
+        k candidates from disk.
+        The index is labelled with stable chunk ids, which are resolved to
+        text and source metadata through a sidecar directory (by default
+        next to the index). Both are memory-mapped, and are written out on
+        first start so later workers can share them.
+
+        index_document and delete_chunks are applied to an in-memory overlay
+        and folded into the files on disk by compact(), which runs on its own
+        once the overlay holds FAISS_COMPACT_THRESHOLD times the index size.
+        Other processes see the changes after they next load the index
+        """
         load_logger = logging.getLogger(__name__)
 
+        self.index_type = index_type or os.environ.get("FAISS_INDEX_TYPE", "flat")
+        self.storage = storage or os.environ.get("FAISS_STORAGE", "float32")
+        # Defaults for the per-query search parameters
+        self.nprobe = int(os.environ.get("FAISS_NPROBE", "16"))
+        self.ef_search = int(os.environ.get("FAISS_EF_SEARCH", "64"))
+        self.rescore = int(os.environ.get("FAISS_RESCORE", "10"))
+        self.train_sample = int(os.environ.get("FAISS_TRAIN_SAMPLE", "100000"))
+        self.compact_threshold = float(
+            os.environ.get("FAISS_COMPACT_THRESHOLD", "0.1")
+        )
+
+        self.index_filename = index_filename
+        self._overlay = IndexOverlay()
+        # Serialises updates; searches read self._overlay without it
+        self._update_lock = threading.Lock()
+
         load_model_start = datetime.now()
 
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.model = SentenceTransformer(self.model_id)
 
         load_model_end = datetime.now()
 
@@ -24,54 +109,320 @@ class FaissIndex(VDB):
         load_logger.debug("Getting contexts")
         context_start = datetime.now()
 
-        contexts = []
-
-        example_path = "./vdb/example_sources"
-
-        for filename in os.listdir(example_path):
-            file_path = os.path.join(example_path, filename)
-            if os.path.isfile(file_path):
-                with open(file_path) as f:
-                    contexts.append(f.read())
-
-        self.contexts = contexts
+        self.metadata_dirname = metadata_dirname or f"{index_filename}.meta"
+        rebuilt_metadata = False
+        try:
+            self.metadata = ChunkMetadata(self.metadata_dirname)
+        except (OSError, ValueError) as _:
+            load_logger.info("Could not read chunk metadata, creating it")
+            write_chunk_metadata(self.metadata_dirname, self.read_example_sources())
+            self.metadata = ChunkMetadata(self.metadata_dirname)
+            rebuilt_metadata = True
 
         context_end = datetime.now()
 
         load_logger.debug(f"Loaded contexts in {context_end - context_start}")
 
-        try:
-            self.index = self.load_index(index_filename)
-            # print("faiss DB successfully loaded")
-            load_logger.info("faiss DB successfully loaded")
-        except Exception as _:
-            # print("Could not read faiss DB, creating a new one")
-            load_logger.info("Could not read faiss DB, creating a new one")
-            embeddings = self.model.encode(contexts)
+        self.index = None
+        # An index saved before the metadata was rebuilt may not match it
+        if not rebuilt_metadata:
+            try:
+                self.index = self.load_index(index_filename)
+                # print("faiss DB successfully loaded")
+                load_logger.info("faiss DB successfully loaded")
+            except Exception as _:
+                # print("Could not read faiss DB, creating a new one")
+                load_logger.info("Could not read faiss DB, creating a new one")
+
+        if (
+            self.index is not None
+            and is_binary(self.index)
+            and self.metadata.vectors is None
+        ):
+            load_logger.info("No embeddings to re-score binary codes, rebuilding")
+            self.index = None
+
+        if self.index is None:
+            embeddings = self.model.encode(list(self.metadata.columns["text"]))
             embeddings_np = np.array(embeddings).astype("float32")
-            d = embeddings_np.shape[1]
-            self.index = faiss.IndexFlatL2(d)
-            self.index.add(embeddings_np)
+            spec = index_spec(self.index_type, *embeddings_np.shape, self.storage)
+            load_logger.info(f"Building {spec} index")
+            self.index = build_index(
+                embeddings_np,
+                spec,
+                train_sample=self.train_sample,
+                ids=np.asarray(self.metadata.ids),
+            )
+            if is_binary(self.index):
+                # Encoded in sidecar row order, so they line up already
+                write_chunk_vectors(self.metadata_dirname, embeddings_np)
+                self.metadata = ChunkMetadata(self.metadata_dirname)
+            try:
+                self.save_faiss(index_filename)
+            except RuntimeError as e:
+                load_logger.warning(f"Could not save faiss DB: {e}")
+        elif self.index.ntotal != len(self.metadata):
+            load_logger.warning(
+                f"faiss DB has {self.index.ntotal} vectors but the metadata has "
+                f"{len(self.metadata)} chunks; unknown ids will be skipped"
+            )
+
+    @property
+    def model_id(self) -> str:
+        return "all-MiniLM-L6-v2"
+
+    def get_nearest(self, k: int, query: str) -> list[Context]:
+        return self.get_nearest_by_vector(k, self.embed_query(query))
+
+    def embed_query(self, query: str) -> list[float]:
+        return self.model.encode([query])[0].tolist()
+
+    def get_nearest_batch(self, k: int, queries: Sequence[str]) -> list[list[Context]]:
+        return self.get_nearest_by_vectors(k, self.embed_queries(queries))
+
+    def embed_queries(self, queries: Sequence[str]) -> list[list[float]]:
+        return self.model.encode(list(queries)).tolist()
 
-    def get_nearest(self, k: int, query: str):
-        new_embedding = self.model.encode([query])
-        new_embedding = new_embedding.reshape((1, new_embedding.shape[1]))
+    def get_nearest_by_vector(
+        self,
+        k: int,
+        vector: list[float],
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> list[Context]:
+        """nprobe / ef_search override the defaults for this query only,
+        trading latency for recall on IVF and HNSW indexes
+        """
+        return self.get_nearest_by_vectors(k, [vector], nprobe, ef_search)[0]
 
-        _, indices = self.index.search(new_embedding, k)
+    def get_nearest_by_vectors(
+        self,
+        k: int,
+        vectors: Sequence[list[float]],
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> list[list[Context]]:
+        """Searches every query in one call over the stacked vectors"""
+        if len(vectors) == 0:
+            return []
+        queries = np.array(vectors, dtype="float32").reshape((len(vectors), -1))
+
+        # Read the overlay before the index, so a compaction in between at
+        # worst returns a chunk from both, which is deduplicated below
+        overlay = self._overlay
+        index, metadata = self.index, self.metadata
+
+        if is_binary(index):
+            distances, indices = rescored_search(
+                index,
+                queries,
+                k,
+                metadata.embeddings,
+                rescore=self.rescore,
+                exclude=overlay.tombstones,
+            )
+        else:
+            params = search_parameters(
+                index,
+                nprobe or self.nprobe,
+                ef_search or self.ef_search,
+                sel=overlay.selectors[0],
+            )
+            distances, indices = index.search(queries, k, params=params)
+
+        if overlay.delta is not None and overlay.delta.ntotal > 0:
+            delta_distances, delta_indices = overlay.delta.search(queries, k)
+            distances = np.hstack([distances, delta_distances])
+            indices = np.hstack([indices, delta_indices])
+            order = np.argsort(distances, axis=1, kind="stable")
+            indices = np.take_along_axis(indices, order, axis=1)
+
+        ids = [
+            list(dict.fromkeys(int(i) for i in row if i >= 0))[:k] for row in indices
+        ]
+        # One metadata lookup for every query
+        records = iter(
+            metadata.lookup(i for row in ids for i in row if i not in overlay.chunks)
+        )
 
         results = []
-        print(indices)
-        for index in indices[0]:
-            results.append(self.contexts[index])
+        for row in ids:
+            contexts = []
+            for i in row:
+                record = overlay.chunks[i] if i in overlay.chunks else next(records)
+                if record is not None:
+                    contexts.append(Context(record.text, record.url))
+            results.append(contexts)
 
         return results
 
-    def index_document(self):
-        raise NotImplementedError
+    def index_document(self, chunks: Sequence[Chunk]) -> int:
+        # A later chunk with the same id replaces an earlier one
+        by_id = {chunk_id(c.repo, c.path, c.offset): c for c in chunks}
+        if not by_id:
+            return 0
+
+        ids = np.fromiter(by_id.keys(), dtype="int64", count=len(by_id))
+        embeddings = self.model.encode([c.text for c in by_id.values()])
+        embeddings_np = np.array(embeddings).astype("float32")
+
+        with self._update_lock:
+            overlay = self._overlay
+
+            if overlay.delta is None:
+                delta = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings_np.shape[1]))
+            else:
+                delta = faiss.clone_index(overlay.delta)
+                delta.remove_ids(ids)
+            delta.add_with_ids(embeddings_np, ids)
+
+            replaced = ids[self.metadata.rows(ids) >= 0]
+            self._overlay = tombstone_overlay(
+                delta,
+                {**overlay.chunks, **by_id},
+                np.union1d(overlay.tombstones, replaced),
+            )
+            self._compact_if_needed()
+
+        return len(by_id)
+
+    def delete_chunks(self, chunks: Iterable[Chunk]) -> int:
+        ids = np.unique(
+            np.fromiter((chunk_id(c.repo, c.path, c.offset) for c in chunks), "int64")
+        )
+
+        with self._update_lock:
+            overlay = self._overlay
+
+            in_delta = [i for i in ids.tolist() if i in overlay.chunks]
+            in_main = ids[self.metadata.rows(ids) >= 0]
+            newly_deleted = np.setdiff1d(in_main, overlay.tombstones)
+            # A chunk replaced in the overlay is also tombstoned in the main
+            # index, so only count it once
+            removed = len(np.union1d(newly_deleted, in_delta))
+            if removed == 0:
+                return 0
+
+            delta = overlay.delta
+            if in_delta:
+                delta = faiss.clone_index(delta)
+                delta.remove_ids(np.array(in_delta, dtype="int64"))
+
+            deleted = set(in_delta)
+            self._overlay = tombstone_overlay(
+                delta,
+                {i: c for i, c in overlay.chunks.items() if i not in deleted},
+                np.union1d(overlay.tombstones, newly_deleted),
+            )
+            self._compact_if_needed()
+
+        return removed
+
+    def compact(self) -> None:
+        """Fold pending updates and deletes into the index and metadata on
+        disk, then reload them
+        """
+        with self._update_lock:
+            self._compact()
+
+    def _compact_if_needed(self) -> None:
+        if self._overlay.pending > self.compact_threshold * max(self.index.ntotal, 1):
+            self._compact()
+
+    def _compact(self) -> None:
+        compact_logger = logging.getLogger(__name__)
+        overlay = self._overlay
+        if overlay.pending == 0:
+            return
+
+        compact_start = datetime.now()
+
+        delta_ids = np.fromiter(overlay.chunks.keys(), dtype="int64")
+        dropped = np.union1d(overlay.tombstones, delta_ids)
+
+        # A writable copy, since the loaded index is memory-mapped
+        try:
+            index = faiss.clone_index(self.index)
+        except RuntimeError as _:
+            # mmap'd IVF inverted lists can't be cloned, only re-read
+            index = faiss.read_index(self.index_filename)
+        try:
+            index.remove_ids(dropped)
+        except RuntimeError as _:
+            # HNSW can't remove vectors, so rebuild it from the survivors
+            kept = np.setdiff1d(np.asarray(self.metadata.ids), dropped)
+            vectors = np.vstack([index.reconstruct(int(i)) for i in kept])
+            index = build_index(
+                vectors,
+                index_spec(self.index_type, *vectors.shape, self.storage),
+                train_sample=self.train_sample,
+                ids=kept,
+            )
+
+        delta_vectors = np.empty((0, index.d), dtype="float32")
+        if len(delta_ids):
+            delta_vectors = np.vstack(
+                [overlay.delta.reconstruct(int(i)) for i in delta_ids]
+            )
+            index.add_with_ids(delta_vectors, delta_ids)
+
+        kept_rows = np.flatnonzero(~np.isin(self.metadata.ids, dropped))
+        records = [self.metadata.record(row) for row in kept_rows]
+        records.extend(overlay.chunks.values())
+
+        vectors = None
+        if is_binary(index):
+            vectors = np.vstack([self.metadata.vectors[kept_rows], delta_vectors])
+
+        # Swap the metadata in before the index, so every id a search gets
+        # from the new index can be resolved
+        write_chunk_metadata(self.metadata_dirname, records, vectors)
+        self.metadata = ChunkMetadata(self.metadata_dirname)
+
+        self.index = index
+        try:
+            self.save_faiss(self.index_filename)
+            self.index = self.load_index(self.index_filename)
+        except RuntimeError as e:
+            compact_logger.warning(f"Could not save faiss DB: {e}")
+
+        self._overlay = IndexOverlay()
+
+        compact_end = datetime.now()
+
+        compact_logger.info(
+            f"Compacted {overlay.pending} change(s) into {self.index.ntotal} "
+            f"vectors in {compact_end - compact_start}"
+        )
 
     def save_faiss(self, filename: str):
-        print(f"Saving index {self.index}")
-        faiss.write_index(self.index, filename)
+        logger.debug(f"Saving index {self.index} to {filename}")
+        # Written alongside and renamed into place, since the old file may be
+        # memory-mapped by this or another process
+        tmp_filename = f"{filename}.tmp{os.getpid()}"
+        faiss.write_index(self.index, tmp_filename)
+        os.replace(tmp_filename, filename)
 
     def load_index(self, filename: str):
-        return faiss.read_index(filename)
+        try:
+            return faiss.read_index(filename, faiss.IO_FLAG_MMAP)
+        except RuntimeError as _:
+            # Older faiss builds can only mmap IVF inverted lists
+            if not os.path.isfile(filename):
+                raise
+            return faiss.read_index(filename)
+
+    def read_example_sources(self) -> list[Chunk]:
+        records = []
+
+        example_path = "./vdb/example_sources"
+
+        for filename in os.listdir(example_path):
+            file_path = os.path.join(example_path, filename)
+            if os.path.isfile(file_path):
+                with open(file_path) as f:
+                    records.append(
+                        Chunk(f.read(), file_path, "example_sources", filename, 0)
+                    )
+
+        return records
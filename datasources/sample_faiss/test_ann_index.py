@@ -0,0 +1,49 @@
+# test_ann_index.py
+import numpy as np
+import pytest
+
+from vdb.ann_index import (
+    MIN_ANN_VECTORS,
+    MIN_PQ_VECTORS,
+    build_index,
+    index_spec,
+    pq_bits,
+)
+
+
+def test_pq_floor_is_enough_for_8_bit_codebooks():
+    assert MIN_PQ_VECTORS >= 256 * 39
+    assert pq_bits(MIN_PQ_VECTORS) == 8
+    assert pq_bits(MIN_PQ_VECTORS - 1) == 7
+    assert pq_bits(MIN_ANN_VECTORS) == 4
+
+
+@pytest.mark.parametrize(
+    "index_type,n,expected",
+    [
+        ("ivfpq", 1000, "IVF25,PQ48x4"),
+        ("opq", 1000, "IVF25,PQ48x4"),
+        ("ivfpq", 5000, "IVF128,PQ48x7"),
+        ("ivfpq", MIN_PQ_VECTORS, "IVF256,PQ48"),
+        ("opq", MIN_PQ_VECTORS, "OPQ48,IVF256,PQ48"),
+        ("ivf", 1000, "IVF25,Flat"),
+        ("hnsw", 999, "Flat"),
+    ],
+)
+def test_index_spec_sizes_pq_to_the_training_set(index_type, n, expected):
+    assert index_spec(index_type, n, 384) == expected
+
+
+def test_factory_strings_are_passed_through():
+    assert index_spec("HNSW8,Flat", 10, 384) == "HNSW8,Flat"
+    assert index_spec("IVF16,SQfp16", 10, 384, "int8") == "IVF16,SQfp16"
+
+
+@pytest.mark.parametrize("index_type", ["ivfpq", "opq"])
+def test_small_pq_indexes_train_without_warnings(capfd, index_type):
+    embeddings = np.random.default_rng(0).standard_normal((1200, 32), "float32")
+
+    index = build_index(embeddings, index_spec(index_type, *embeddings.shape))
+
+    assert index.ntotal == 1200
+    assert "WARNING clustering" not in capfd.readouterr().err
@@ -0,0 +1,151 @@
+# test_faiss.py
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from models.chunk import Chunk
+from vdb.chunk_metadata import write_chunk_metadata
+
+DIM = 32
+
+
+class FakeModel:
+    """Bag of hashed words, so a chunk's own text is its nearest query"""
+
+    def __init__(self, model_id: str) -> None:
+        self.model_id = model_id
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), DIM), dtype="float32")
+        for row, text in enumerate(texts):
+            for word in text.split():
+                vectors[row, zlib.crc32(word.encode()) % DIM] += 1.0
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def chunk(name: str, text: str) -> Chunk:
+    return Chunk(text, f"https://example.com/{name}", "repo", f"{name}.md", 0)
+
+
+ALPHA = chunk("alpha", "alpha apple anchor")
+BRAVO = chunk("bravo", "bravo banana bridge")
+CHARLIE = chunk("charlie", "charlie cherry castle")
+DELTA = chunk("delta", "delta date desert")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    metadata_dirname = str(tmp_path / "index.faiss.meta")
+    write_chunk_metadata(metadata_dirname, [ALPHA, BRAVO, CHARLIE, DELTA])
+    return str(tmp_path / "index.faiss"), metadata_dirname
+
+
+@pytest.fixture
+def open_index(vdb_faiss, monkeypatch, paths):
+    monkeypatch.setattr(vdb_faiss, "SentenceTransformer", FakeModel)
+    monkeypatch.setenv("FAISS_COMPACT_THRESHOLD", "10")
+
+    def open_index(index_type="flat", storage="float32"):
+        index_filename, metadata_dirname = paths
+        return vdb_faiss.FaissIndex(
+            index_filename, index_type, metadata_dirname, storage
+        )
+
+    return open_index
+
+
+def nearest(index, text: str, k: int = 1) -> list[str]:
+    return [context.content for context in index.get_nearest(k, text)]
+
+
+# HNSW can't remove vectors, so compact() rebuilds it instead
+@pytest.mark.parametrize(
+    "index_type,storage",
+    [("flat", "float32"), ("flat", "binary"), ("HNSW8,Flat", "float32")],
+)
+def test_index_delete_search_compact_reload(open_index, paths, index_type, storage):
+    index = open_index(index_type, storage)
+    assert index.index.ntotal == 4
+    assert nearest(index, BRAVO.text) == [BRAVO.text]
+
+    echo = chunk("echo", "echo elder engine")
+    new_bravo = BRAVO._replace(text="bravo blueberry bottle")
+    assert index.index_document([echo, new_bravo]) == 2
+    # Two new chunks, and the replaced bravo in the main index
+    assert index._overlay.pending == 3
+    assert nearest(index, echo.text) == [echo.text]
+    assert nearest(index, new_bravo.text) == [new_bravo.text]
+    assert BRAVO.text not in nearest(index, BRAVO.text, k=5)
+
+    assert index.delete_chunks([CHARLIE, echo]) == 2
+    # Already gone, so nothing more is removed
+    assert index.delete_chunks([CHARLIE]) == 0
+    remaining = sorted([ALPHA.text, new_bravo.text, DELTA.text])
+    assert sorted(nearest(index, CHARLIE.text, k=5)) == remaining
+
+    index.compact()
+    assert index._overlay.pending == 0
+    assert index.index.ntotal == 3
+    assert len(index.metadata) == 3
+    assert sorted(nearest(index, CHARLIE.text, k=5)) == remaining
+    assert nearest(index, new_bravo.text) == [new_bravo.text]
+
+    reloaded = open_index(index_type, storage)
+    assert reloaded.index.ntotal == 3
+    assert sorted(nearest(reloaded, ALPHA.text, k=5)) == remaining
+    assert nearest(reloaded, DELTA.text) == [DELTA.text]
+    assert not [
+        name for name in os.listdir(os.path.dirname(paths[0])) if ".tmp" in name
+    ]
+
+
+def test_searches_return_each_chunk_once(open_index):
+    index = open_index()
+
+    index.index_document([ALPHA._replace(text="alpha apple anchor again")])
+    # The replaced chunk matches in the main index too, but is tombstoned there
+    texts = nearest(index, ALPHA.text, k=4)
+
+    assert len(texts) == len(set(texts)) == 4
+    assert ALPHA.text not in texts
+
+
+def test_deleting_an_overlay_chunk_removes_it_from_the_delta(open_index):
+    index = open_index()
+    echo = chunk("echo", "echo elder engine")
+
+    index.index_document([echo])
+    assert index.delete_chunks([echo]) == 1
+
+    assert index._overlay.pending == 0
+    assert echo.text not in nearest(index, echo.text, k=5)
+
+
+def test_overlay_compacts_past_the_threshold(open_index, monkeypatch):
+    monkeypatch.setenv("FAISS_COMPACT_THRESHOLD", "0.5")
+    index = open_index()
+
+    index.index_document([chunk("echo", "echo elder engine")])
+    index.delete_chunks([ALPHA])
+    assert index._overlay.pending == 2
+
+    # 3 pending changes against 4 indexed vectors
+    index.delete_chunks([BRAVO])
+    assert index._overlay.pending == 0
+    assert index.index.ntotal == 3
+    assert sorted(nearest(index, DELTA.text, k=5)) == sorted(
+        [CHARLIE.text, DELTA.text, "echo elder engine"]
+    )
+
+
+def test_batched_search_matches_single_queries(open_index):
+    index = open_index()
+    index.index_document([chunk("echo", "echo elder engine")])
+    index.delete_chunks([CHARLIE])
+
+    queries = [ALPHA.text, CHARLIE.text, "echo elder engine"]
+    batched = index.get_nearest_batch(2, queries)
+
+    assert batched == [index.get_nearest(2, query) for query in queries]
@@ -23,12 +23,23 @@ const App: React.FC = () => {
 
   const fetchChatHistory = async () => {
     try {
-      const response = await apiFetch('/api/chat');
-      const data = await response.json();
+      // The chat list is paginated; follow next_cursor until every page is loaded
+      let loaded: IChatSession[] = [];
+      let cursor: string | null = null;
 
-      if (data && typeof data === "object" && 'chats' in data) {
-        setChats(data.chats);
-      }
+      do {
+        const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await apiFetch(`/api/chat${query}`);
+        const data = await response.json();
+
+        if (!(data && typeof data === "object" && 'chats' in data)) {
+          break;
+        }
+
+        loaded = [...loaded, ...data.chats];
+        setChats(loaded);
+        cursor = data.next_cursor ?? null;
+      } while (cursor);
     } catch (error) {
       console.error('Error fetching chat history:', error);
     }
@@ -129,6 +129,10 @@ function Chatbot({ messages, setMessages, chatId, setChatId, onUpdateSources, on
                   if (json.new_uuid) {
                     setChatId(json.new_uuid);
                   }
+                } else if (currentEvent === 'set_title') {
+                  if (json.title) {
+                    onRefreshChats();
+                  }
                 }
               } catch (e) {
                 console.error('Error parsing SSE data:', e);